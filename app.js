@@ -3,8 +3,10 @@ const express=require('express');
 const session = require('express-session');
 const app=express();
 const path=require('path');
-const port=8000;
+const port=process.env.PORT || 8000;
 const mongoose=require('mongoose');
+const { recognitionPool } = require('./utils/recognitionPool');
+const { registry, metricsHandler } = require('./utils/metrics');
 app.set('view engine','hbs');
 
 // Session configuration
@@ -27,6 +29,9 @@ app.get('/',(req,res,next)=>{
     res.render('index');
 })
 
+// Prometheus scrape endpoint: recognition counters, latency histograms and pool gauges
+app.get('/metrics', metricsHandler);
+
 const studentRouter=require('./routes/student');
 app.use('/student',studentRouter);
 
@@ -35,9 +40,12 @@ app.use('/teacher',teacherRouter);
 
 app.use('/api/teacher', teacherRouter);
 
-mongoose.connect('mongodb://127.0.0.1:27017/SmartAttendence').then(()=>{
+mongoose.connect(process.env.MONGO_URI || 'mongodb://127.0.0.1:27017/SmartAttendence').then(()=>{
     app.listen(port,()=>{
         console.log('db connected successfully');
+        // Warm the recognition workers before the first student opens the camera
+        recognitionPool.start();
+        registry.startFileExport();
         console.log(`Server Connected Successfully at ${port}`);
     })
 })
@@ -1,15 +1,9 @@
 const Student = require('../models/student');
 const ClassAccess = require('../models/classAccess');
 const MarkPresent = require('../models/markpresent');
-const { spawn } = require('child_process');
-const path = require('path');
-
-// Allow configuring Python path via environment variable
-// Prioritize conda environment Python for this project
-const PYTHON_PATH = process.env.PYTHON_PATH || 
-    '/opt/anaconda3/envs/project/bin/python3' ||
-    (process.platform === 'darwin' ? '/Users/krishna/.pyenv/shims/python3' : 'python3') ||
-    'python3';
+const { recognitionPool, frameFromRequest } = require('../utils/recognitionPool');
+const { createSession, getSession, consumeSession } = require('../utils/verificationSession');
+const { publishCheckIn } = require('../utils/attendanceFeed');
 
 module.exports.getSignUp = async (req, res, next) => {
     res.render('../views/student/signup');
@@ -43,8 +37,29 @@ module.exports.postSignUp = async (req, res, next) => {
 
         console.log('[Signup] Photo uploaded successfully:', req.file.path);
         
+        // Encode the reference face once now instead of on every recognition request
+        const enrollment = await recognitionPool.run({ op: 'enroll', url: req.file.path });
+        
+        // A face count means the photo itself was examined and is unusable
+        if (!enrollment.success && enrollment.faces !== undefined) {
+            console.error('[Signup] Photo rejected:', enrollment.error);
+            return res.status(400).send(`
+                <script>
+                    alert('${enrollment.error}. Please upload a clear photo of only your face.');
+                    window.history.back();
+                </script>
+            `);
+        }
+        
+        if (!enrollment.success) {
+            // Recognition will fall back to encoding the photo lazily
+            console.error('[Signup] Enrollment encoding failed:', enrollment.error);
+        }
+        
         await Student.create({
             photo: req.file.path,
+            faceEncoding: enrollment.success ? enrollment.encoding : undefined,
+            encodingModel: enrollment.success ? enrollment.modelVersion : undefined,
             rollNumber: parseInt(rollNumber),
             name,
             email,
@@ -227,7 +242,9 @@ module.exports.checkAccess = async (req, res, next) => {
 // NEW: Recognize single frame
 module.exports.recognizeFrame = async (req, res) => {
     try {
-        const { rollNumber, frame } = req.body;
+        // Raw JPEG uploads carry the roll number in the query string
+        const rollNumber = req.query.rollNumber || (req.body && req.body.rollNumber);
+        const frame = frameFromRequest(req);
         
         if (!rollNumber || !frame) {
             return res.json({ faceDetected: false });
@@ -239,85 +256,122 @@ module.exports.recognizeFrame = async (req, res) => {
             return res.json({ faceDetected: false });
         }
 
-        // Call Python with frame data - Add timeout to prevent hanging
-        const python = spawn(PYTHON_PATH, [
-            '-W', 'ignore::UserWarning',
-            path.join(__dirname, '../ml/compare_frame.py'),
-            student.photo,
-            frame
-        ]);
+        // Hand the frame to a warm worker instead of spawning a fresh interpreter
+        const parsed = await recognitionPool.run({
+            op: 'compare',
+            url: student.photo,
+            encoding: student.faceEncoding,
+            encodingModel: student.encodingModel,
+            track: String(student.rollNumber),
+            frame: frame
+        });
 
-        let result = '';
-        let hasResponded = false;
-        
-        // Set timeout for Python process (12 seconds max - increased for slower processing)
-        const processTimeout = setTimeout(() => {
-            if (!hasResponded) {
-                hasResponded = true;
-                python.kill('SIGKILL');
-                console.error('[Frame Recognition] Python process timeout - killing process');
-                res.json({ faceDetected: false, error: 'Process timeout' });
-            }
-        }, 12000);
+        // How fast and how large the next frame should be under the current load
+        parsed.pacing = recognitionPool.pacing();
 
-        python.stdout.on('data', (data) => {
-            result += data.toString();
-        });
+        // Queue full - tell the client to back off rather than letting it time out
+        if (parsed.busy) {
+            return res.status(503).set('Retry-After', '1').json(parsed);
+        }
 
-        // Suppress stderr warnings (only log real errors)
-        python.stderr.on('data', (data) => {
-            const errorMsg = data.toString();
-            // Only log if it's not the pkg_resources warning
-            if (!errorMsg.includes('pkg_resources is deprecated')) {
-                console.error('[Python stderr]', errorMsg);
-            }
-        });
+        // Only log successful matches to reduce console spam
+        if (parsed.matched) {
+            console.log('[Frame Recognition] Match:', parsed.confidence.toFixed(3));
+        } else if (parsed.error) {
+            console.error('[Frame Recognition] Python error:', parsed.error);
+        }
+        res.json(parsed);
 
-        python.on('close', (code) => {
-            if (hasResponded) return;
-            hasResponded = true;
-            clearTimeout(processTimeout);
-            
-            // Log non-zero exit codes
-            if (code !== 0) {
-                console.error(`[Frame Recognition] Python exited with code ${code}`);
-                console.error(`[Frame Recognition] Output: ${result.substring(0, 200)}`);
-            }
-            
-            try {
-                const rawOutput = result.trim().split('\n').pop();
-                if (!rawOutput) {
-                    console.error('[Frame Recognition] No output from Python script');
-                    res.json({ faceDetected: false, error: 'No output' });
-                    return;
-                }
-                const parsed = JSON.parse(rawOutput);
-                // Only log successful matches to reduce console spam
-                if (parsed.matched) {
-                    console.log('[Frame Recognition] Match:', parsed.confidence.toFixed(3));
-                } else if (parsed.error) {
-                    console.error('[Frame Recognition] Python error:', parsed.error);
-                }
-                res.json(parsed);
-            } catch (e) {
-                console.error('[Frame Recognition Parse Error]', e.message);
-                console.error('[Frame Recognition] Raw output:', result.substring(0, 500));
-                res.json({ faceDetected: false, error: 'Parse error' });
-            }
-        });
+    } catch (error) {
+        console.error('Frame recognition error:', error);
+        res.json({ faceDetected: false });
+    }
+};
+
+// Start a server-side verification session; frames are then posted to /verify-frame
+module.exports.startVerification = async (req, res) => {
+    try {
+        // A logged-in student can only verify themselves
+        const loggedIn = req.session && req.session.studentLoggedIn ? req.session.rollNumber : null;
+        const requested = parseInt(req.body && req.body.rollNumber);
+        if (loggedIn && requested && requested !== loggedIn) {
+            return res.status(403).json({ success: false, message: 'Roll number does not match the logged-in student' });
+        }
+        const rollNumber = loggedIn || requested;
+        if (!rollNumber) {
+            return res.json({ success: false, message: 'Roll number required' });
+        }
+
+        const student = await Student.findOne({ rollNumber: rollNumber });
+        if (!student || !student.photo) {
+            return res.json({ success: false, message: 'Student not found' });
+        }
 
-        python.on('error', (error) => {
-            if (hasResponded) return;
-            hasResponded = true;
-            clearTimeout(processTimeout);
-            console.error('[Frame Recognition] Python spawn error:', error.message);
-            console.error('[Frame Recognition] Python path:', PYTHON_PATH);
-            console.error('[Frame Recognition] Student photo URL:', student.photo);
-            res.json({ faceDetected: false, error: 'Process error: ' + error.message });
+        const session = createSession(rollNumber);
+        res.json({ success: true, session: session.view() });
+
+    } catch (error) {
+        console.error('Start verification error:', error);
+        res.json({ success: false, message: error.message });
+    }
+};
+
+// One camera frame of a verification session; the session accepts as soon as
+// the running mean of the matched embeddings is confident enough
+module.exports.verifyFrame = async (req, res) => {
+    try {
+        const session = getSession(req.query.session);
+        const frame = frameFromRequest(req);
+
+        if (!session) {
+            return res.json({ faceDetected: false, error: 'Verification session expired' });
+        }
+        if (session.status !== 'pending' || !frame) {
+            return res.json({ faceDetected: false, session: session.view() });
+        }
+
+        // Byte-identical frame: never counts as evidence and costs no recognition work
+        if (session.isReplay(frame)) {
+            console.log(`[Verification] Replayed frame ignored for ${session.rollNumber}`);
+            return res.json({ faceDetected: false, error: 'Replayed frame', session: session.view() });
+        }
+
+        const student = await Student.findOne({ rollNumber: session.rollNumber });
+        if (!student || !student.photo) {
+            return res.json({ faceDetected: false, session: session.view() });
+        }
+
+        const parsed = await recognitionPool.run({
+            op: 'compare',
+            url: student.photo,
+            encoding: student.faceEncoding,
+            encodingModel: student.encodingModel,
+            track: String(student.rollNumber),
+            aggregate: session.aggregate(),
+            frame: frame
         });
+        parsed.pacing = recognitionPool.pacing();
+
+        if (parsed.busy) {
+            return res.status(503).set('Retry-After', '1').json(Object.assign(parsed, { session: session.view() }));
+        }
+        if (parsed.error) {
+            console.error('[Verification] Python error:', parsed.error);
+        }
+
+        session.update(parsed);
+        if (session.status === 'accepted') {
+            console.log(`[Verification] Accepted ${session.rollNumber} after ${session.frames} frame(s):`,
+                session.aggregateConfidence.toFixed(3));
+        }
+
+        // The probe embedding stays on the server
+        delete parsed.encoding;
+        parsed.session = session.view();
+        res.json(parsed);
 
     } catch (error) {
-        console.error('Frame recognition error:', error);
+        console.error('Verify frame error:', error);
         res.json({ faceDetected: false });
     }
 };
@@ -325,46 +379,48 @@ module.exports.recognizeFrame = async (req, res) => {
 // NEW: Save attendance after recognition
 module.exports.saveAttendance = async (req, res) => {
     try {
-        const { rollNumber, confidence, subject, time, room } = req.body;
+        const { rollNumber, subject, time, room, sessionId } = req.body;
 
         if (!subject || !time || !room) {
             return res.json({ success: false, message: 'Class information missing' });
         }
 
-        const student = await Student.findOne({ rollNumber: parseInt(rollNumber) });
+        // Only an accepted verification session can mark a student present; the
+        // confidence is the session's, never one supplied by the client
+        const session = sessionId ? consumeSession(sessionId, parseInt(rollNumber)) : null;
+        if (!session) {
+            return res.json({ success: false, message: 'Face verification not completed' });
+        }
+        const confidence = session.aggregateConfidence;
+
+        const student = await Student.findOne({ rollNumber: parseInt(rollNumber) }, { name: 1 }).lean();
         if (!student) {
             return res.json({ success: false, message: 'Student not found' });
         }
 
-        // Check if already marked for THIS SPECIFIC CLASS today
-        const today = new Date();
-        today.setHours(0, 0, 0, 0);
-        
-        const existing = await MarkPresent.findOne({
-            rollNumber: parseInt(rollNumber),
-            subject: subject,
-            time: time,
-            room: room,
-            timestamp: { $gte: today }
-        });
-
-        if (existing) {
-            return res.json({ success: false, message: `Already marked attendance for ${subject} today` });
+        // Save attendance with class information; the unique (student, class, day)
+        // index rejects a second check-in atomically, no read-then-write
+        let record;
+        try {
+            record = await MarkPresent.create({
+                rollNumber: parseInt(rollNumber),
+                studentName: student.name,
+                timestamp: new Date(),
+                method: 'face_recognition',
+                confidence: confidence,
+                status: 'present',
+                framesProcessed: 0,
+                subject: subject,
+                time: time,
+                room: room
+            });
+        } catch (error) {
+            if (MarkPresent.isDuplicate(error)) {
+                return res.json({ success: false, message: `Already marked attendance for ${subject} today` });
+            }
+            throw error;
         }
-
-        // Save attendance with class information
-        await MarkPresent.create({
-            rollNumber: parseInt(rollNumber),
-            studentName: student.name,
-            timestamp: new Date(),
-            method: 'face_recognition',
-            confidence: confidence,
-            status: 'present',
-            framesProcessed: 0,
-            subject: subject,
-            time: time,
-            room: room
-        });
+        publishCheckIn(record);
 
         res.json({
             success: true,
@@ -5,6 +5,14 @@ const path = require('path');
 const { PythonShell } = require('python-shell');
 const Student = require('../models/student');
 const { sendOTP, verifyOTP } = require('../utils/otpService');
+const { recognitionPool, frameFromRequest, PYTHON_PATH } = require('../utils/recognitionPool');
+const { recordRecognition } = require('../utils/metrics');
+const { publishCheckIn, subscribe } = require('../utils/attendanceFeed');
+const crypto = require('crypto');
+const fs = require('fs');
+const http = require('http');
+const os = require('os');
+const { spawn } = require('child_process');
 
 module.exports.getRegister = async (req, res, next) => {
     res.render('../views/teacher/register');
@@ -190,6 +198,78 @@ module.exports.getPortal = async (req, res, next) => {
     }
 };
 
+// Reference encodings are computed right when a class opens, not on each student's first frame
+let warmUp = null;
+
+async function warmClassEncodings() {
+    const started = Date.now();
+    const modelVersion = recognitionPool.modelVersion;
+    // Classes have no enrolled-student list in the schema, so every student is considered
+    const students = await Student.find({ photo: { $exists: true } }, {
+        rollNumber: 1,
+        photo: 1,
+        faceEncoding: 1,
+        encodingModel: 1,
+        faceEncodingError: 1
+    }).lean();
+
+    const current = s => !modelVersion || s.encodingModel === modelVersion;
+    // Students whose stored encoding is current need nothing, nor do photos already
+    // found unusable by this model - retrying those only repeats the download
+    const pending = students.filter(s => !(current(s) && ((s.faceEncoding && s.faceEncoding.length) ||
+        (s.faceEncodingError && s.faceEncodingError.photo === s.photo))));
+    if (!pending.length) {
+        console.log(`[Warm-up] All ${students.length} reference encodings already stored or unusable`);
+        return;
+    }
+
+    const result = await recognitionPool.warm(pending.map(s => ({ rollNumber: s.rollNumber, url: s.photo })));
+
+    // Store them on the student records so later frames skip the photo entirely
+    const photos = new Map(pending.map(s => [s.rollNumber, s.photo]));
+    const updates = result.encodings.map(entry => ({
+        updateOne: {
+            filter: { rollNumber: entry.rollNumber },
+            update: {
+                $set: { faceEncoding: entry.encoding, encodingModel: result.modelVersion },
+                $unset: { faceEncodingError: 1 }
+            }
+        }
+    }));
+    // Photos without exactly one face are marked so the next class doesn't fetch them again;
+    // download failures are not, and are retried on the next warm-up
+    result.rejected.forEach(rollNumber => updates.push({
+        updateOne: {
+            filter: { rollNumber },
+            update: {
+                $set: {
+                    encodingModel: result.modelVersion,
+                    faceEncodingError: { photo: photos.get(rollNumber), reason: 'Photo does not show exactly one face' }
+                },
+                $unset: { faceEncoding: 1 }
+            }
+        }
+    }));
+    if (updates.length && result.modelVersion) {
+        await Student.bulkWrite(updates, { ordered: false });
+    }
+
+    console.log(`[Warm-up] ${result.encodings.length} reference encodings computed, ` +
+        `${students.length - pending.length} already stored or unusable, ${result.rejected.length} unusable photo(s), ` +
+        `${result.failed.length} failed in ${Date.now() - started}ms`);
+}
+
+function startWarmUp() {
+    if (warmUp) return;
+    warmUp = warmClassEncodings()
+        .catch(error => console.error('[Warm-up] Error:', error.message))
+        .finally(() => {
+            warmUp = null;
+            // Rebuild section galleries with the newly stored encodings
+            sectionGalleries.clear();
+        });
+}
+
 module.exports.grantAccess = async (req, res, next) => {
     try {
         const { subject, time, room, accessGranted, teacherId } = req.body;
@@ -227,6 +307,11 @@ module.exports.grantAccess = async (req, res, next) => {
             });
         }
 
+        // Students arrive within the minute - have their reference encodings ready
+        if (accessGranted) {
+            startWarmUp();
+        }
+
         res.json({
             success: true,
             message: accessGranted ? 'Access granted successfully' : 'Access revoked successfully',
@@ -272,17 +357,16 @@ module.exports.getAttendanceRecords = async (req, res) => {
             });
         }
 
-        const today = new Date();
-        today.setHours(0, 0, 0, 0);
-        
+        // Exact match on day uses the whole (subject, time, room, day, timestamp) index
         const attendance = await MarkPresent.find({
             subject: subject,
             time: time,
             room: room,
-            timestamp: { $gte: today }
+            day: MarkPresent.dayKey(new Date())
         }).sort({ timestamp: -1 }).lean();
 
-        const totalStudents = await Student.countDocuments();
+        // Unfiltered count comes from collection metadata instead of a scan
+        const totalStudents = await Student.estimatedDocumentCount();
 
         res.json({
             success: true,
@@ -303,6 +387,39 @@ module.exports.getAttendanceRecords = async (req, res) => {
     }
 };
 
+// Server-Sent Events: new check-ins for one class as they are written
+module.exports.attendanceStream = (req, res) => {
+    const { subject, time, room } = req.query;
+    if (!subject || !time || !room) {
+        return res.status(400).json({ success: false, message: 'Missing parameters' });
+    }
+    subscribe(req, res, { subject, time, room });
+};
+
+// Preview URLs of running recognition scripts, by roll number
+const activePreviews = new Map();
+
+// Relay a running script's localhost MJPEG preview to the browser
+module.exports.previewStream = (req, res) => {
+    const url = activePreviews.get(String(req.params.rollNumber));
+    if (!url) {
+        return res.status(404).json({ success: false, message: 'No recognition running for this student' });
+    }
+
+    const upstream = http.get(url, (preview) => {
+        res.writeHead(preview.statusCode, {
+            'Content-Type': preview.headers['content-type'],
+            'Cache-Control': 'no-cache'
+        });
+        preview.pipe(res);
+    });
+    upstream.on('error', () => {
+        if (!res.headersSent) res.status(502).end();
+        else res.end();
+    });
+    req.on('close', () => upstream.destroy());
+};
+
 module.exports.getAttendance = async (req, res, next) => {
     try {
         let rollNumber = null;
@@ -351,12 +468,9 @@ module.exports.getAttendance = async (req, res, next) => {
             `);
         }
 
-        const today = new Date();
-        today.setHours(0, 0, 0, 0);
-        
         const existingAttendance = await MarkPresent.findOne({
             rollNumber: parseInt(rollNumber),
-            timestamp: { $gte: today }
+            day: MarkPresent.dayKey(new Date())
         });
 
         if (existingAttendance) {
@@ -376,107 +490,108 @@ module.exports.getAttendance = async (req, res, next) => {
             args: [
                 student.photo,
                 rollNumber.toString(),
-                '60'
+                '60',
+                JSON.stringify({
+                    encoding: student.faceEncoding || null,
+                    modelVersion: student.encodingModel || null
+                }),
+                // MJPEG preview port; empty keeps the run headless
+                process.env.FACE_PREVIEW_PORT || ''
             ]
         };
 
         console.log(`[Face Recognition] Starting Python script...`);
 
-        PythonShell.run('student_face_recognition.py', options, async (err, results) => {
-            if (err) {
-                console.error('[Face Recognition] ✗ Error:', err.message);
-                
-                let errorMessage = 'Face recognition failed';
-                if (err.message.includes('404')) {
+        // Events are handled as the script prints them, not after it exits
+        const shell = new PythonShell('student_face_recognition.py', options);
+        let finalResult = null;
+
+        // e.g. Python missing; the end callback below still answers the request
+        shell.on('error', (error) => console.error('[Face Recognition] ✗ Could not run script:', error.message));
+
+        shell.on('message', (line) => {
+            line = line.trim();
+            if (!line.startsWith('{') || !line.endsWith('}')) return;
+            let message;
+            try {
+                message = JSON.parse(line);
+            } catch (e) {
+                return;
+            }
+
+            if (message.type === 'preview') {
+                // The script's server only listens on localhost; browsers go through /teacher/preview/:rollNumber
+                activePreviews.set(String(rollNumber), message.url);
+                console.log(`[Face Recognition] Preview stream: /teacher/preview/${rollNumber}`);
+            } else if (message.type === 'result') {
+                const frame = message.result;
+                recordRecognition('stream', frame.face_detected
+                    ? { faceDetected: true, matched: frame.match }
+                    : { faceDetected: false }, frame.timings || {});
+            } else if (message.type === 'final') {
+                finalResult = message;
+            }
+        });
+
+        shell.end(async (err) => {
+            activePreviews.delete(String(rollNumber));
+
+            // The script exits non-zero when the face isn't recognized; its final event still decides
+            if (!finalResult) {
+                const errorText = err ? err.message : '';
+                if (err) console.error('[Face Recognition] ✗ Error:', errorText);
+
+                let errorMessage = err ? 'Face recognition failed' : 'No response from face recognition';
+                if (errorText.includes('404')) {
                     errorMessage = 'Photo not found (404). Please re-upload your photo.';
-                } else if (err.message.includes('Camera')) {
+                } else if (errorText.includes('Camera')) {
                     errorMessage = 'Camera error. Please check camera access.';
                 }
-                
-                return res.status(500).send(`
-                    <script>
-                        alert('${errorMessage}');
-                        window.history.back();
-                    </script>
-                `);
-            }
 
-            if (!results || results.length === 0) {
                 return res.status(500).send(`
                     <script>
-                        alert('No response from face recognition');
+                        alert('${errorMessage}');
                         window.history.back();
                     </script>
                 `);
             }
 
-            try {
-                let jsonResult = null;
-                for (let line of results) {
-                    line = line.trim();
-                    if (line.startsWith('{') && line.endsWith('}')) {
-                        try {
-                            jsonResult = JSON.parse(line);
-                            break;
-                        } catch (e) {
-                            continue;
-                        }
-                    }
-                }
+            const result = finalResult;
+
+            if (result.success && result.recognized) {
+                try {
+                    const record = await MarkPresent.create({
+                        rollNumber: parseInt(rollNumber),
+                        studentName: student.name,
+                        timestamp: new Date(),
+                        method: 'face_recognition',
+                        confidence: result.confidence,
+                        status: 'present',
+                        framesProcessed: result.frames_processed || 0
+                    });
+                    publishCheckIn(record);
 
-                if (!jsonResult) {
-                    return res.status(500).send(`
+                    return res.status(200).send(`
                         <script>
-                            alert('Failed to parse result');
-                            window.history.back();
+                            alert('✓ Attendance Marked!\\n\\nStudent: ${student.name}\\nConfidence: ${(result.confidence * 100).toFixed(1)}%');
+                            window.location.href = '/student/portal';
                         </script>
                     `);
-                }
 
-                const result = jsonResult;
-
-                if (result.success && result.recognized) {
-                    try {
-                        await MarkPresent.create({
-                            rollNumber: parseInt(rollNumber),
-                            studentName: student.name,
-                            timestamp: new Date(),
-                            method: 'face_recognition',
-                            confidence: result.confidence,
-                            status: 'present',
-                            framesProcessed: result.frames_processed || 0
-                        });
-                        
-                        return res.status(200).send(`
-                            <script>
-                                alert('✓ Attendance Marked!\\n\\nStudent: ${student.name}\\nConfidence: ${(result.confidence * 100).toFixed(1)}%');
-                                window.location.href = '/student/portal';
-                            </script>
-                        `);
-                        
-                    } catch (dbError) {
-                        console.error('Database error:', dbError.message);
-                        return res.status(500).send(`
-                            <script>
-                                alert('Failed to save attendance');
-                                window.history.back();
-                            </script>
-                        `);
-                    }
-                    
-                } else {
-                    return res.status(200).send(`
+                } catch (dbError) {
+                    console.error('Database error:', dbError.message);
+                    return res.status(500).send(`
                         <script>
-                            alert('✗ Face Not Recognized\\n\\nTry again with better lighting');
+                            alert('Failed to save attendance');
                             window.history.back();
                         </script>
                     `);
                 }
-            } catch (parseError) {
-                console.error('Parse error:', parseError.message);
-                return res.status(500).send(`
+
+            } else {
+                return res.status(200).send(`
                     <script>
-                        alert('Failed to process result');
+                        alert('✗ Face Not Recognized\\n\\nTry again with better lighting');
                         window.history.back();
                     </script>
                 `);
@@ -492,4 +607,212 @@ module.exports.getAttendance = async (req, res, next) => {
             </script>
         `);
     }
-};
\ No newline at end of file
+};
+
+// Section rosters for classroom identification, reused across frames
+const sectionGalleries = new Map();
+const GALLERY_TTL = 60 * 1000;
+const IDENTIFY_WARM_UP_INTERVAL = 5 * 60 * 1000;
+let lastIdentifyWarmUp = 0;
+
+async function loadSectionGallery(section) {
+    const filterKey = JSON.stringify(section);
+    const cached = sectionGalleries.get(filterKey);
+    if (cached && Date.now() - cached.loadedAt < GALLERY_TTL) {
+        return cached;
+    }
+
+    const students = await Student.find(section, {
+        rollNumber: 1,
+        name: 1,
+        photo: 1,
+        faceEncoding: 1,
+        encodingModel: 1
+    }).sort({ rollNumber: 1 }).lean();
+
+    // The key changes whenever a student joins, leaves or re-enrolls
+    const hash = crypto.createHash('sha1');
+    students.forEach(s => hash.update(`${s.rollNumber}|${s.photo}|${s.encodingModel || ''};`));
+
+    const gallery = {
+        key: hash.digest('hex'),
+        section: filterKey,
+        students: students.map(s => ({
+            rollNumber: s.rollNumber,
+            photo: s.photo,
+            encoding: s.faceEncoding || null,
+            encodingModel: s.encodingModel || null
+        })),
+        names: new Map(students.map(s => [s.rollNumber, s.name])),
+        loadedAt: Date.now()
+    };
+    sectionGalleries.set(filterKey, gallery);
+    return gallery;
+}
+
+module.exports.identifyFrame = async (req, res) => {
+    try {
+        // Raw JPEG uploads carry the section in the query string
+        const params = Buffer.isBuffer(req.body) ? req.query : Object.assign({}, req.query, req.body);
+        const { course, branch, year, semester } = params;
+        const frame = frameFromRequest(req);
+
+        if (!frame) {
+            return res.json({ success: false, message: 'Frame required', faces: [] });
+        }
+
+        // Any subset of course/branch/year/semester narrows the section
+        const section = {};
+        if (course) section.course = course;
+        if (branch) section.branch = branch;
+        if (year) section.year = year;
+        if (semester) section.semester = semester;
+
+        const gallery = await loadSectionGallery(section);
+        const result = await recognitionPool.identify(gallery, frame);
+
+        if (result.error) {
+            console.error('[Class Identification] Python error:', result.error);
+        }
+        // Students without a stored encoding are left out of the gallery; encode them in the
+        // background, but don't retry photos that failed (e.g. no face) on every frame
+        if (result.missing && result.missing.length && Date.now() - lastIdentifyWarmUp > IDENTIFY_WARM_UP_INTERVAL) {
+            lastIdentifyWarmUp = Date.now();
+            startWarmUp();
+        }
+
+        const faces = (result.faces || []).map(face => Object.assign(face, {
+            studentName: face.rollNumber !== null ? gallery.names.get(face.rollNumber) || null : null
+        }));
+
+        res.status(result.busy ? 503 : 200).json({
+            success: !result.error,
+            message: result.error,
+            busy: !!result.busy,
+            faces: faces,
+            identified: faces.filter(face => face.matched).length,
+            gallerySize: result.gallerySize || 0,
+            missingEncodings: result.missing || []
+        });
+
+    } catch (error) {
+        console.error('[Class Identification] Error:', error);
+        res.json({ success: false, message: error.message, faces: [] });
+    }
+};
+
+// Run ml/video_attendance.py and resolve with its final JSON line
+function runVideoAttendance(videoPath, rosterPath, sampleFps) {
+    return new Promise((resolve, reject) => {
+        const args = ['-u', '-W', 'ignore::UserWarning', path.join(__dirname, '../ml/video_attendance.py'),
+            videoPath, rosterPath, '--sample-fps', String(sampleFps)];
+        const python = spawn(PYTHON_PATH, args);
+        let stdout = '';
+
+        python.stdout.on('data', (data) => { stdout += data.toString(); });
+        python.stderr.on('data', (data) => {
+            const message = data.toString().trim();
+            if (message.startsWith('Segments done')) {
+                console.log('[Video Attendance]', message);
+            } else if (!message.includes('pkg_resources is deprecated')) {
+                console.error('[Video Attendance]', message);
+            }
+        });
+        python.on('error', reject);
+        python.on('close', () => {
+            const lines = stdout.trim().split('\n');
+            try {
+                resolve(JSON.parse(lines[lines.length - 1]));
+            } catch (e) {
+                reject(new Error('Failed to parse video attendance result'));
+            }
+        });
+    });
+}
+
+// Attendance for a whole class from a recorded lecture video
+module.exports.videoAttendance = async (req, res) => {
+    const videoPath = req.file && req.file.path;
+    const rosterPath = path.join(os.tmpdir(), `roster_${crypto.randomUUID()}.json`);
+
+    try {
+        const { course, branch, year, semester, subject, time, room } = req.body;
+        if (!videoPath) {
+            return res.json({ success: false, message: 'Video file required' });
+        }
+        if (!subject || !time || !room) {
+            return res.json({ success: false, message: 'Class information missing' });
+        }
+
+        const section = {};
+        if (course) section.course = course;
+        if (branch) section.branch = branch;
+        if (year) section.year = year;
+        if (semester) section.semester = semester;
+
+        const gallery = await loadSectionGallery(section);
+        await fs.promises.writeFile(rosterPath, JSON.stringify(gallery.students));
+
+        console.log(`[Video Attendance] Processing ${req.file.originalname} against ${gallery.students.length} student(s)`);
+        const result = await runVideoAttendance(videoPath, rosterPath, parseFloat(req.body.sampleFps) || 1);
+
+        if (!result.success) {
+            return res.json({ success: false, message: result.error, present: [] });
+        }
+
+        // Students already marked for this class today keep their existing record
+        const rollNumbers = result.present.map(p => p.rollNumber);
+        const existing = await MarkPresent.find({
+            rollNumber: { $in: rollNumbers },
+            subject: subject,
+            time: time,
+            room: room,
+            day: MarkPresent.dayKey(new Date())
+        }, { rollNumber: 1 }).lean();
+        const marked = new Set(existing.map(record => record.rollNumber));
+
+        // One bulk insert for the whole class
+        const now = new Date();
+        const records = result.present.filter(p => !marked.has(p.rollNumber)).map(p => ({
+            rollNumber: p.rollNumber,
+            studentName: gallery.names.get(p.rollNumber) || String(p.rollNumber),
+            timestamp: now,
+            method: 'video',
+            confidence: p.confidence,
+            status: 'present',
+            framesProcessed: p.sightings,
+            subject: subject,
+            time: time,
+            room: room
+        }));
+        // Check-ins that landed meanwhile are dropped by the unique index
+        let inserted = [];
+        if (records.length) {
+            try {
+                inserted = await MarkPresent.insertMany(records, { ordered: false });
+            } catch (error) {
+                if (!MarkPresent.isDuplicate(error)) throw error;
+                inserted = error.insertedDocs || [];
+            }
+        }
+        inserted.forEach(publishCheckIn);
+
+        console.log(`[Video Attendance] ${inserted.length} marked present (${marked.size} already marked) in ${result.elapsedSeconds}s`);
+        res.json({
+            success: true,
+            marked: inserted.length,
+            alreadyMarked: marked.size,
+            framesSampled: result.framesSampled,
+            durationSeconds: result.durationSeconds,
+            elapsedSeconds: result.elapsedSeconds,
+            present: result.present.map(p => Object.assign(p, { studentName: gallery.names.get(p.rollNumber) || null }))
+        });
+
+    } catch (error) {
+        console.error('[Video Attendance] Error:', error);
+        res.json({ success: false, message: error.message, present: [] });
+    } finally {
+        fs.promises.unlink(rosterPath).catch(() => {});
+        if (videoPath) fs.promises.unlink(videoPath).catch(() => {});
+    }
+};
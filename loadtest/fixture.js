@@ -0,0 +1,61 @@
+const mongoose = require('mongoose');
+const Student = require('../models/student');
+const MarkPresent = require('../models/markpresent');
+
+// Simulated students get roll numbers from here up, clear of real enrollments
+const FIRST_ROLL_NUMBER = 900000;
+const PRODUCTION_DB = 'SmartAttendence';
+
+// Throwaway database: a local mongod under a separate name, or an in-memory one
+async function startDatabase({ mongoUri, memory }) {
+    if (!memory) {
+        return { uri: mongoUri, stop: async () => {} };
+    }
+
+    let MongoMemoryServer;
+    try {
+        ({ MongoMemoryServer } = require('mongodb-memory-server'));
+    } catch (error) {
+        throw new Error('--memory-db needs mongodb-memory-server - run: npm install --no-save mongodb-memory-server');
+    }
+    const server = await MongoMemoryServer.create();
+    return { uri: server.getUri('SmartAttendenceLoadTest'), stop: () => server.stop() };
+}
+
+// Replace the fixture database's students and attendance with `count` simulated students
+async function seedStudents(uri, count, photoUrl) {
+    const connection = await mongoose.connect(uri);
+    if (connection.connection.name === PRODUCTION_DB) {
+        await mongoose.disconnect();
+        throw new Error(`Refusing to seed the ${PRODUCTION_DB} database - point --mongo at a separate one`);
+    }
+
+    await Student.deleteMany({});
+    await MarkPresent.deleteMany({});
+    await MarkPresent.syncIndexes();
+
+    const students = [];
+    for (let i = 0; i < count; i++) {
+        const rollNumber = FIRST_ROLL_NUMBER + i;
+        students.push({
+            photo: photoUrl(i),
+            rollNumber,
+            name: `Load Test ${i}`,
+            email: `loadtest${i}@example.invalid`,
+            phone: 9000000000 + i,
+            course: 'B.Tech',
+            branch: 'CSE',
+            year: '1',
+            semester: '1'
+        });
+    }
+    await Student.insertMany(students);
+    await mongoose.disconnect();
+
+    return students.map(student => student.rollNumber);
+}
+
+module.exports = {
+    startDatabase,
+    seedStudents
+};
@@ -0,0 +1,328 @@
+// Load generator for the check-in path: N simulated students each go through the portal's
+// verification flow - /student/verify/start, recorded camera frames to /student/verify/frame
+// until the session is decided, then /student/save-attendance with the session id.
+// --flow recognize replays the frames against the legacy /student/recognize-frame instead;
+// that endpoint issues no session, so this mode measures recognition only and saves nothing.
+//
+//   node loadtest/loadTest.js --frames <dir of recorded .jpg frames> --photos <dir of reference photos> --students 40
+//
+// By default the app is started here (PORT, MONGO_URI) against a separate database that
+// is reseeded with the simulated students; reference photos come from a local HTTP server
+// instead of Cloudinary. Use --url to hit a server that is already running with
+// MONGO_URI set to the same --mongo database. The JSON report goes to stdout.
+const crypto = require('crypto');
+const fs = require('fs');
+const path = require('path');
+const { execFile, spawn } = require('child_process');
+const { parseArgs } = require('util');
+const { listPhotos, startPhotoServer } = require('./photoServer');
+const { startDatabase, seedStudents } = require('./fixture');
+
+const { values: options } = parseArgs({
+    options: {
+        students: { type: 'string', default: '30' },
+        frames: { type: 'string' },
+        photos: { type: 'string' },
+        'frames-per-student': { type: 'string', default: '6' },
+        // Matches the portal: one frame every 2 s and a 10 s request timeout
+        interval: { type: 'string', default: '2000' },
+        timeout: { type: 'string', default: '10000' },
+        ramp: { type: 'string', default: '5' },
+        flow: { type: 'string', default: 'verify' },
+        url: { type: 'string' },
+        port: { type: 'string', default: '8100' },
+        mongo: { type: 'string', default: 'mongodb://127.0.0.1:27017/SmartAttendenceLoadTest' },
+        'memory-db': { type: 'boolean', default: false },
+        // Wait the server's suggested interval between frames instead of --interval
+        'follow-pacing': { type: 'boolean', default: false },
+        verbose: { type: 'boolean', default: false }
+    }
+});
+
+const STUDENTS = parseInt(options.students);
+const FRAMES_PER_STUDENT = parseInt(options['frames-per-student']);
+const INTERVAL = parseInt(options.interval);
+const REQUEST_TIMEOUT = parseInt(options.timeout);
+const RAMP = parseFloat(options.ramp) * 1000;
+const FLOWS = ['verify', 'recognize'];
+// Matched frames that count as a match in --flow recognize, as the old portal did;
+// the verify flow leaves that decision to the server's session
+const REQUIRED_MATCHES = 2;
+// A verification session ignores byte-identical frames and accepts after two matched
+// ones (VERIFY_MIN_FRAMES), so each student needs at least this many distinct frames
+const MIN_DISTINCT_FRAMES = 2;
+const READY_TIMEOUT = 60000;
+const PROCESS_SAMPLE_INTERVAL = 1000;
+
+const sleep = (ms) => new Promise(resolve => setTimeout(resolve, ms));
+
+function percentile(sorted, p) {
+    if (sorted.length === 0) return null;
+    const index = Math.min(sorted.length - 1, Math.ceil(p / 100 * sorted.length) - 1);
+    return Math.round(sorted[Math.max(0, index)] * 10) / 10;
+}
+
+// Latency and outcome counts for one endpoint
+class EndpointStats {
+    constructor() {
+        this.latencies = [];
+        this.requests = 0;
+        this.timeouts = 0;
+        this.busy = 0;
+        this.errors = 0;
+    }
+
+    report(seconds) {
+        const sorted = this.latencies.slice().sort((a, b) => a - b);
+        return {
+            requests: this.requests,
+            throughput: Math.round(this.requests / seconds * 100) / 100,
+            p50Ms: percentile(sorted, 50),
+            p95Ms: percentile(sorted, 95),
+            p99Ms: percentile(sorted, 99),
+            timeouts: this.timeouts,
+            timeoutRate: this.requests ? Math.round(this.timeouts / this.requests * 1000) / 1000 : 0,
+            busy: this.busy,
+            errors: this.errors
+        };
+    }
+}
+
+async function timedRequest(stats, url, init) {
+    const started = performance.now();
+    stats.requests++;
+    try {
+        const response = await fetch(url, { ...init, signal: AbortSignal.timeout(REQUEST_TIMEOUT) });
+        const body = await response.json();
+        stats.latencies.push(performance.now() - started);
+        if (response.status === 503 || body.busy) stats.busy++;
+        // The pool answers a stuck worker with this error instead of hanging the request
+        else if (body.error === 'Process timeout') stats.timeouts++;
+        else if (body.error) stats.errors++;
+        return { status: response.status, body };
+    } catch (error) {
+        if (error.name === 'TimeoutError') {
+            stats.timeouts++;
+        } else {
+            stats.errors++;
+            if (options.verbose) console.error('[LoadTest] Request failed:', error.message);
+        }
+        return null;
+    }
+}
+
+// Python processes on this machine (recognition workers and any per-request scripts)
+function countPythonProcesses() {
+    return new Promise(resolve => {
+        execFile('ps', ['-A', '-o', 'args='], (error, stdout) => {
+            if (error) return resolve(null);
+            const python = stdout.split('\n').filter(line => /python/i.test(line.split(' ')[0]));
+            resolve({
+                total: python.length,
+                workers: python.filter(line => line.includes('compare_frame.py')).length
+            });
+        });
+    });
+}
+
+function sampleProcesses() {
+    const samples = [];
+    let stopped = false;
+    const loop = (async () => {
+        while (!stopped) {
+            const sample = await countPythonProcesses();
+            if (sample) samples.push(sample);
+            await sleep(PROCESS_SAMPLE_INTERVAL);
+        }
+    })();
+
+    return async () => {
+        stopped = true;
+        await loop;
+        if (samples.length === 0) return null;
+        const totals = samples.map(sample => sample.total);
+        return {
+            max: Math.max(...totals),
+            mean: Math.round(totals.reduce((a, b) => a + b, 0) / totals.length * 10) / 10,
+            maxWorkers: Math.max(...samples.map(sample => sample.workers))
+        };
+    };
+}
+
+// Start the app against the fixture database and wait for a warm recognition worker
+async function startApp(port, mongoUri) {
+    const app = spawn(process.execPath, ['app.js'], {
+        cwd: path.join(__dirname, '..'),
+        env: { ...process.env, PORT: port, MONGO_URI: mongoUri },
+        stdio: ['ignore', options.verbose ? 'inherit' : 'ignore', 'inherit']
+    });
+    const exited = new Promise(resolve => app.once('exit', resolve));
+    const baseUrl = `http://127.0.0.1:${port}`;
+
+    const deadline = Date.now() + READY_TIMEOUT;
+    while (Date.now() < deadline) {
+        if (app.exitCode !== null) throw new Error(`App exited with code ${app.exitCode}`);
+        try {
+            const metrics = await (await fetch(`${baseUrl}/metrics`)).text();
+            const ready = metrics.match(/^recognition_workers_ready (\d+)/m);
+            if (ready && parseInt(ready[1]) > 0) {
+                return { baseUrl, stop: () => { app.kill('SIGTERM'); return exited; } };
+            }
+        } catch (error) {
+            // Not listening yet
+        }
+        await sleep(500);
+    }
+    app.kill('SIGTERM');
+    throw new Error('App did not become ready in time');
+}
+
+// Wait out the rest of the frame interval, or the server's suggested one
+async function pace(result, started) {
+    let wait = INTERVAL;
+    if (options['follow-pacing'] && result && result.body.pacing) {
+        wait = result.body.pacing.interval;
+    }
+    if (result && result.status === 503) {
+        // Same backoff as the portal: skip an extra interval
+        wait += wait;
+    }
+    await sleep(Math.max(0, wait - (Date.now() - started)));
+}
+
+// The portal's check-in: a verification session fed frames until the server decides
+async function verifyStudent(baseUrl, rollNumber, frames, stats, offset) {
+    await sleep(Math.random() * RAMP);
+
+    const start = await timedRequest(stats.start, `${baseUrl}/student/verify/start`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ rollNumber })
+    });
+    if (!start || !start.body.success) return { matched: false, saved: false };
+
+    let session = start.body.session;
+    for (let i = 0; i < FRAMES_PER_STUDENT && session.status === 'pending'; i++) {
+        const started = Date.now();
+        const frame = frames[(offset + i) % frames.length];
+        const result = await timedRequest(stats.frame, `${baseUrl}/student/verify/frame?session=${session.id}`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'image/jpeg' },
+            body: frame
+        });
+        if (result && result.body.session) session = result.body.session;
+        if (session.status === 'pending') await pace(result, started);
+    }
+
+    if (session.status !== 'accepted') return { matched: false, saved: false };
+
+    const saved = await timedRequest(stats.save, `${baseUrl}/student/save-attendance`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({
+            rollNumber,
+            sessionId: session.id,
+            subject: 'Load Test',
+            time: '09:00',
+            room: 'LT-1'
+        })
+    });
+
+    return { matched: true, saved: Boolean(saved && saved.body.success) };
+}
+
+// Recognition only: save-attendance needs a verification session, which this endpoint doesn't issue
+async function recognizeStudent(baseUrl, rollNumber, frames, stats, offset) {
+    await sleep(Math.random() * RAMP);
+    let matches = 0;
+
+    for (let i = 0; i < FRAMES_PER_STUDENT && matches < REQUIRED_MATCHES; i++) {
+        const started = Date.now();
+        const frame = frames[(offset + i) % frames.length];
+        const result = await timedRequest(stats.recognize, `${baseUrl}/student/recognize-frame?rollNumber=${rollNumber}`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'image/jpeg' },
+            body: frame
+        });
+        if (result && result.body.matched) matches++;
+        await pace(result, started);
+    }
+
+    return { matched: matches >= REQUIRED_MATCHES, saved: false };
+}
+
+async function main() {
+    if (!options.frames || !options.photos) {
+        console.error('Usage: node loadtest/loadTest.js --frames <dir> --photos <dir> [--students 30] [--flow verify|recognize] [--url http://host:port]');
+        process.exit(2);
+    }
+    if (!FLOWS.includes(options.flow)) {
+        console.error(`Unknown --flow '${options.flow}' (expected one of ${FLOWS.join(', ')})`);
+        process.exit(2);
+    }
+
+    const frames = listPhotos(options.frames).map(name => fs.readFileSync(path.join(options.frames, name)));
+    if (frames.length === 0) throw new Error(`No recorded frames in ${options.frames}`);
+    const distinct = new Set(frames.map(frame => crypto.createHash('sha1').update(frame).digest('hex'))).size;
+    if (options.flow === 'verify' && distinct < MIN_DISTINCT_FRAMES) {
+        console.error(`--flow verify needs at least ${MIN_DISTINCT_FRAMES} distinct frames in ${options.frames} ` +
+            `(found ${distinct}) - repeated frames are rejected as replays`);
+        process.exit(2);
+    }
+
+    const photoServer = await startPhotoServer(options.photos);
+    const database = await startDatabase({ mongoUri: options.mongo, memory: options['memory-db'] });
+    let app = null;
+
+    try {
+        const rollNumbers = await seedStudents(database.uri, STUDENTS, photoServer.photoUrl);
+        console.error(`[LoadTest] Seeded ${rollNumbers.length} students`);
+
+        app = options.url ? null : await startApp(options.port, database.uri);
+        const baseUrl = options.url ? options.url.replace(/\/+$/, '') : app.baseUrl;
+
+        const verify = options.flow === 'verify';
+        const stats = verify
+            ? { start: new EndpointStats(), frame: new EndpointStats(), save: new EndpointStats() }
+            : { recognize: new EndpointStats() };
+        const simulateStudent = verify ? verifyStudent : recognizeStudent;
+        const stopSampling = sampleProcesses();
+        console.error(`[LoadTest] ${STUDENTS} students against ${baseUrl} (${options.flow} flow)`);
+
+        const started = performance.now();
+        const outcomes = await Promise.all(rollNumbers.map((rollNumber, i) =>
+            simulateStudent(baseUrl, rollNumber, frames, stats, i)));
+        const seconds = (performance.now() - started) / 1000;
+        const processes = await stopSampling();
+
+        const checkIns = outcomes.filter(outcome => outcome.saved).length;
+        const report = {
+            flow: options.flow,
+            students: STUDENTS,
+            framesPerStudent: FRAMES_PER_STUDENT,
+            intervalMs: INTERVAL,
+            durationSeconds: Math.round(seconds * 10) / 10,
+            matchedStudents: outcomes.filter(outcome => outcome.matched).length,
+            checkIns,
+            checkInsPerSecond: Math.round(checkIns / seconds * 100) / 100
+        };
+        if (verify) {
+            report.verifyStart = stats.start.report(seconds);
+            report.verifyFrame = stats.frame.report(seconds);
+            report.saveAttendance = stats.save.report(seconds);
+        } else {
+            report.recognizeFrame = stats.recognize.report(seconds);
+        }
+        report.pythonProcesses = processes;
+        console.log(JSON.stringify(report, null, 2));
+    } finally {
+        if (app) await app.stop();
+        await database.stop();
+        await photoServer.close();
+    }
+}
+
+main().catch(error => {
+    console.error('[LoadTest] Failed:', error.message);
+    process.exit(1);
+});
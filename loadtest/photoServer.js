@@ -0,0 +1,48 @@
+const fs = require('fs');
+const http = require('http');
+const path = require('path');
+
+const PHOTO_EXTENSIONS = ['.jpg', '.jpeg', '.png'];
+
+// Local stand-in for Cloudinary: serves a folder of reference photos over HTTP,
+// so reference downloads cost a real request without leaving the machine
+function listPhotos(folder) {
+    return fs.readdirSync(folder)
+        .filter(name => PHOTO_EXTENSIONS.includes(path.extname(name).toLowerCase()))
+        .sort();
+}
+
+function startPhotoServer(folder, port = 0) {
+    const photos = listPhotos(folder);
+    if (photos.length === 0) {
+        throw new Error(`No reference photos (.jpg/.png) in ${folder}`);
+    }
+
+    const server = http.createServer((req, res) => {
+        const name = decodeURIComponent(req.url.split('?')[0]).replace(/^\/+/, '');
+        if (!photos.includes(name)) {
+            res.writeHead(404);
+            return res.end();
+        }
+        const type = path.extname(name).toLowerCase() === '.png' ? 'image/png' : 'image/jpeg';
+        res.writeHead(200, { 'Content-Type': type });
+        fs.createReadStream(path.join(folder, name)).pipe(res);
+    });
+
+    return new Promise((resolve, reject) => {
+        server.once('error', reject);
+        server.listen(port, '127.0.0.1', () => {
+            const base = `http://127.0.0.1:${server.address().port}`;
+            resolve({
+                // Students share the photos round-robin
+                photoUrl: (index) => `${base}/${encodeURIComponent(photos[index % photos.length])}`,
+                close: () => new Promise(done => server.close(done))
+            });
+        });
+    });
+}
+
+module.exports = {
+    listPhotos,
+    startPhotoServer
+};
@@ -0,0 +1,339 @@
+import os
+import sys
+import json
+import time
+import shutil
+
+import numpy as np
+
+DIMENSIONS = 128
+
+# Below this many live vectors brute force is both exact and fast enough
+EXACT_THRESHOLD = 4096
+
+
+class FaceIndex:
+    """Inverted-file (IVF) index over 128-d face encodings in pure NumPy.
+
+    Vectors are bucketed by their nearest k-means centroid; a query only scans
+    the buckets of its nprobe nearest centroids. Small indexes, and anything
+    added since the last training, are searched exactly. Labels are the
+    caller's ids (roll numbers); adding an existing label replaces it.
+    """
+
+    def __init__(self, exact_threshold=EXACT_THRESHOLD, nprobe=8):
+        self.exact_threshold = exact_threshold
+        self.nprobe = nprobe
+        # Row storage grows by doubling; rows [0, size) are in use
+        self._vectors = np.empty((0, DIMENSIONS), dtype=np.float32)
+        self._labels = np.empty(0, dtype=np.int64)
+        self._alive = np.empty(0, dtype=bool)
+        self.size = 0
+        self.rows = {}              # label -> row
+        self.centroids = None       # (n_lists, 128) once trained
+        self.list_rows = None       # rows sorted by list (CSR values)
+        self.list_offsets = None    # CSR offsets, len n_lists + 1
+        self.trained_rows = 0       # rows [0, trained_rows) are in the inverted lists
+
+    def __len__(self):
+        return len(self.rows)
+
+    @property
+    def vectors(self):
+        return self._vectors[:self.size]
+
+    @property
+    def labels(self):
+        return self._labels[:self.size]
+
+    @property
+    def alive(self):
+        return self._alive[:self.size]
+
+    # ----- maintenance -----
+
+    def _reserve(self, capacity):
+        if capacity <= len(self._labels) and self._vectors.flags.writeable:
+            return
+        capacity = max(capacity, 2 * len(self._labels), 64)
+        # Also detaches arrays loaded read-only from a memory map
+        vectors = np.empty((capacity, DIMENSIONS), dtype=np.float32)
+        labels = np.empty(capacity, dtype=np.int64)
+        alive = np.zeros(capacity, dtype=bool)
+        vectors[:self.size] = self.vectors
+        labels[:self.size] = self.labels
+        alive[:self.size] = self.alive
+        self._vectors, self._labels, self._alive = vectors, labels, alive
+
+    def add(self, label, vector):
+        """Add or replace the encoding for label"""
+        label = int(label)
+        if label in self.rows:
+            self.remove(label)
+
+        self._reserve(self.size + 1)
+        row = self.size
+        self._vectors[row] = np.asarray(vector, dtype=np.float32).reshape(DIMENSIONS)
+        self._labels[row] = label
+        self._alive[row] = True
+        self.size += 1
+        self.rows[label] = row
+
+        # Retrain once untrained additions would dominate the exact tail scan
+        pending = self.size - self.trained_rows
+        if len(self) >= self.exact_threshold and (self.centroids is None or pending > len(self) // 2):
+            self.train()
+
+    def remove(self, label):
+        row = self.rows.pop(int(label), None)
+        if row is None:
+            return False
+        if not self._alive.flags.writeable:
+            self._alive = self._alive.copy()
+        self._alive[row] = False
+        return True
+
+    def compact(self):
+        """Physically drop removed rows"""
+        keep = np.flatnonzero(self.alive)
+        self._vectors = np.ascontiguousarray(self.vectors[keep])
+        self._labels = self.labels[keep]
+        self._alive = np.ones(len(keep), dtype=bool)
+        self.size = len(keep)
+        self.rows = {int(label): row for row, label in enumerate(self._labels)}
+        self.centroids = None
+        self.list_rows = None
+        self.list_offsets = None
+        self.trained_rows = 0
+
+    def train(self, n_lists=None, iterations=10, seed=0):
+        """Cluster the live vectors and rebuild the inverted lists"""
+        self.compact()
+        n = self.size
+        if n < self.exact_threshold:
+            return
+
+        n_lists = n_lists or max(16, int(np.sqrt(n)))
+        rng = np.random.default_rng(seed)
+
+        # k-means on a sample keeps training cost flat as the roster grows
+        sample = self.vectors[rng.choice(n, size=min(n, n_lists * 64), replace=False)]
+        centroids = sample[rng.choice(len(sample), size=n_lists, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = _nearest(sample, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            counts = np.bincount(assignment, minlength=n_lists)
+            nonempty = counts > 0
+            centroids[nonempty] = sums[nonempty] / counts[nonempty, None]
+
+        assignment = _nearest(self.vectors, centroids)
+        self.centroids = centroids
+        self.list_rows = np.argsort(assignment, kind='stable')
+        self.list_offsets = np.searchsorted(assignment[self.list_rows], np.arange(n_lists + 1))
+        self.trained_rows = n
+
+    def sync(self, labels, vectors):
+        """Make the index hold exactly these labels, touching only what changed.
+
+        Returns True if anything was added or removed.
+        """
+        wanted = {int(label): np.asarray(vector, dtype=np.float32) for label, vector in zip(labels, vectors)}
+        changed = False
+
+        for label in list(self.rows):
+            if label not in wanted:
+                changed = self.remove(label) or changed
+
+        for label, vector in wanted.items():
+            row = self.rows.get(label)
+            if row is None or not np.array_equal(self.vectors[row], vector):
+                self.add(label, vector)
+                changed = True
+
+        return changed
+
+    # ----- search -----
+
+    def search(self, queries, k=1, exact=False):
+        """Return (distances, labels) of the k nearest live vectors, each shaped (len(queries), k).
+
+        Missing neighbours are reported as distance inf and label -1.
+        """
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, DIMENSIONS)
+        out_d = np.full((len(queries), k), np.inf, dtype=np.float32)
+        out_l = np.full((len(queries), k), -1, dtype=np.int64)
+
+        if len(self) == 0:
+            return out_d, out_l
+
+        if exact or self.centroids is None:
+            candidates = [np.flatnonzero(self.alive)] * len(queries)
+        else:
+            candidates = self._probe(queries)
+
+        for i, rows in enumerate(candidates):
+            if len(rows) == 0:
+                continue
+            d = _distances(queries[i:i + 1], self.vectors[rows])[0]
+            top = min(k, len(rows))
+            best = np.argpartition(d, top - 1)[:top]
+            best = best[np.argsort(d[best])]
+            out_d[i, :top] = d[best]
+            out_l[i, :top] = self.labels[rows[best]]
+
+        return out_d, out_l
+
+    def _probe(self, queries):
+        nprobe = min(self.nprobe, len(self.centroids))
+        lists = np.argsort(_distances(queries, self.centroids), axis=1)[:, :nprobe]
+        tail = np.arange(self.trained_rows, self.size)
+
+        candidates = []
+        for probe in lists:
+            parts = [self.list_rows[self.list_offsets[j]:self.list_offsets[j + 1]] for j in probe]
+            parts.append(tail)
+            rows = np.concatenate(parts)
+            candidates.append(rows[self.alive[rows]])
+        return candidates
+
+    # ----- persistence -----
+
+    def save(self, path):
+        """Write the index as a directory of .npy files (loadable with mmap).
+
+        Workers share the directory, so each save goes into a fresh version
+        subdirectory that is published by atomically replacing the CURRENT
+        pointer; a concurrent load() sees either the old or the new arrays,
+        never a mix.
+        """
+        os.makedirs(path, exist_ok=True)
+        version = f"v{time.time_ns()}-{os.getpid()}"
+        tmp_dir = os.path.join(path, f".{version}.tmp")
+        os.makedirs(tmp_dir)
+
+        arrays = {
+            'vectors': self.vectors,
+            'labels': self.labels,
+            'alive': self.alive
+        }
+        if self.centroids is not None:
+            arrays.update(centroids=self.centroids, list_rows=self.list_rows, list_offsets=self.list_offsets)
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp_dir, f"{name}.npy"), np.ascontiguousarray(array))
+        with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+            json.dump({
+                'trained_rows': self.trained_rows,
+                'exact_threshold': self.exact_threshold,
+                'nprobe': self.nprobe
+            }, f)
+        os.rename(tmp_dir, os.path.join(path, version))
+
+        pointer = os.path.join(path, f"CURRENT.{os.getpid()}.tmp")
+        with open(pointer, 'w') as f:
+            f.write(version)
+        os.replace(pointer, os.path.join(path, 'CURRENT'))
+        _prune_versions(path, version)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """Load the current saved version; with mmap the vectors are paged in on demand"""
+        with open(os.path.join(path, 'CURRENT')) as f:
+            path = os.path.join(path, f.read().strip())
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+
+        mode = 'r' if mmap else None
+        index = cls(exact_threshold=meta['exact_threshold'], nprobe=meta['nprobe'])
+        index._vectors = np.load(os.path.join(path, 'vectors.npy'), mmap_mode=mode)
+        index._labels = np.load(os.path.join(path, 'labels.npy'))
+        index._alive = np.load(os.path.join(path, 'alive.npy'))
+        if not len(index._vectors) == len(index._labels) == len(index._alive):
+            raise ValueError(f"Inconsistent face index at {path}")
+        index.size = len(index._labels)
+        index.rows = {int(label): row for row, label in enumerate(index._labels) if index._alive[row]}
+        index.trained_rows = meta['trained_rows']
+
+        if os.path.exists(os.path.join(path, 'centroids.npy')):
+            index.centroids = np.load(os.path.join(path, 'centroids.npy'))
+            index.list_rows = np.load(os.path.join(path, 'list_rows.npy'), mmap_mode=mode)
+            index.list_offsets = np.load(os.path.join(path, 'list_offsets.npy'))
+        return index
+
+
+def _prune_versions(path, current, keep=2):
+    """Remove all but the newest saved versions; readers of an older one keep their open mmaps"""
+    versions = sorted((name for name in os.listdir(path) if name.startswith('v') and name != current),
+                      key=lambda name: int(name[1:].split('-')[0]))
+    for name in versions[:max(0, len(versions) - (keep - 1))]:
+        shutil.rmtree(os.path.join(path, name), ignore_errors=True)
+
+
+def _distances(a, b):
+    """Pairwise Euclidean distances between rows of a and rows of b"""
+    sq = (np.einsum('ij,ij->i', a, a)[:, None] + np.einsum('ij,ij->i', b, b)[None, :]
+          - 2.0 * (a @ b.T))
+    return np.sqrt(np.maximum(sq, 0.0))
+
+
+def _nearest(vectors, centroids, chunk=8192):
+    out = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), chunk):
+        out[start:start + chunk] = np.argmin(_distances(vectors[start:start + chunk], centroids), axis=1)
+    return out
+
+
+def _synthetic_roster(n, seed=0):
+    """Clustered unit-scale vectors resembling face encodings (people cluster by appearance)"""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(scale=0.15, size=(max(1, n // 50), DIMENSIONS))
+    vectors = centers[rng.integers(len(centers), size=n)] + rng.normal(scale=0.05, size=(n, DIMENSIONS))
+    return vectors.astype(np.float32)
+
+
+def benchmark(sizes=(1000, 10000, 50000), queries=200, nprobes=(1, 4, 8, 16, 32), seed=0):
+    """Recall@1 and per-query latency of IVF search against exact search"""
+    rng = np.random.default_rng(seed + 1)
+    report = []
+
+    for n in sizes:
+        vectors = _synthetic_roster(n, seed)
+        index = FaceIndex()
+        start = time.perf_counter()
+        for label, vector in enumerate(vectors):
+            index.add(label, vector)
+        index.train()
+        build_s = time.perf_counter() - start
+
+        # Probes are noisy re-captures of enrolled students
+        truth_rows = rng.integers(n, size=queries)
+        probes = vectors[truth_rows] + rng.normal(scale=0.03, size=(queries, DIMENSIONS)).astype(np.float32)
+
+        start = time.perf_counter()
+        _, exact_labels = index.search(probes, exact=True)
+        exact_ms = (time.perf_counter() - start) * 1000 / queries
+
+        row = {'size': n, 'buildSeconds': round(build_s, 3), 'exactMsPerQuery': round(exact_ms, 4), 'ivf': []}
+        for nprobe in nprobes:
+            index.nprobe = nprobe
+            start = time.perf_counter()
+            _, labels = index.search(probes)
+            ivf_ms = (time.perf_counter() - start) * 1000 / queries
+            row['ivf'].append({
+                'nprobe': nprobe,
+                'msPerQuery': round(ivf_ms, 4),
+                'recallAt1': float(np.mean(labels[:, 0] == exact_labels[:, 0]))
+            })
+        report.append(row)
+        print(json.dumps(row), file=sys.stderr)
+
+    return report
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--benchmark':
+        sizes = tuple(int(n) for n in sys.argv[2:]) or (1000, 10000, 50000)
+        print(json.dumps({'benchmark': 'ann_index', 'results': benchmark(sizes)}), flush=True)
+    else:
+        print('Usage: python ann_index.py --benchmark [size ...]', file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,339 @@
+import os
+import sys
+import json
+import time
+import base64
+import argparse
+import tracemalloc
+import subprocess
+
+import cv2
+import numpy as np
+
+STAGES = ('base64', 'jpegDecode', 'color', 'detect', 'encode', 'distance')
+DEFAULT_RESOLUTIONS = ((320, 240), (640, 480), (1280, 720))
+
+
+def load_faces(face_dir):
+    """RGB face photos from a folder (e.g. a few enrollment photos)"""
+    faces = []
+    if not face_dir:
+        return faces
+    for name in sorted(os.listdir(face_dir)):
+        if name.lower().endswith(('.jpg', '.jpeg', '.png')):
+            image = cv2.imread(os.path.join(face_dir, name))
+            if image is not None:
+                faces.append(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+    return faces
+
+
+def synthetic_frame(width, height, face=None, seed=0):
+    """A camera-like RGB frame: smooth background plus sensor noise, with the face photo pasted in the middle.
+
+    The same seed always gives the same frame so runs are comparable.
+    """
+    rng = np.random.default_rng(seed)
+    ys, xs = np.mgrid[0:height, 0:width].astype(np.float32)
+    base = 90 + 60 * np.sin(xs / width * np.pi)[..., None] * np.array([1.0, 0.9, 0.8], dtype=np.float32)
+    base = base + 20 * (ys / height)[..., None]
+    frame = np.clip(base + rng.normal(scale=6, size=(height, width, 3)), 0, 255).astype(np.uint8)
+
+    if face is not None:
+        # Face photo scaled to about half the frame height, like a student at a laptop camera
+        face_height = height // 2
+        face_width = max(1, int(face.shape[1] * face_height / face.shape[0]))
+        if face_width > width:
+            face_width, face_height = width, max(1, int(face.shape[0] * width / face.shape[1]))
+        resized = cv2.resize(face, (face_width, face_height), interpolation=cv2.INTER_AREA)
+        top, left = (height - face_height) // 2, (width - face_width) // 2
+        frame[top:top + face_height, left:left + face_width] = resized
+
+    return frame
+
+
+def _stats(samples):
+    if not samples:
+        return None
+    ms = 1000 * np.asarray(samples)
+    return {
+        'meanMs': round(float(np.mean(ms)), 3),
+        'p50Ms': round(float(np.percentile(ms, 50)), 3),
+        'p95Ms': round(float(np.percentile(ms, 95)), 3)
+    }
+
+
+def run_frame(payload, detector, reference, num_jitters):
+    """Push one base64 JPEG through every compare_frame stage; returns {stage: seconds}"""
+    import face_recognition
+
+    timings = {}
+    clock = time.perf_counter
+
+    start = clock()
+    data = base64.b64decode(payload)
+    timings['base64'] = clock() - start
+
+    start = clock()
+    bgr = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    timings['jpegDecode'] = clock() - start
+
+    start = clock()
+    rgb = cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)
+    timings['color'] = clock() - start
+
+    start = clock()
+    face_locations = detector.detect(rgb)
+    timings['detect'] = clock() - start
+
+    if face_locations:
+        start = clock()
+        encodings = face_recognition.face_encodings(rgb, face_locations[:1], num_jitters=num_jitters)
+        timings['encode'] = clock() - start
+
+        if encodings and reference is not None:
+            start = clock()
+            face_recognition.face_distance([reference], encodings[0])
+            timings['distance'] = clock() - start
+
+    return timings
+
+
+def benchmark(faces, resolutions=DEFAULT_RESOLUTIONS, repeat=20, warmup=2, detector_name='hog',
+              scale=1.0, upsample=1, num_jitters=1, quality=80):
+    """Warm per-stage latency and single-core throughput at each resolution"""
+    import face_recognition
+    from face_detection import FaceDetector
+
+    detector = FaceDetector(detector_name, scale=scale, upsample=upsample)
+    reference = None
+    if faces:
+        encodings = face_recognition.face_encodings(faces[0], num_jitters=num_jitters)
+        reference = encodings[0] if encodings else None
+
+    report = []
+    for width, height in resolutions:
+        frames = [synthetic_frame(width, height, face, seed) for seed, face in enumerate(faces or [None])]
+        payloads = []
+        for frame in frames:
+            ok, buffer = cv2.imencode('.jpg', cv2.cvtColor(frame, cv2.COLOR_RGB2BGR),
+                                      [cv2.IMWRITE_JPEG_QUALITY, quality])
+            payloads.append(base64.b64encode(buffer.tobytes()))
+
+        for i in range(warmup):
+            run_frame(payloads[i % len(payloads)], detector, reference, num_jitters)
+
+        samples = {stage: [] for stage in STAGES}
+        totals = []
+        detected = 0
+        for i in range(repeat):
+            timings = run_frame(payloads[i % len(payloads)], detector, reference, num_jitters)
+            for stage, seconds in timings.items():
+                samples[stage].append(seconds)
+            totals.append(sum(timings.values()))
+            detected += 'encode' in timings
+
+        total = float(np.mean(totals))
+        row = {
+            'resolution': f"{width}x{height}",
+            'frames': repeat,
+            'faceRate': round(detected / repeat, 3),
+            'stages': {stage: _stats(samples[stage]) for stage in STAGES},
+            'total': _stats(totals),
+            # Workers are single-threaded, so one worker per core scales this linearly
+            'framesPerSecondPerCore': round(1.0 / total, 2) if total > 0 else None
+        }
+        report.append(row)
+        print(json.dumps(row), file=sys.stderr)
+
+    return report
+
+
+def cold_start(face_dir, width, height, detector_name, scale, upsample, num_jitters):
+    """Time a fresh interpreter: imports plus the first frame (model loading)"""
+    command = [sys.executable, os.path.abspath(__file__), '--cold',
+               '--faces', face_dir or '', '--resolutions', f"{width}x{height}",
+               '--detector', detector_name, '--scale', str(scale),
+               '--upsample', str(upsample), '--jitters', str(num_jitters)]
+    start = time.perf_counter()
+    result = subprocess.run(command, capture_output=True, text=True)
+    wall = time.perf_counter() - start
+    try:
+        timings = json.loads(result.stdout.strip().splitlines()[-1])
+    except (IndexError, ValueError):
+        print(f"Cold start run failed: {result.stderr.strip()}", file=sys.stderr)
+        return None
+    timings['processMs'] = round(1000 * wall, 1)
+    return timings
+
+
+def _cold_child(args):
+    start = time.perf_counter()
+    import face_recognition  # noqa: F401 - loading the dlib models is the cost being measured
+    from face_detection import FaceDetector
+    import_ms = 1000 * (time.perf_counter() - start)
+
+    width, height = args.resolutions[0]
+    faces = load_faces(args.faces)
+    frame = synthetic_frame(width, height, faces[0] if faces else None)
+    ok, buffer = cv2.imencode('.jpg', cv2.cvtColor(frame, cv2.COLOR_RGB2BGR))
+    payload = base64.b64encode(buffer.tobytes())
+    detector = FaceDetector(args.detector, scale=args.scale, upsample=args.upsample)
+
+    start = time.perf_counter()
+    run_frame(payload, detector, None, args.jitters)
+    first_ms = 1000 * (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    run_frame(payload, detector, None, args.jitters)
+    second_ms = 1000 * (time.perf_counter() - start)
+
+    print(json.dumps({'importMs': round(import_ms, 1), 'firstFrameMs': round(first_ms, 1),
+                      'warmFrameMs': round(second_ms, 1)}), flush=True)
+
+
+class ReplayCamera:
+    """Stands in for cv2.VideoCapture: returns the same BGR frame, into image when one is passed"""
+
+    def __init__(self, frame):
+        self.frame = frame
+
+    def read(self, image=None):
+        if image is not None and image.shape == self.frame.shape:
+            np.copyto(image, self.frame)
+            return True, image
+        return True, self.frame.copy()
+
+
+def render_benchmark(faces, resolutions=DEFAULT_RESOLUTIONS, repeat=20, warmup=2, quality=80):
+    """Per-frame time and transient allocation of the live-stream path, without and with FrameBuffers.
+
+    processFrame is the serial camera -> mirror -> recognize -> overlay path;
+    preview is the output thread's copy -> overlay -> JPEG encode. Allocation
+    is the per-frame peak of memory traced by tracemalloc (numpy arrays,
+    including those OpenCV returns).
+    """
+    from student_face_recognition import FaceRecognitionStream
+
+    report = []
+    for width, height in resolutions:
+        face = faces[0] if faces else None
+        bgr = cv2.cvtColor(synthetic_frame(width, height, face), cv2.COLOR_RGB2BGR)
+        box = (height // 4, 3 * width // 4, 3 * height // 4, width // 4)
+        overlay = {'status': ('Face Matched! (1/5)', (0, 255, 0)), 'box': (box, True, 0.8)}
+        row = {'resolution': f"{width}x{height}", 'frames': repeat}
+
+        for mode, reuse in (('allocating', False), ('buffered', True)):
+            stream = FaceRecognitionStream(None, 'benchmark', reuse_buffers=reuse)
+            stream.registered_encoding = np.zeros(128)
+            stream.camera = ReplayCamera(bgr)
+            stream.frame_shape = bgr.shape
+
+            def preview():
+                frame = stream.render(stream.preview_copy(bgr), overlay)
+                cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+
+            for name, step in (('processFrame', stream.process_frame), ('preview', preview)):
+                for _ in range(warmup):
+                    step()
+                allocations = stream.buffers.allocations
+                seconds, peaks = [], []
+                tracemalloc.start()
+                for _ in range(repeat):
+                    tracemalloc.reset_peak()
+                    before = tracemalloc.get_traced_memory()[0]
+                    start = time.perf_counter()
+                    step()
+                    seconds.append(time.perf_counter() - start)
+                    peaks.append(tracemalloc.get_traced_memory()[1] - before)
+                tracemalloc.stop()
+                row.setdefault(name, {})[mode] = {
+                    **_stats(seconds),
+                    'allocatedKB': round(float(np.mean(peaks)) / 1024, 1),
+                    # Buffers (re)allocated after warm-up; 0 means the steady state reuses everything
+                    'bufferAllocations': stream.buffers.allocations - allocations
+                }
+
+        report.append(row)
+        print(json.dumps(row), file=sys.stderr)
+
+    return report
+
+
+def compare_baseline(report, baseline, tolerance):
+    """Stages whose mean latency grew by more than tolerance (a fraction) against a saved run"""
+    previous = {row['resolution']: row for row in baseline.get('results', [])}
+    regressions = []
+    for row in report['results']:
+        old = previous.get(row['resolution'])
+        if old is None:
+            continue
+        for stage in STAGES + ('total',):
+            new_stats = row['total'] if stage == 'total' else row['stages'].get(stage)
+            old_stats = old['total'] if stage == 'total' else old['stages'].get(stage)
+            if not new_stats or not old_stats or not old_stats['meanMs']:
+                continue
+            change = new_stats['meanMs'] / old_stats['meanMs'] - 1
+            if change > tolerance:
+                regressions.append({'resolution': row['resolution'], 'stage': stage,
+                                    'baselineMs': old_stats['meanMs'], 'meanMs': new_stats['meanMs'],
+                                    'change': round(change, 3)})
+    return regressions
+
+
+def _resolutions(value):
+    return tuple(tuple(int(v) for v in size.lower().split('x')) for size in value.split(','))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Offline benchmark of the compare_frame recognition stages')
+    parser.add_argument('--faces', default='', help='folder of face photos pasted into the synthetic frames')
+    parser.add_argument('--resolutions', type=_resolutions, default=DEFAULT_RESOLUTIONS,
+                        help='comma-separated WxH list (default 320x240,640x480,1280x720)')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--detector', default='hog')
+    parser.add_argument('--scale', type=float, default=1.0)
+    parser.add_argument('--upsample', type=int, default=1)
+    parser.add_argument('--jitters', type=int, default=1)
+    parser.add_argument('--baseline', help='earlier output of this script to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slowdown per stage (0.2 = 20%%)')
+    parser.add_argument('--render', action='store_true',
+                        help='benchmark the live-stream render path with and without reused frame buffers instead')
+    parser.add_argument('--cold', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.cold:
+        _cold_child(args)
+        sys.exit(0)
+
+    faces = load_faces(args.faces)
+    if args.render:
+        report = {'benchmark': 'render', 'results': render_benchmark(faces, args.resolutions, args.repeat)}
+        print(json.dumps(report), flush=True)
+        sys.exit(0)
+
+    if not faces:
+        print('No --faces given: frames contain no face, so encode and distance are not timed', file=sys.stderr)
+
+    width, height = args.resolutions[0]
+    report = {
+        'benchmark': 'recognition',
+        'config': {
+            'detector': args.detector,
+            'scale': args.scale,
+            'upsample': args.upsample,
+            'jitters': args.jitters,
+            'faces': len(faces),
+            'cores': os.cpu_count()
+        },
+        'coldStart': cold_start(args.faces, width, height, args.detector, args.scale, args.upsample, args.jitters),
+        'results': benchmark(faces, args.resolutions, args.repeat, detector_name=args.detector,
+                             scale=args.scale, upsample=args.upsample, num_jitters=args.jitters)
+    }
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            report['regressions'] = compare_baseline(report, json.load(f), args.tolerance)
+
+    print(json.dumps(report), flush=True)
+    if report.get('regressions'):
+        sys.exit(1)
@@ -0,0 +1,162 @@
+import os
+import sys
+import json
+import time
+import argparse
+from multiprocessing import Pool
+
+import face_recognition
+
+from encoding_cache import MODEL_VERSION
+from enroll_face import enroll_image, enroll_url
+
+DEFAULT_MONGO_URI = 'mongodb://127.0.0.1:27017/SmartAttendence'
+DEFAULT_BATCH_SIZE = 50
+PHOTO_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+def encode_job(job):
+    """Worker: encode one reference photo (URL or local file)"""
+    roll_number, source = job
+    if source.startswith(('http://', 'https://')):
+        # Also seeds the shared on-disk encoding cache
+        return roll_number, enroll_url(source)
+    try:
+        return roll_number, enroll_image(face_recognition.load_image_file(source))
+    except Exception as e:
+        return roll_number, {'success': False, 'error': str(e)}
+
+
+class Checkpoint:
+    """Roll numbers already written for the current model version, persisted after every batch"""
+
+    def __init__(self, path):
+        self.path = path
+        self.done = set()
+        if path and os.path.exists(path):
+            with open(path) as f:
+                state = json.load(f)
+            if state.get('modelVersion') == MODEL_VERSION:
+                self.done = set(state.get('done', []))
+
+    def save(self, roll_numbers):
+        self.done.update(roll_numbers)
+        if not self.path:
+            return
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump({'modelVersion': MODEL_VERSION, 'done': sorted(self.done)}, f)
+        os.replace(tmp, self.path)
+
+
+class MongoRoster:
+    """Students from the app's MongoDB; encodings are written back with bulk updates"""
+
+    def __init__(self, uri, force=False):
+        try:
+            from pymongo import MongoClient, UpdateOne
+        except ImportError:
+            raise SystemExit('Reading the student collection needs pymongo - run: pip install pymongo')
+        self.update_one = UpdateOne
+        self.client = MongoClient(uri)
+        self.students = self.client.get_default_database()['students']
+        self.force = force
+
+    def jobs(self):
+        query = {'photo': {'$exists': True}}
+        if not self.force:
+            query['encodingModel'] = {'$ne': MODEL_VERSION}
+        for student in self.students.find(query, {'rollNumber': 1, 'photo': 1}):
+            yield student['rollNumber'], student['photo']
+
+    def write(self, results):
+        updates = [
+            self.update_one({'rollNumber': roll_number},
+                            {'$set': {'faceEncoding': result['encoding'], 'encodingModel': result['modelVersion']}})
+            for roll_number, result in results if result['success']
+        ]
+        if updates:
+            self.students.bulk_write(updates, ordered=False)
+
+
+class FolderRoster:
+    """Photos named <rollNumber>.jpg; encodings are appended to a JSON-lines file"""
+
+    def __init__(self, folder, output):
+        self.folder = folder
+        self.output = output
+
+    def jobs(self):
+        for name in sorted(os.listdir(self.folder)):
+            stem, extension = os.path.splitext(name)
+            if extension.lower() in PHOTO_EXTENSIONS and stem.isdigit():
+                yield int(stem), os.path.join(self.folder, name)
+
+    def write(self, results):
+        with open(self.output, 'a') as f:
+            for roll_number, result in results:
+                if result['success']:
+                    f.write(json.dumps({'rollNumber': roll_number, 'encoding': result['encoding'],
+                                        'modelVersion': result['modelVersion']}) + '\n')
+
+
+def is_final(result):
+    """Enrolled, or a photo that will never enroll as it is (no face or several faces)"""
+    return result['success'] or result.get('faces', 1) != 1
+
+
+def bulk_enroll(roster, checkpoint, workers=None, batch_size=DEFAULT_BATCH_SIZE):
+    """Encode every pending photo in a process pool, writing results back batch by batch"""
+    jobs = [job for job in roster.jobs() if job[0] not in checkpoint.done]
+    report = {'total': len(jobs), 'enrolled': 0, 'noFace': [], 'multipleFaces': [], 'errors': []}
+    started = time.perf_counter()
+    batch = []
+
+    def flush():
+        roster.write(batch)
+        # Download failures and timeouts are left out so a resumed run retries them
+        checkpoint.save(roll_number for roll_number, result in batch if is_final(result))
+        batch.clear()
+
+    with Pool(workers or os.cpu_count() or 1) as pool:
+        for done, (roll_number, result) in enumerate(pool.imap_unordered(encode_job, jobs), 1):
+            if result['success']:
+                report['enrolled'] += 1
+            elif result.get('faces') == 0:
+                report['noFace'].append(roll_number)
+            elif result.get('faces', 0) > 1:
+                report['multipleFaces'].append({'rollNumber': roll_number, 'faces': result['faces']})
+            else:
+                report['errors'].append({'rollNumber': roll_number, 'error': result.get('error')})
+
+            batch.append((roll_number, result))
+            if len(batch) >= batch_size:
+                flush()
+                elapsed = time.perf_counter() - started
+                print(f"{done}/{len(jobs)} photos, {done / elapsed:.1f}/s", file=sys.stderr)
+        if batch:
+            flush()
+
+    elapsed = time.perf_counter() - started
+    report['elapsedSeconds'] = round(elapsed, 2)
+    report['photosPerSecond'] = round(len(jobs) / elapsed, 2) if elapsed > 0 else None
+    report['modelVersion'] = MODEL_VERSION
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Recompute every stored reference encoding')
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--mongo', default=DEFAULT_MONGO_URI, help='student collection to re-enroll (default)')
+    source.add_argument('--folder', help='folder of <rollNumber>.jpg photos instead of MongoDB')
+    parser.add_argument('--output', default='enrollments.jsonl', help='results file for --folder')
+    parser.add_argument('--checkpoint', default='bulk_enroll.checkpoint.json',
+                        help='progress file; rerun with the same file to resume')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument('--force', action='store_true', help='also re-encode students already on this model version')
+    args = parser.parse_args()
+
+    roster = FolderRoster(args.folder, args.output) if args.folder else MongoRoster(args.mongo, args.force)
+    report = bulk_enroll(roster, Checkpoint(args.checkpoint), args.workers, args.batch_size)
+    print(json.dumps(report), flush=True)
@@ -4,32 +4,30 @@ import cv2
 import numpy as np
 import face_recognition
 import base64
-from io import BytesIO
-from PIL import Image
-import requests
-import tempfile
 import os
+from encoding_cache import get_default_cache, stored_encoding, MODEL_VERSION
+from enroll_face import enroll_url
+from identify_class import GalleryStore, identify_faces
+from face_detection import FaceDetector
+from stage_timing import StageTimings
+from frame_quality import QualityGate
+
+# One detector per process; tracks remember each student's last face box
+detector = FaceDetector()
+quality_gate = QualityGate()
 
 def load_registered_image(url):
-    """Download and encode registered image - Optimized for speed"""
+    """Return the registered face encoding, served from the shared encoding cache"""
     try:
-        # Reduced timeout to 5 seconds
-        response = requests.get(url, timeout=5)
-        response.raise_for_status()
-        
-        # Use BytesIO instead of temp file for faster processing
-        image_data = BytesIO(response.content)
-        image = face_recognition.load_image_file(image_data)
-        encodings = face_recognition.face_encodings(image, num_jitters=1)  # Faster encoding
-        
-        return encodings[0] if encodings else None
+        # Reduced timeout to 5 seconds; repeat calls for the same URL do no network I/O
+        return get_default_cache().load(url, timeout=5, num_jitters=1)
         
     except Exception as e:
         print(f"Error loading registered image: {str(e)}", file=sys.stderr)
         return None
 
 def decode_frame(frame_data):
-    """Decode base64 frame to numpy array"""
+    """Decode base64 frame (command-line mode) to a BGR numpy array"""
     try:
         # Remove data:image/jpeg;base64, prefix if present
         if ',' in frame_data:
@@ -38,79 +36,399 @@ def decode_frame(frame_data):
         # Decode base64
         image_data = base64.b64decode(frame_data)
         
-        # Convert to PIL Image
-        image = Image.open(BytesIO(image_data))
-        
-        # Convert to numpy array (RGB)
-        return np.array(image)
+        # Decode JPEG straight to a BGR array
+        return cv2.imdecode(np.frombuffer(image_data, dtype=np.uint8), cv2.IMREAD_COLOR)
         
     except Exception as e:
         print(f"Error decoding frame: {str(e)}", file=sys.stderr)
         return None
 
-def compare_frame(registered_url, frame_data):
-    """Compare captured frame with registered face"""
+class FrameDecoder:
+    """Worker-side frame input: raw JPEG bytes read into one reused buffer and
+    decoded into one reused RGB array, so a frame is never base64'd or copied
+    through Python strings"""
+    
+    def __init__(self, initial_size=1 << 20):
+        self.payload = bytearray(initial_size)
+        self.rgb = None
+    
+    def read(self, stream, size):
+        """Read exactly size bytes of frame payload from a binary stream"""
+        if size > len(self.payload):
+            self.payload = bytearray(size)
+        view = memoryview(self.payload)[:size]
+        received = 0
+        while received < size:
+            count = stream.readinto(view[received:])
+            if not count:
+                raise EOFError('Frame payload truncated')
+            received += count
+        return view
+    
+    def decode(self, view, reuse=True):
+        """Decode JPEG bytes to RGB; with reuse the returned array is overwritten by the next call"""
+        bgr = cv2.imdecode(np.frombuffer(view, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if bgr is None:
+            return None
+        if not reuse:
+            return cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)
+        if self.rgb is None or self.rgb.shape != bgr.shape:
+            self.rgb = np.empty_like(bgr)
+        cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB, dst=self.rgb)
+        return self.rgb
+
+def prepare_frame(frame_data):
+    """Turn a posted frame into the RGB array face_recognition expects"""
+    # Worker mode hands over frames already decoded by FrameDecoder
+    if isinstance(frame_data, np.ndarray):
+        return frame_data
+    
+    frame = decode_frame(frame_data)
+    if frame is None:
+        return None
+    
+    # Convert BGR to RGB if needed
+    if len(frame.shape) == 3 and frame.shape[2] == 3:
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    return frame
+
+def identify_frame(galleries, gallery_key, students, frame_data, section=None, timings=None):
+    """Identify every face in a classroom frame against a section gallery"""
+    timings = timings if timings is not None else StageTimings()
     try:
-        # Load registered face encoding
+        gallery = galleries.get(gallery_key)
+        if gallery is None:
+            if students is None:
+                # Caller resends with the roster; keeps the roster off the hot path
+                return {'galleryMissing': True}
+            with timings.stage('gallery'):
+                gallery = galleries.load(gallery_key, students, section)
+        
+        with timings.stage('decode'):
+            rgb_frame = prepare_frame(frame_data)
+        if rgb_frame is None:
+            return {'faces': [], 'error': 'Failed to decode frame'}
+        
+        result = {'faces': identify_faces(gallery, rgb_frame, detector, timings), 'gallerySize': len(gallery)}
+        if gallery.missing:
+            result['missing'] = gallery.missing
+        return result
+        
+    except Exception as e:
+        print(f"Error in identify_frame: {str(e)}", file=sys.stderr)
+        return {'faces': [], 'error': str(e)}
+
+def registered_encoding_for(registered_url, encoding=None, encoding_model=None):
+    """Prefer the encoding stored at enrollment; fall back to the photo"""
+    registered_encoding = stored_encoding(encoding, encoding_model)
+    if registered_encoding is None:
         registered_encoding = load_registered_image(registered_url)
+    return registered_encoding
+
+def match_result(registered_encoding, face_location, face_encoding, aggregate=None):
+    """Build the result for the first face in a frame.
+
+    With aggregate ({sum, count} of earlier probe encodings in a verification
+    session) the probe encoding is returned too, along with the confidence of
+    the running mean including this frame.
+    """
+    # Get face boundary
+    top, right, bottom, left = face_location
+    
+    # Compare faces - Balanced matching to prevent proxy but allow legitimate matches
+    # Tolerance 0.6 is standard (0.4 is very strict, 0.6 is balanced)
+    matches = face_recognition.compare_faces([registered_encoding], face_encoding, tolerance=0.6)
+    distance = face_recognition.face_distance([registered_encoding], face_encoding)
+    
+    # Calculate confidence
+    confidence = float(1 - distance[0])
+    # Require moderate confidence (0.5 = 50% match) to allow legitimate matches
+    matched = bool(matches[0]) and confidence > 0.5
+    
+    result = {
+        'faceDetected': True,
+        'matched': matched,
+        'confidence': confidence,
+        'x': int(left),
+        'y': int(top),
+        'width': int(right - left),
+        'height': int(bottom - top)
+    }
+    
+    if aggregate is not None:
+        count = int(aggregate.get('count') or 0)
+        total = np.asarray(aggregate.get('sum') or np.zeros(128), dtype=np.float64) + face_encoding
+        mean_distance = face_recognition.face_distance([registered_encoding], total / (count + 1))[0]
+        result['encoding'] = [round(float(v), 6) for v in face_encoding]
+        result['aggregateConfidence'] = float(1 - mean_distance)
+    
+    return result
+
+def compare_frame(registered_url, frame_data, encoding=None, encoding_model=None, track_key=None, timings=None,
+                  aggregate=None):
+    """Compare captured frame with registered face; stage durations go into timings"""
+    timings = timings if timings is not None else StageTimings()
+    try:
+        # Stored encoding, cache hit, or a photo download + encode
+        with timings.stage('reference'):
+            registered_encoding = registered_encoding_for(registered_url, encoding, encoding_model)
         if registered_encoding is None:
             return {'faceDetected': False, 'error': 'Failed to load registered image'}
         
         # Decode frame
-        frame = decode_frame(frame_data)
-        if frame is None:
+        with timings.stage('decode'):
+            rgb_frame = prepare_frame(frame_data)
+        if rgb_frame is None:
             return {'faceDetected': False, 'error': 'Failed to decode frame'}
         
-        # Convert BGR to RGB if needed
-        if len(frame.shape) == 3 and frame.shape[2] == 3:
-            rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        else:
-            rgb_frame = frame
+        # Blurry, dark or overexposed frames never match - skip detection for them
+        with timings.stage('quality'):
+            rejected = quality_gate.check_frame(rgb_frame)
+        if rejected:
+            return {'faceDetected': False, 'rejectedReason': rejected}
         
-        # Detect faces in frame - Use faster model
-        face_locations = face_recognition.face_locations(rgb_frame, model='hog', number_of_times_to_upsample=1)
+        # Detect faces in frame - searches near the student's last face box first
+        with timings.stage('detect'):
+            face_locations = detector.detect(rgb_frame, track_key)
         
         if not face_locations:
             return {'faceDetected': False}
         
-        # Get face encodings - Faster with fewer jitters
-        face_encodings = face_recognition.face_encodings(rgb_frame, face_locations, num_jitters=1)
+        rejected = quality_gate.check_face(face_locations[0])
+        if rejected:
+            return {'faceDetected': False, 'rejectedReason': rejected}
+        
+        # Only the first face is compared, so only it is encoded
+        with timings.stage('encode'):
+            face_encodings = face_recognition.face_encodings(rgb_frame, face_locations[:1], num_jitters=1)
         
         if not face_encodings:
             return {'faceDetected': False}
         
-        # Compare with registered face
-        face_location = face_locations[0]
-        face_encoding = face_encodings[0]
-        
-        # Get face boundary
-        top, right, bottom, left = face_location
-        
-        # Compare faces - Balanced matching to prevent proxy but allow legitimate matches
-        # Tolerance 0.6 is standard (0.4 is very strict, 0.6 is balanced)
-        matches = face_recognition.compare_faces([registered_encoding], face_encoding, tolerance=0.6)
-        distance = face_recognition.face_distance([registered_encoding], face_encoding)
-        
-        # Calculate confidence
-        confidence = float(1 - distance[0])
-        # Require moderate confidence (0.5 = 50% match) to allow legitimate matches
-        matched = bool(matches[0]) and confidence > 0.5
-        
-        return {
-            'faceDetected': True,
-            'matched': matched,
-            'confidence': confidence,
-            'x': int(left),
-            'y': int(top),
-            'width': int(right - left),
-            'height': int(bottom - top)
-        }
+        with timings.stage('match'):
+            return match_result(registered_encoding, face_locations[0], face_encodings[0], aggregate)
         
     except Exception as e:
         print(f"Error in compare_frame: {str(e)}", file=sys.stderr)
         return {'faceDetected': False, 'error': str(e)}
 
+# Cleared the first time the installed dlib turns out not to support batches
+batch_encoding_supported = True
+
+def batch_face_encodings(images, locations, num_jitters=1):
+    """Encode the faces of several frames with one dlib call.
+
+    Falls back to per-frame face_encodings on dlib builds without batch support.
+    """
+    global batch_encoding_supported
+    if len(images) > 1 and batch_encoding_supported:
+        try:
+            import dlib
+            from face_recognition import api
+            batch_faces = []
+            for image, face_locations in zip(images, locations):
+                detections = dlib.full_object_detections()
+                for landmarks in api._raw_face_landmarks(image, face_locations, model='small'):
+                    detections.append(landmarks)
+                batch_faces.append(detections)
+            descriptors = api.face_encoder.compute_face_descriptor(images, batch_faces, num_jitters)
+            return [[np.array(d) for d in per_image] for per_image in descriptors]
+        except (ImportError, AttributeError) as e:
+            batch_encoding_supported = False
+            print(f"Batch encoding unavailable, encoding per frame: {str(e)}", file=sys.stderr)
+        except (TypeError, RuntimeError) as e:
+            # Likely one bad frame - only this batch falls back
+            print(f"Batch encoding failed, encoding this batch per frame: {str(e)}", file=sys.stderr)
+    
+    return [face_recognition.face_encodings(image, face_locations, num_jitters=num_jitters)
+            for image, face_locations in zip(images, locations)]
+
+def compare_batch(items, timings=None):
+    """compare_frame for a micro-batch of frames from different students.
+
+    Detection runs per frame; the encodings of all detected faces are
+    computed together and each item is charged an equal share of that call.
+    """
+    timings = timings if timings is not None else [StageTimings() for _ in items]
+    results = [None] * len(items)
+    pending = []  # (index, registered_encoding, rgb_frame, face_location)
+    
+    for index, item in enumerate(items):
+        try:
+            with timings[index].stage('reference'):
+                registered_encoding = registered_encoding_for(item.get('url'), item.get('encoding'),
+                                                              item.get('encodingModel'))
+            if registered_encoding is None:
+                results[index] = {'faceDetected': False, 'error': 'Failed to load registered image'}
+                continue
+            
+            with timings[index].stage('decode'):
+                rgb_frame = prepare_frame(item.get('frame'))
+            if rgb_frame is None:
+                results[index] = {'faceDetected': False, 'error': 'Failed to decode frame'}
+                continue
+            
+            with timings[index].stage('quality'):
+                rejected = quality_gate.check_frame(rgb_frame)
+            if rejected:
+                results[index] = {'faceDetected': False, 'rejectedReason': rejected}
+                continue
+            
+            with timings[index].stage('detect'):
+                face_locations = detector.detect(rgb_frame, item.get('track'))
+            if not face_locations:
+                results[index] = {'faceDetected': False}
+                continue
+            
+            rejected = quality_gate.check_face(face_locations[0])
+            if rejected:
+                results[index] = {'faceDetected': False, 'rejectedReason': rejected}
+                continue
+            
+            pending.append((index, registered_encoding, rgb_frame, face_locations[0]))
+        except Exception as e:
+            print(f"Error in compare_batch: {str(e)}", file=sys.stderr)
+            results[index] = {'faceDetected': False, 'error': str(e)}
+    
+    if pending:
+        try:
+            batch_timings = StageTimings()
+            with batch_timings.stage('encode'):
+                encodings = batch_face_encodings([p[2] for p in pending], [[p[3]] for p in pending])
+            share = batch_timings.ms['encode'] / len(pending)
+            for (index, registered_encoding, _, face_location), face_encodings in zip(pending, encodings):
+                timings[index].add('encode', share)
+                if face_encodings:
+                    with timings[index].stage('match'):
+                        results[index] = match_result(registered_encoding, face_location, face_encodings[0],
+                                                      items[index].get('aggregate'))
+                else:
+                    results[index] = {'faceDetected': False}
+        except Exception as e:
+            print(f"Error in compare_batch: {str(e)}", file=sys.stderr)
+            for index, *_ in pending:
+                results[index] = {'faceDetected': False, 'error': str(e)}
+    
+    return results
+
+def warm_encodings(students):
+    """Fetch and encode the reference photos of [{rollNumber, url}] ahead of the first frames"""
+    try:
+        encodings = get_default_cache().warm([student['url'] for student in students])
+    except Exception as e:
+        print(f"Error in warm_encodings: {str(e)}", file=sys.stderr)
+        return {'encodings': [], 'failed': [student['rollNumber'] for student in students], 'rejected': [],
+                'error': str(e)}
+    
+    # failed: worth retrying later; rejected: the photo itself can't be used (no face or several)
+    result = {'encodings': [], 'failed': [], 'rejected': [], 'modelVersion': MODEL_VERSION}
+    for student in students:
+        if student['url'] not in encodings:
+            result['failed'].append(student['rollNumber'])
+            continue
+        encoding = encodings[student['url']]
+        if encoding is None:
+            result['rejected'].append(student['rollNumber'])
+        else:
+            result['encodings'].append({'rollNumber': student['rollNumber'],
+                                        'encoding': [float(v) for v in encoding]})
+    return result
+
+def serve():
+    """Long-lived worker mode - models are loaded once and requests arrive on stdin.
+
+    Each request is one JSON header line; if the header carries frameBytes,
+    that many raw JPEG bytes follow it.
+    """
+    # Keep stdout reserved for protocol messages; stray prints from libraries go to stderr
+    out = sys.stdout
+    sys.stdout = sys.stderr
+    stdin = sys.stdin.buffer
+
+    def send(message):
+        out.write(json.dumps(message) + '\n')
+        out.flush()
+
+    galleries = GalleryStore()
+    decoder = FrameDecoder()
+    send({'type': 'ready', 'pid': os.getpid(), 'modelVersion': MODEL_VERSION})
+
+    while True:
+        line = stdin.readline()
+        if not line:
+            break
+        line = line.strip()
+        if not line:
+            continue
+
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            send({'type': 'result', 'id': None, 'result': {'faceDetected': False, 'error': f'Bad request: {str(e)}'}})
+            continue
+
+        # Per-request stage durations, returned with the result
+        timings = StageTimings()
+        frame_bytes = request.get('frameBytes')
+        if frame_bytes:
+            with timings.stage('read'):
+                payload = decoder.read(stdin, frame_bytes)
+            with timings.stage('decode'):
+                request['frame'] = decoder.decode(payload)
+        
+        items = request.get('items') or []
+        item_timings = [StageTimings() for _ in items]
+        if items:
+            # A micro-batch: the frames follow back to back, in item order
+            payload = decoder.read(stdin, sum(item.get('frameBytes', 0) for item in items))
+            offset = 0
+            for item, item_timing in zip(items, item_timings):
+                size = item.get('frameBytes', 0)
+                with item_timing.stage('decode'):
+                    item['frame'] = decoder.decode(payload[offset:offset + size], reuse=False) if size else None
+                offset += size
+
+        request_id = request.get('id')
+        op = request.get('op', 'compare')
+
+        if op == 'ping':
+            send({'type': 'pong', 'id': request_id})
+        elif op == 'compare':
+            result = compare_frame(request.get('url'), request.get('frame'),
+                                   request.get('encoding'), request.get('encodingModel'),
+                                   request.get('track'), timings, request.get('aggregate'))
+            result['timings'] = timings.as_dict()
+            send({'type': 'result', 'id': request_id, 'result': result})
+        elif op == 'batch':
+            results = compare_batch(items, item_timings)
+            for result, item_timing in zip(results, item_timings):
+                result['timings'] = item_timing.as_dict()
+            send({'type': 'result', 'id': request_id, 'results': results})
+        elif op == 'identify':
+            result = identify_frame(galleries, request.get('galleryKey'), request.get('students'),
+                                    request.get('frame'), request.get('section'), timings)
+            result['timings'] = timings.as_dict()
+            send({'type': 'result', 'id': request_id, 'result': result})
+        elif op == 'enroll':
+            send({'type': 'result', 'id': request_id, 'result': enroll_url(request.get('url'))})
+        elif op == 'warm':
+            send({'type': 'result', 'id': request_id, 'result': warm_encodings(request.get('students') or [])})
+        elif op == 'invalidate':
+            get_default_cache().invalidate(request.get('url'))
+            send({'type': 'result', 'id': request_id, 'result': {'invalidated': True}})
+        elif op == 'shutdown':
+            break
+        else:
+            send({'type': 'result', 'id': request_id, 'result': {'faceDetected': False, 'error': f'Unknown op: {op}'}})
+
 if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--worker':
+        try:
+            serve()
+        except KeyboardInterrupt:
+            pass
+        sys.exit(0)
+
     try:
         if len(sys.argv) < 3:
             print(json.dumps({'faceDetected': False, 'error': 'Missing arguments'}), flush=True)
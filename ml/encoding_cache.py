@@ -0,0 +1,287 @@
+import os
+import sys
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from io import BytesIO
+
+import numpy as np
+import face_recognition
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    'FACE_CACHE_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'encodings')
+)
+DEFAULT_MEMORY_ENTRIES = int(os.environ.get('FACE_CACHE_MEMORY_ENTRIES', 512))
+DEFAULT_DISK_ENTRIES = int(os.environ.get('FACE_CACHE_DISK_ENTRIES', 20000))
+# Pruning trims the disk cache to this share of its limit, so it runs once per
+# batch of new entries instead of on every write past the limit
+DISK_PRUNE_TARGET = 0.9
+# Concurrent photo downloads when warming many entries at once
+DEFAULT_FETCH_WORKERS = int(os.environ.get('FACE_CACHE_FETCH_WORKERS', 8))
+
+# Identifies how stored reference encodings were produced; vectors from a
+# different version are ignored and recomputed from the photo
+REFERENCE_JITTERS = 1
+MODEL_VERSION = f"face_recognition-{getattr(face_recognition, '__version__', 'unknown')}/resnet_v1/jitters{REFERENCE_JITTERS}"
+
+
+class EncodingCache:
+    """Reference face encodings keyed by photo URL.
+
+    Lookups go memory (LRU) -> disk (.npy per entry) -> network. The ETag
+    of the downloaded photo is stored alongside the encoding so that an
+    invalidated entry can be revalidated with a conditional GET instead of
+    being downloaded and encoded again.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_memory_entries=DEFAULT_MEMORY_ENTRIES,
+                 max_disk_entries=DEFAULT_DISK_ENTRIES):
+        self.cache_dir = cache_dir
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.memory = OrderedDict()  # url -> (encoding, etag)
+        self.stale = OrderedDict()   # url -> (encoding, etag) of invalidated entries awaiting revalidation
+        self.disk_entries = None     # entries on disk, counted on the first write
+        self.lock = threading.Lock()
+        # Keep-alive connections shared by every download, sized for warm()'s threads
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=DEFAULT_FETCH_WORKERS, pool_maxsize=DEFAULT_FETCH_WORKERS)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+        except OSError as e:
+            print(f"Encoding cache disabled on disk: {str(e)}", file=sys.stderr)
+            self.cache_dir = None
+
+    @staticmethod
+    def key(url):
+        return hashlib.sha1(url.encode('utf-8')).hexdigest()
+
+    def _paths(self, url):
+        base = os.path.join(self.cache_dir, self.key(url))
+        return base + '.npy', base + '.json'
+
+    def _remember(self, url, encoding, etag):
+        with self.lock:
+            self.memory[url] = (encoding, etag)
+            self.memory.move_to_end(url)
+            while len(self.memory) > self.max_memory_entries:
+                self.memory.popitem(last=False)
+
+    def _read_disk(self, url):
+        if not self.cache_dir:
+            return None
+        npy_path, meta_path = self._paths(url)
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if meta.get('url') != url:
+                return None
+            encoding = np.load(npy_path)
+            return encoding, meta.get('etag')
+        except (OSError, ValueError):
+            return None
+
+    def _write_disk(self, url, encoding, etag):
+        if not self.cache_dir:
+            return
+        npy_path, meta_path = self._paths(url)
+        try:
+            if self.disk_entries is None:
+                self.disk_entries = self._count_disk()
+            is_new = not os.path.exists(npy_path)
+
+            # Write-then-rename so concurrent workers never read half a file
+            tmp_npy = f"{npy_path}.{os.getpid()}.tmp"
+            with open(tmp_npy, 'wb') as f:
+                np.save(f, encoding)
+            os.replace(tmp_npy, npy_path)
+
+            tmp_meta = f"{meta_path}.{os.getpid()}.tmp"
+            with open(tmp_meta, 'w') as f:
+                json.dump({'url': url, 'etag': etag}, f)
+            os.replace(tmp_meta, meta_path)
+
+            if is_new:
+                self.disk_entries += 1
+            if self.disk_entries > self.max_disk_entries:
+                self._prune_disk()
+        except OSError as e:
+            print(f"Error writing encoding cache: {str(e)}", file=sys.stderr)
+
+    def _count_disk(self):
+        return sum(1 for name in os.listdir(self.cache_dir) if name.endswith('.npy'))
+
+    def _prune_disk(self):
+        # Other workers write to the same directory, so the count is refreshed here
+        entries = [name for name in os.listdir(self.cache_dir) if name.endswith('.npy')]
+        keep = int(self.max_disk_entries * DISK_PRUNE_TARGET)
+        self.disk_entries = len(entries)
+        if len(entries) <= keep:
+            return
+
+        entries.sort(key=lambda name: os.path.getmtime(os.path.join(self.cache_dir, name)))
+        for name in entries[:len(entries) - keep]:
+            base = os.path.join(self.cache_dir, name[:-len('.npy')])
+            for path in (base + '.npy', base + '.json'):
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+        self.disk_entries = keep
+
+    def get(self, url):
+        """Return a cached encoding without touching the network, or None"""
+        with self.lock:
+            entry = self.memory.get(url)
+            if entry is not None:
+                self.memory.move_to_end(url)
+                return entry[0]
+            if url in self.stale:
+                return None
+
+        entry = self._read_disk(url)
+        if entry is None:
+            return None
+        self._remember(url, *entry)
+        return entry[0]
+
+    def put(self, url, encoding, etag=None):
+        encoding = np.asarray(encoding, dtype=np.float64)
+        self._remember(url, encoding, etag)
+        self._write_disk(url, encoding, etag)
+
+    def invalidate(self, url):
+        """Drop an entry (e.g. the student re-uploaded their photo)"""
+        with self.lock:
+            entry = self.memory.pop(url, None)
+        if entry is None:
+            entry = self._read_disk(url)
+        if entry is None:
+            return
+
+        with self.lock:
+            self.stale[url] = entry
+            self.stale.move_to_end(url)
+            # Bounded like the LRU; an evicted entry just costs a full download later
+            while len(self.stale) > self.max_memory_entries:
+                self.stale.popitem(last=False)
+        if self.cache_dir:
+            npy_path, meta_path = self._paths(url)
+            try:
+                os.unlink(npy_path)
+                if self.disk_entries:
+                    self.disk_entries -= 1
+            except OSError:
+                pass
+            try:
+                os.unlink(meta_path)
+            except OSError:
+                pass
+
+    def load(self, url, timeout=5, num_jitters=REFERENCE_JITTERS):
+        """Return the encoding for url, downloading and encoding only on a miss"""
+        encoding = self.get(url)
+        if encoding is not None:
+            return encoding
+        return self._encode(url, *self._fetch(url, timeout), num_jitters=num_jitters)
+
+    def warm(self, urls, timeout=10, num_jitters=REFERENCE_JITTERS, max_workers=DEFAULT_FETCH_WORKERS):
+        """Load many encodings at once; returns {url: encoding or None}.
+
+        None means the photo was downloaded but doesn't hold exactly one face;
+        photos that couldn't be fetched are left out, so a retry may still work.
+        Downloads run concurrently over the pooled session and each photo is
+        encoded as soon as it arrives.
+        """
+        results = {}
+        missing = []
+        for url in dict.fromkeys(urls):
+            encoding = self.get(url)
+            if encoding is not None:
+                results[url] = encoding
+            else:
+                missing.append(url)
+
+        if not missing:
+            return results
+
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(missing))) as pool:
+            futures = {pool.submit(self._fetch, url, timeout): url for url in missing}
+            for future in as_completed(futures):
+                url = futures[future]
+                try:
+                    results[url] = self._encode(url, *future.result(), num_jitters=num_jitters)
+                except Exception as e:
+                    print(f"Error warming encoding for {url}: {str(e)}", file=sys.stderr)
+        return results
+
+    def _fetch(self, url, timeout):
+        """Download the photo, revalidating an invalidated entry; returns (stale entry, response)"""
+        with self.lock:
+            stale = self.stale.pop(url, None)
+
+        headers = {}
+        if stale is not None and stale[1]:
+            headers['If-None-Match'] = stale[1]
+
+        response = self.session.get(url, timeout=timeout, headers=headers)
+        if response.status_code != 304 or stale is None:
+            response.raise_for_status()
+        return stale, response
+
+    def _encode(self, url, stale, response, num_jitters=REFERENCE_JITTERS):
+        if response.status_code == 304 and stale is not None:
+            # Photo unchanged since it was encoded - keep the old vector
+            self.put(url, stale[0], stale[1])
+            return stale[0]
+
+        image = face_recognition.load_image_file(BytesIO(response.content))
+        _, encoding = encode_reference(image, num_jitters=num_jitters)
+        if encoding is None:
+            return None
+
+        self.put(url, encoding, response.headers.get('ETag'))
+        return encoding
+
+
+def encode_reference(image, num_jitters=REFERENCE_JITTERS):
+    """(faces found, encoding) for a reference photo.
+
+    The encoding is None unless the photo holds exactly one face - with two,
+    there is no telling which of them is the student.
+    """
+    face_locations = face_recognition.face_locations(image, model='hog')
+    if len(face_locations) != 1:
+        return len(face_locations), None
+
+    encodings = face_recognition.face_encodings(image, face_locations, num_jitters=num_jitters)
+    return 1, (encodings[0] if encodings else None)
+
+
+def stored_encoding(encoding, model_version):
+    """Return an encoding saved at enrollment, or None if absent or from another model version"""
+    if not encoding or model_version != MODEL_VERSION:
+        return None
+    encoding = np.asarray(encoding, dtype=np.float64)
+    if encoding.shape != (128,):
+        return None
+    return encoding
+
+
+_default_cache = None
+
+
+def get_default_cache():
+    """Process-wide cache shared by compare_frame and student_face_recognition"""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = EncodingCache()
+    return _default_cache
@@ -0,0 +1,55 @@
+import sys
+import json
+from io import BytesIO
+
+import face_recognition
+
+from encoding_cache import get_default_cache, encode_reference, MODEL_VERSION
+
+
+def enroll_image(image):
+    """Encode a reference photo, requiring exactly one face"""
+    faces, encoding = encode_reference(image)
+
+    if faces == 0:
+        return {'success': False, 'faces': 0, 'error': 'No face found in photo'}
+    if faces > 1:
+        return {'success': False, 'faces': faces, 'error': 'More than one face found in photo'}
+    if encoding is None:
+        return {'success': False, 'faces': 1, 'error': 'Face could not be encoded'}
+
+    return {
+        'success': True,
+        'faces': 1,
+        'encoding': [float(value) for value in encoding],
+        'modelVersion': MODEL_VERSION
+    }
+
+
+def enroll_url(url, timeout=10):
+    """Download a freshly uploaded photo, encode it and seed the encoding cache"""
+    try:
+        cache = get_default_cache()
+        response = cache.session.get(url, timeout=timeout)
+        response.raise_for_status()
+
+        image = face_recognition.load_image_file(BytesIO(response.content))
+        result = enroll_image(image)
+
+        if result['success']:
+            cache.put(url, result['encoding'], response.headers.get('ETag'))
+        return result
+
+    except Exception as e:
+        print(f"Error enrolling photo: {str(e)}", file=sys.stderr)
+        return {'success': False, 'error': str(e)}
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print(json.dumps({'success': False, 'error': 'Missing arguments: photo_url required'}), flush=True)
+        sys.exit(1)
+
+    result = enroll_url(sys.argv[1])
+    print(json.dumps(result), flush=True)
+    sys.exit(0 if result['success'] else 1)
@@ -0,0 +1,199 @@
+import os
+import sys
+import json
+import time
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+import face_recognition
+
+DETECTORS = ('hog', 'cnn', 'haar', 'dnn')
+
+# Defaults are overridable per deployment without code changes
+DEFAULT_DETECTOR = os.environ.get('FACE_DETECTOR', 'hog')
+DEFAULT_UPSAMPLE = int(os.environ.get('FACE_DETECT_UPSAMPLE', 1))
+DEFAULT_SCALE = float(os.environ.get('FACE_DETECT_SCALE', 1.0))
+
+# OpenCV ships the Haar cascades; the res10 SSD weights for 'dnn' must be supplied
+DNN_PROTOTXT = os.environ.get('FACE_DNN_PROTOTXT', '')
+DNN_MODEL = os.environ.get('FACE_DNN_MODEL', '')
+DNN_CONFIDENCE = 0.6
+
+
+class FaceDetector:
+    """Face detection shared by compare_frame and student_face_recognition.
+
+    Frames are optionally downscaled before detection and boxes are mapped back
+    to full-frame (top, right, bottom, left). With tracking, a frame is first
+    searched only around the box last seen for the same track key, falling back
+    to the whole frame when the face is lost.
+    """
+
+    def __init__(self, detector=DEFAULT_DETECTOR, scale=DEFAULT_SCALE, upsample=DEFAULT_UPSAMPLE,
+                 roi_margin=0.6, max_tracks=256, buffers=None):
+        if detector not in DETECTORS:
+            raise ValueError(f"Unknown face detector '{detector}' (expected one of {', '.join(DETECTORS)})")
+
+        self.detector = detector
+        self.scale = scale
+        self.upsample = upsample
+        self.roi_margin = roi_margin
+        self.max_tracks = max_tracks
+        self.tracks = OrderedDict()  # track key -> last full-frame box
+        # Optional FrameBuffers: the downscaled copy is then written into a reused array
+        self.buffers = buffers
+
+        if detector == 'haar':
+            self.cascade = cv2.CascadeClassifier(
+                os.path.join(cv2.data.haarcascades, 'haarcascade_frontalface_default.xml'))
+        elif detector == 'dnn':
+            if not (os.path.exists(DNN_PROTOTXT) and os.path.exists(DNN_MODEL)):
+                raise ValueError('dnn detector needs FACE_DNN_PROTOTXT and FACE_DNN_MODEL (res10 SSD)')
+            self.net = cv2.dnn.readNetFromCaffe(DNN_PROTOTXT, DNN_MODEL)
+
+    def detect(self, rgb_frame, track_key=None):
+        """Return face boxes as full-frame (top, right, bottom, left) tuples"""
+        last_box = self.tracks.get(track_key) if track_key is not None else None
+
+        boxes = []
+        if last_box is not None:
+            top, right, bottom, left = self._roi(rgb_frame, last_box)
+            roi = rgb_frame[top:bottom, left:right]
+            boxes = [(t + top, r + left, b + top, l + left)
+                     for t, r, b, l in self._detect_scaled(roi, pooled=False)]
+
+        if not boxes:
+            boxes = self._detect_scaled(rgb_frame)
+
+        if track_key is not None:
+            if boxes:
+                self.tracks[track_key] = boxes[0]
+                self.tracks.move_to_end(track_key)
+                while len(self.tracks) > self.max_tracks:
+                    self.tracks.popitem(last=False)
+            else:
+                self.tracks.pop(track_key, None)
+
+        return boxes
+
+    def reset(self, track_key=None):
+        if track_key is None:
+            self.tracks.clear()
+        else:
+            self.tracks.pop(track_key, None)
+
+    def _roi(self, frame, box):
+        """The last box grown by roi_margin on every side, clipped to the frame"""
+        top, right, bottom, left = box
+        dy = int((bottom - top) * self.roi_margin)
+        dx = int((right - left) * self.roi_margin)
+        height, width = frame.shape[:2]
+        return max(0, top - dy), min(width, right + dx), min(height, bottom + dy), max(0, left - dx)
+
+    def _detect_scaled(self, rgb_frame, pooled=True):
+        """Detect on a downscaled copy. Only full frames use the reused buffer: ROI
+        crops change size every frame, and a small crop is cheap to allocate anyway"""
+        if rgb_frame.size == 0:
+            return []
+        if self.scale == 1.0:
+            return self._detect(rgb_frame)
+
+        height, width = rgb_frame.shape[:2]
+        size = (max(1, int(round(width * self.scale))), max(1, int(round(height * self.scale))))
+        dst = None
+        if pooled and self.buffers:
+            dst = self.buffers.get('detect', (size[1], size[0]) + rgb_frame.shape[2:])
+        small = cv2.resize(rgb_frame, size, dst=dst, interpolation=cv2.INTER_AREA)
+        factor = 1.0 / self.scale
+        return [tuple(int(round(v * factor)) for v in box) for box in self._detect(small)]
+
+    def _detect(self, rgb_frame):
+        if self.detector in ('hog', 'cnn'):
+            return face_recognition.face_locations(rgb_frame, model=self.detector,
+                                                   number_of_times_to_upsample=self.upsample)
+
+        if self.detector == 'haar':
+            gray = cv2.cvtColor(rgb_frame, cv2.COLOR_RGB2GRAY)
+            rects = self.cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(40, 40))
+            return [(int(y), int(x + w), int(y + h), int(x)) for x, y, w, h in rects]
+
+        # dnn: res10 SSD expects 300x300 BGR with these channel means
+        height, width = rgb_frame.shape[:2]
+        bgr = cv2.cvtColor(cv2.resize(rgb_frame, (300, 300)), cv2.COLOR_RGB2BGR)
+        blob = cv2.dnn.blobFromImage(bgr, 1.0, (300, 300), (104.0, 177.0, 123.0), swapRB=False)
+        self.net.setInput(blob)
+        detections = self.net.forward()[0, 0]
+        boxes = []
+        for detection in detections:
+            if detection[2] < DNN_CONFIDENCE:
+                continue
+            left, top, right, bottom = (detection[3:7] * np.array([width, height, width, height])).astype(int)
+            boxes.append((max(0, int(top)), min(width, int(right)), min(height, int(bottom)), max(0, int(left))))
+        return boxes
+
+
+def box_iou(a, b):
+    """Intersection over union of two (top, right, bottom, left) boxes"""
+    top, right = max(a[0], b[0]), min(a[1], b[1])
+    bottom, left = min(a[2], b[2]), max(a[3], b[3])
+    inter = max(0, right - left) * max(0, bottom - top)
+    area = lambda box: (box[1] - box[3]) * (box[2] - box[0])
+    union = area(a) + area(b) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def benchmark(image_dir, detectors=DETECTORS, scales=(1.0, 0.5)):
+    """Per-detector latency and recall on a folder of images.
+
+    image_dir/labels.json maps file name -> list of [top, right, bottom, left]
+    ground-truth boxes; a ground-truth face counts as found at IoU >= 0.5.
+    """
+    with open(os.path.join(image_dir, 'labels.json')) as f:
+        labels = json.load(f)
+
+    images = {}
+    for name in labels:
+        image = cv2.imread(os.path.join(image_dir, name))
+        if image is not None:
+            images[name] = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+    report = []
+    for name in detectors:
+        for scale in scales:
+            try:
+                detector = FaceDetector(name, scale=scale)
+            except ValueError as e:
+                report.append({'detector': name, 'scale': scale, 'skipped': str(e)})
+                continue
+
+            found = total = 0
+            elapsed = []
+            for file_name, image in images.items():
+                start = time.perf_counter()
+                boxes = detector.detect(image)
+                elapsed.append(time.perf_counter() - start)
+
+                truth = labels[file_name]
+                total += len(truth)
+                found += sum(1 for gt in truth if any(box_iou(gt, box) >= 0.5 for box in boxes))
+
+            report.append({
+                'detector': name,
+                'scale': scale,
+                'images': len(elapsed),
+                'meanMs': round(1000 * float(np.mean(elapsed)), 2) if elapsed else None,
+                'p95Ms': round(1000 * float(np.percentile(elapsed, 95)), 2) if elapsed else None,
+                'recall': round(found / total, 4) if total else None
+            })
+            print(json.dumps(report[-1]), file=sys.stderr)
+
+    return report
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 2 and sys.argv[1] == '--benchmark':
+        print(json.dumps({'benchmark': 'face_detection', 'results': benchmark(sys.argv[2])}), flush=True)
+    else:
+        print('Usage: python face_detection.py --benchmark <image_dir with labels.json>', file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,31 @@
+import numpy as np
+
+
+class FrameBuffers:
+    """Preallocated destination arrays for per-frame OpenCV calls, by name.
+
+    get() hands back the same array for a name as long as the requested shape
+    and dtype don't change, so passing it as dst= turns a per-frame allocation
+    into a write into existing memory. Disabled, get() returns None and OpenCV
+    allocates as usual. A buffer is only safe to reuse by the one thread that
+    owns its name, and only once nothing else holds the previous frame.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.arrays = {}
+        self.allocations = 0
+
+    def get(self, name, shape, dtype=np.uint8):
+        if not self.enabled:
+            return None
+        array = self.arrays.get(name)
+        if array is None or array.shape != tuple(shape) or array.dtype != dtype:
+            array = np.empty(shape, dtype=dtype)
+            self.arrays[name] = array
+            self.allocations += 1
+        return array
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in self.arrays.values())
@@ -0,0 +1,60 @@
+import os
+
+import cv2
+import numpy as np
+
+# Thresholds are overridable per deployment; a value of 0 disables that check
+MIN_SHARPNESS = float(os.environ.get('FACE_MIN_SHARPNESS', 12.0))
+MIN_BRIGHTNESS = float(os.environ.get('FACE_MIN_BRIGHTNESS', 40.0))
+MAX_BRIGHTNESS = float(os.environ.get('FACE_MAX_BRIGHTNESS', 220.0))
+MIN_FACE_PX = int(os.environ.get('FACE_MIN_FACE_PX', 48))
+
+# Sharpness and brightness are measured on a copy this wide, so thresholds
+# don't depend on the camera resolution
+PROBE_WIDTH = 160
+
+
+class QualityGate:
+    """Rejects frames that can't produce a usable match before any dlib work.
+
+    check_frame() looks at blur (variance of the Laplacian) and exposure
+    (mean brightness) of a small grayscale copy; check_face() rejects face
+    boxes too small for a reliable encoding. Both return a rejectedReason
+    string, or None if the frame may proceed.
+    """
+
+    def __init__(self, min_sharpness=MIN_SHARPNESS, min_brightness=MIN_BRIGHTNESS,
+                 max_brightness=MAX_BRIGHTNESS, min_face_px=MIN_FACE_PX):
+        self.min_sharpness = min_sharpness
+        self.min_brightness = min_brightness
+        self.max_brightness = max_brightness
+        self.min_face_px = min_face_px
+
+    def measure(self, rgb_frame):
+        """(sharpness, brightness) of an RGB frame"""
+        height, width = rgb_frame.shape[:2]
+        if width > PROBE_WIDTH:
+            probe_height = max(1, int(height * PROBE_WIDTH / width))
+            small = cv2.resize(rgb_frame, (PROBE_WIDTH, probe_height), interpolation=cv2.INTER_AREA)
+        else:
+            small = rgb_frame
+        gray = cv2.cvtColor(small, cv2.COLOR_RGB2GRAY)
+        sharpness = float(cv2.Laplacian(gray, cv2.CV_32F).var())
+        brightness = float(np.mean(gray))
+        return sharpness, brightness
+
+    def check_frame(self, rgb_frame):
+        sharpness, brightness = self.measure(rgb_frame)
+        if self.min_brightness and brightness < self.min_brightness:
+            return 'too_dark'
+        if self.max_brightness and brightness > self.max_brightness:
+            return 'overexposed'
+        if self.min_sharpness and sharpness < self.min_sharpness:
+            return 'blurry'
+        return None
+
+    def check_face(self, face_location):
+        top, right, bottom, left = face_location
+        if self.min_face_px and min(bottom - top, right - left) < self.min_face_px:
+            return 'face_too_small'
+        return None
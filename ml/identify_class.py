@@ -0,0 +1,206 @@
+import os
+import sys
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+import face_recognition
+
+from encoding_cache import get_default_cache, stored_encoding, DEFAULT_CACHE_DIR
+from ann_index import FaceIndex, EXACT_THRESHOLD
+from stage_timing import StageTimings
+
+# Same thresholds as the 1:1 check in compare_frame
+MATCH_TOLERANCE = 0.6
+MIN_CONFIDENCE = 0.5
+
+# Candidates per face taken from the ANN index before one-to-one assignment
+INDEX_CANDIDATES = 5
+
+INDEX_DIR = os.path.join(os.path.dirname(DEFAULT_CACHE_DIR), 'indexes')
+
+
+class EncodingGallery:
+    """All enrolled encodings of a section as one contiguous N x 128 float32 matrix"""
+
+    def __init__(self, roll_numbers, encodings, index=None, missing=None):
+        self.roll_numbers = list(roll_numbers)
+        # Students left out for want of a usable encoding
+        self.missing = list(missing or [])
+        self.columns = {roll_number: column for column, roll_number in enumerate(self.roll_numbers)}
+        self.index = index
+        if encodings:
+            self.matrix = np.ascontiguousarray(np.vstack(encodings), dtype=np.float32)
+        else:
+            self.matrix = np.empty((0, 128), dtype=np.float32)
+        # Squared norms are reused by every distance computation
+        self.sq_norms = np.einsum('ij,ij->i', self.matrix, self.matrix)
+
+    def __len__(self):
+        return len(self.roll_numbers)
+
+    @classmethod
+    def from_students(cls, students, fetch_missing=True):
+        """Build from [{rollNumber, encoding, encodingModel, photo}].
+
+        Stored and cached encodings are used as they are. Other photos are
+        downloaded and encoded only with fetch_missing; otherwise those
+        students are listed in gallery.missing so they can be warmed separately.
+        """
+        roll_numbers = []
+        encodings = []
+        missing = []
+        cache = get_default_cache()
+
+        for student in students:
+            encoding = stored_encoding(student.get('encoding'), student.get('encodingModel'))
+            if encoding is None and student.get('photo'):
+                try:
+                    encoding = cache.load(student['photo']) if fetch_missing else cache.get(student['photo'])
+                except Exception as e:
+                    print(f"Error loading photo for {student.get('rollNumber')}: {str(e)}", file=sys.stderr)
+            if encoding is None:
+                missing.append(student['rollNumber'])
+                continue
+            roll_numbers.append(student['rollNumber'])
+            encodings.append(encoding)
+
+        return cls(roll_numbers, encodings, missing=missing)
+
+    def distances(self, probes):
+        """Euclidean distances, shape (len(probes), len(self)), in one matrix product.
+
+        Large galleries go through the ANN index instead; pairs it did not
+        propose are reported as inf.
+        """
+        probes = np.asarray(probes, dtype=np.float32).reshape(-1, 128)
+        if self.index is not None:
+            return self._indexed_distances(probes)
+
+        probe_sq = np.einsum('ij,ij->i', probes, probes)
+        sq = probe_sq[:, None] + self.sq_norms[None, :] - 2.0 * (probes @ self.matrix.T)
+        return np.sqrt(np.maximum(sq, 0.0))
+
+    def _indexed_distances(self, probes):
+        out = np.full((len(probes), len(self)), np.inf, dtype=np.float32)
+        distances, labels = self.index.search(probes, k=INDEX_CANDIDATES)
+        for face in range(len(probes)):
+            for distance, label in zip(distances[face], labels[face]):
+                column = self.columns.get(int(label))
+                if column is not None:
+                    out[face, column] = distance
+        return out
+
+
+def assign_matches(distances, tolerance=MATCH_TOLERANCE):
+    """Greedy one-to-one assignment of faces to students, closest pairs first.
+
+    Returns {face_index: student_index}; a student is never given to two faces.
+    """
+    if distances.size == 0:
+        return {}
+
+    order = np.argsort(distances, axis=None)
+    faces, students = np.unravel_index(order, distances.shape)
+    assigned = {}
+    taken = set()
+
+    for face, student in zip(faces.tolist(), students.tolist()):
+        if distances[face, student] > tolerance:
+            break
+        if face in assigned or student in taken:
+            continue
+        assigned[face] = student
+        taken.add(student)
+        if len(assigned) == distances.shape[0]:
+            break
+
+    return assigned
+
+
+def identify_faces(gallery, rgb_frame, detector, timings=None):
+    """Detect every face in a classroom frame and identify it against the gallery"""
+    timings = timings if timings is not None else StageTimings()
+    with timings.stage('detect'):
+        face_locations = detector.detect(rgb_frame)
+    if not face_locations:
+        return []
+
+    with timings.stage('encode'):
+        face_encodings = face_recognition.face_encodings(rgb_frame, face_locations, num_jitters=1)
+    if not face_encodings or len(gallery) == 0:
+        assigned = {}
+        distances = None
+    else:
+        with timings.stage('match'):
+            distances = gallery.distances(face_encodings)
+            assigned = assign_matches(distances)
+
+    faces = []
+    for index, (top, right, bottom, left) in enumerate(face_locations[:len(face_encodings)]):
+        face = {
+            'rollNumber': None,
+            'matched': False,
+            'confidence': 0.0,
+            'x': int(left),
+            'y': int(top),
+            'width': int(right - left),
+            'height': int(bottom - top)
+        }
+        if index in assigned:
+            student = assigned[index]
+            confidence = float(1 - distances[index, student])
+            if confidence > MIN_CONFIDENCE:
+                face['rollNumber'] = gallery.roll_numbers[student]
+                face['matched'] = True
+                face['confidence'] = confidence
+        faces.append(face)
+
+    return faces
+
+
+class GalleryStore:
+    """The few most recently used section galleries of a worker process"""
+
+    def __init__(self, max_galleries=8, index_dir=INDEX_DIR):
+        self.max_galleries = max_galleries
+        self.index_dir = index_dir
+        self.galleries = OrderedDict()
+        self.indexes = {}  # section -> FaceIndex, kept across roster changes
+
+    def get(self, key):
+        gallery = self.galleries.get(key)
+        if gallery is not None:
+            self.galleries.move_to_end(key)
+        return gallery
+
+    def load(self, key, students, section=None):
+        # Never downloads: a live identify request can't wait for a section's photos
+        gallery = EncodingGallery.from_students(students, fetch_missing=False)
+        if section is not None and len(gallery) >= EXACT_THRESHOLD:
+            gallery.index = self._section_index(section, gallery)
+        self.galleries[key] = gallery
+        self.galleries.move_to_end(key)
+        while len(self.galleries) > self.max_galleries:
+            self.galleries.popitem(last=False)
+        return gallery
+
+    def _section_index(self, section, gallery):
+        """Bring the section's persisted index in line with the roster incrementally"""
+        path = os.path.join(self.index_dir, hashlib.sha1(section.encode('utf-8')).hexdigest())
+        index = self.indexes.get(section)
+
+        if index is None:
+            try:
+                index = FaceIndex.load(path)
+            except (OSError, ValueError, KeyError):
+                index = FaceIndex()
+
+        if index.sync(gallery.roll_numbers, gallery.matrix):
+            try:
+                index.save(path)
+            except OSError as e:
+                print(f"Error saving face index: {str(e)}", file=sys.stderr)
+
+        self.indexes[section] = index
+        return index
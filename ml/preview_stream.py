@@ -0,0 +1,102 @@
+import sys
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+
+BOUNDARY = b'frame'
+
+
+class PreviewServer:
+    """Optional MJPEG-over-HTTP preview of the annotated camera feed.
+
+    Frames are only JPEG-encoded while at least one viewer is connected and
+    never faster than max_fps, so a headless run pays nothing for the preview.
+    Open http://<host>:<port>/preview.mjpg in a browser or an <img> tag.
+    """
+
+    def __init__(self, port, host='127.0.0.1', max_fps=10, quality=80):
+        self.max_fps = max_fps
+        self.quality = quality
+        self.condition = threading.Condition()
+        self.jpeg = None
+        self.seq = 0
+        self.clients = 0
+        self.closed = False
+        self.last_publish = 0.0
+
+        preview = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/preview.mjpg':
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', f"multipart/x-mixed-replace; boundary={BOUNDARY.decode()}")
+                self.send_header('Cache-Control', 'no-cache')
+                self.send_header('Access-Control-Allow-Origin', '*')
+                self.end_headers()
+                preview.serve_client(self.wfile)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/preview.mjpg"
+
+    def wants_frame(self):
+        """True if a viewer is connected and the rate limit allows another frame"""
+        return self.clients > 0 and time.monotonic() - self.last_publish >= 1.0 / self.max_fps
+
+    def publish(self, frame):
+        """JPEG-encode an annotated BGR frame and hand it to all viewers"""
+        ok, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        if not ok:
+            return
+        with self.condition:
+            self.jpeg = buffer.tobytes()
+            self.seq += 1
+            self.last_publish = time.monotonic()
+            self.condition.notify_all()
+
+    def serve_client(self, wfile):
+        with self.condition:
+            self.clients += 1
+        seq = 0
+        try:
+            while True:
+                with self.condition:
+                    self.condition.wait_for(lambda: self.seq > seq or self.closed, timeout=1.0)
+                    if self.closed:
+                        return
+                    if self.seq == seq:
+                        continue
+                    seq, jpeg = self.seq, self.jpeg
+                wfile.write(b'--' + BOUNDARY + b'\r\nContent-Type: image/jpeg\r\nContent-Length: '
+                            + str(len(jpeg)).encode() + b'\r\n\r\n' + jpeg + b'\r\n')
+                wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            with self.condition:
+                self.clients -= 1
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        try:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+        except Exception as e:
+            print(f"Error closing preview server: {str(e)}", file=sys.stderr)
@@ -0,0 +1,51 @@
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+
+class StageTimings:
+    """Wall time of each pipeline stage of one request, in milliseconds"""
+
+    def __init__(self):
+        self.ms = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, 1000 * (time.perf_counter() - start))
+
+    def add(self, name, ms):
+        self.ms[name] = self.ms.get(name, 0.0) + ms
+
+    def as_dict(self):
+        return {name: round(ms, 2) for name, ms in self.ms.items()}
+
+
+class StageStats:
+    """Per-stage latency summary over many requests (e.g. one recognition session)"""
+
+    def __init__(self, max_samples=2000):
+        self.max_samples = max_samples
+        self.samples = {}
+
+    def record(self, timings):
+        for name, ms in timings.ms.items():
+            samples = self.samples.setdefault(name, [])
+            if len(samples) < self.max_samples:
+                samples.append(ms)
+
+    def summary(self):
+        report = {}
+        for name, samples in self.samples.items():
+            ms = np.asarray(samples)
+            report[name] = {
+                'count': len(samples),
+                'meanMs': round(float(np.mean(ms)), 2),
+                'p95Ms': round(float(np.percentile(ms, 95)), 2),
+                'p99Ms': round(float(np.percentile(ms, 99)), 2)
+            }
+        return report
@@ -4,11 +4,13 @@ import cv2
 import numpy as np
 import face_recognition
 import logging
-import requests
-import os
-import tempfile
-import base64
+import threading
 from datetime import datetime
+from encoding_cache import get_default_cache, stored_encoding
+from face_detection import FaceDetector, box_iou
+from frame_buffers import FrameBuffers
+from preview_stream import PreviewServer
+from stage_timing import StageTimings, StageStats
 
 # Setup logging
 logging.basicConfig(
@@ -18,47 +20,86 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+class LatestFrame:
+    """Single-slot mailbox between pipeline stages: a new frame replaces the old
+    one, so slow consumers skip stale frames instead of queueing them"""
+    
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.frame = None
+        self.seq = 0
+        self.closed = False
+    
+    def put(self, frame):
+        with self.condition:
+            self.frame = frame
+            self.seq += 1
+            self.condition.notify_all()
+    
+    def get(self, after_seq, timeout=None):
+        """Wait for a frame newer than after_seq; returns (seq, frame) or (after_seq, None)"""
+        with self.condition:
+            self.condition.wait_for(lambda: self.seq > after_seq or self.closed, timeout)
+            if self.seq > after_seq and not self.closed:
+                return self.seq, self.frame
+            return after_seq, None
+    
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
 class FaceRecognitionStream:
-    def __init__(self, registered_image_url, roll_number):
+    def __init__(self, registered_image_url, roll_number, encoding=None, encoding_model=None,
+                 preview_port=None, preview_fps=10, reuse_buffers=True):
         self.registered_image_url = registered_image_url
         self.roll_number = roll_number
-        self.registered_encoding = None
+        # Annotated preview is optional and served as MJPEG, never printed to stdout
+        self.preview_port = preview_port
+        self.preview_fps = preview_fps
+        self.preview = None
+        self.registered_encoding = stored_encoding(encoding, encoding_model)
         self.camera = None
+        self.frame_shape = None
+        # Per-frame OpenCV outputs (mirror, RGB, detection copy, preview) go into reused arrays
+        self.buffers = FrameBuffers(enabled=reuse_buffers)
+        # Half-resolution detection, then only the region around the last face
+        self.detector = FaceDetector(scale=0.5, buffers=self.buffers)
         self.consecutive_matches = 0
         self.required_matches = 5
         self.best_confidence = 0.0
         self.recognition_complete = False
         self.success = False
+        # Incremental evaluation: reuse the last distance while the face is static,
+        # but re-encode at least every reencode_interval frames (liveness)
+        self.reencode_interval = 4
+        self.static_iou = 0.85
+        self.motion_threshold = 6.0
+        self.last_evaluation = None  # (face_location, face signature, distance)
+        self.frames_since_encode = 0
+        self.encodings_computed = 0
+        self.encodings_reused = 0
+        # Latest recognition, shared between the recognition and output threads
+        self.state_lock = threading.Lock()
+        self.latest_overlay = None
+        # Per-stage latency over the session, reported with the final result
+        self.stage_stats = StageStats()
         
     def download_and_encode_registered_image(self):
-        """Download registered image and get face encoding"""
+        """Download registered image and get face encoding (via the shared encoding cache)"""
         try:
-            logger.info(f"Downloading registered image: {self.registered_image_url}")
+            logger.info(f"Loading registered image: {self.registered_image_url}")
             
-            # Download image
-            response = requests.get(self.registered_image_url, timeout=15)
-            response.raise_for_status()
+            timings = StageTimings()
+            with timings.stage('reference'):
+                encoding = get_default_cache().load(self.registered_image_url, timeout=15)
+            self.stage_stats.record(timings)
             
-            # Save to temp file
-            temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.jpg')
-            temp_file.write(response.content)
-            temp_file.close()
-            
-            # Load and encode face
-            image = face_recognition.load_image_file(temp_file.name)
-            face_encodings = face_recognition.face_encodings(image)
-            
-            # Cleanup
-            try:
-                os.unlink(temp_file.name)
-            except:
-                pass
-            
-            if len(face_encodings) == 0:
+            if encoding is None:
                 logger.error("No face found in registered image")
                 return False
             
-            self.registered_encoding = face_encodings[0]
+            self.registered_encoding = encoding
             logger.info("✓ Registered face encoding extracted")
             return True
             
@@ -83,10 +124,11 @@ class FaceRecognitionStream:
             
             # Warm up camera
             for _ in range(5):
-                ret, _ = self.camera.read()
+                ret, frame = self.camera.read()
                 if not ret:
                     logger.error("Camera warmup failed")
                     return False
+            self.frame_shape = frame.shape
             
             logger.info("✓ Camera initialized")
             return True
@@ -161,10 +203,14 @@ class FaceRecognitionStream:
         """Add status text overlay at top of frame"""
         height, width = frame.shape[:2]
         
-        # Semi-transparent overlay bar
-        overlay = frame.copy()
-        cv2.rectangle(overlay, (0, 0), (width, 50), (0, 0, 0), -1)
-        cv2.addWeighted(overlay, 0.7, frame, 0.3, 0, frame)
+        # Semi-transparent black bar: 70% black over the frame is 30% of the bar itself
+        if self.buffers.enabled:
+            bar = frame[:51]  # rows 0-50, as the filled rectangle to y=50 covered
+            cv2.addWeighted(bar, 0.3, bar, 0, 0, bar)
+        else:
+            overlay = frame.copy()
+            cv2.rectangle(overlay, (0, 0), (width, 50), (0, 0, 0), -1)
+            cv2.addWeighted(overlay, 0.7, frame, 0.3, 0, frame)
         
         # Status text
         cv2.putText(frame, status_text, (10, 30),
@@ -177,76 +223,77 @@ class FaceRecognitionStream:
         
         return frame
     
-    def process_frame(self):
-        """Process single frame and return result"""
-        ret, frame = self.camera.read()
-        
-        if not ret:
-            logger.error("Failed to read frame")
-            return None, None
-        
-        # Flip frame horizontally for mirror effect
-        frame = cv2.flip(frame, 1)
+    def recognize(self, frame, timings=None):
+        """Detect, encode and compare the face in one (already flipped) BGR frame.
+
+        Returns (result, overlay) where overlay holds what render() needs to draw.
+        """
+        timings = timings if timings is not None else StageTimings()
         
         # Convert to RGB for face_recognition
-        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        
-        # Resize for faster processing
-        small_frame = cv2.resize(rgb_frame, (0, 0), fx=0.5, fy=0.5)
+        with timings.stage('color'):
+            rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=self.buffers.get('rgb', frame.shape))
         
-        # Detect faces
-        face_locations = face_recognition.face_locations(small_frame, model='hog')
+        # Detect faces (downscaled and ROI-tracked by the shared detector)
+        with timings.stage('detect'):
+            face_locations = self.detector.detect(rgb_frame, track_key=self.roll_number)
         
         if len(face_locations) == 0:
             # No face detected
             self.consecutive_matches = 0
-            frame = self.add_status_overlay(frame, "No face detected - Position your face", (0, 165, 255))
-            return frame, {
+            self.last_evaluation = None
+            return {
                 'face_detected': False,
                 'match': False,
                 'confidence': 0.0,
                 'consecutive_matches': 0
-            }
-        
-        # Get face encodings
-        face_encodings = face_recognition.face_encodings(small_frame, face_locations)
-        
-        if len(face_encodings) == 0:
-            self.consecutive_matches = 0
-            frame = self.add_status_overlay(frame, "Face detected but cannot encode", (0, 165, 255))
-            return frame, {
-                'face_detected': True,
-                'match': False,
-                'confidence': 0.0,
-                'consecutive_matches': 0
-            }
+            }, {'status': ("No face detected - Position your face", (0, 165, 255))}
         
-        # Compare with registered face
-        face_encoding = face_encodings[0]
         face_location = face_locations[0]
+        with timings.stage('motion'):
+            signature = self.face_signature(frame, face_location)
+            reused = self.is_static(face_location, signature)
+        if reused:
+            # Same face, same place, same pixels: the encoding would not change
+            distance = self.last_evaluation[2]
+            self.frames_since_encode += 1
+            self.encodings_reused += 1
+        else:
+            # Get face encodings
+            with timings.stage('encode'):
+                face_encodings = face_recognition.face_encodings(rgb_frame, face_locations[:1])
+            
+            if len(face_encodings) == 0:
+                self.consecutive_matches = 0
+                self.last_evaluation = None
+                return {
+                    'face_detected': True,
+                    'match': False,
+                    'confidence': 0.0,
+                    'consecutive_matches': 0
+                }, {'status': ("Face detected but cannot encode", (0, 165, 255))}
+            
+            # Compare with registered face
+            with timings.stage('match'):
+                distance = face_recognition.face_distance([self.registered_encoding], face_encodings[0])[0]
+            self.frames_since_encode = 0
+            self.encodings_computed += 1
         
-        # Scale face location back to original size
-        top, right, bottom, left = face_location
-        top *= 2
-        right *= 2
-        bottom *= 2
-        left *= 2
-        scaled_location = (top, right, bottom, left)
-        
-        # Compare faces
-        matches = face_recognition.compare_faces([self.registered_encoding], face_encoding, tolerance=0.5)
-        face_distance = face_recognition.face_distance([self.registered_encoding], face_encoding)
+        self.last_evaluation = (face_location, signature, distance)
         
-        confidence = 1 - face_distance[0]
-        is_match = matches[0] and confidence > 0.45
+        # Same rule as compare_faces(tolerance=0.5) plus the confidence floor
+        confidence = 1 - distance
+        is_match = distance <= 0.5 and confidence > 0.45
         
         # Update best confidence
         if confidence > self.best_confidence:
             self.best_confidence = confidence
         
-        # Update consecutive matches
+        # Update consecutive matches - only freshly encoded frames count; a reused
+        # distance keeps the streak alive but never advances it
         if is_match:
-            self.consecutive_matches += 1
+            if not reused:
+                self.consecutive_matches += 1
             status_text = f"Face Matched! ({self.consecutive_matches}/{self.required_matches})"
             status_color = (0, 255, 0)
         else:
@@ -254,37 +301,146 @@ class FaceRecognitionStream:
             status_text = f"Scanning... {int(confidence * 100)}%"
             status_color = (0, 0, 255)
         
-        # Draw face boundary
-        frame = self.draw_face_boundary(frame, scaled_location, is_match, confidence)
-        
-        # Add status overlay
-        frame = self.add_status_overlay(frame, status_text, status_color)
-        
-        # Check if recognition is complete
+        # Check if recognition is complete: required_matches real encodings in a row
         if self.consecutive_matches >= self.required_matches:
             self.recognition_complete = True
             self.success = True
             logger.info(f"✓ RECOGNITION COMPLETE! Confidence: {confidence:.2f}")
         
-        return frame, {
+        return {
             'face_detected': True,
-            'match': is_match,
+            'match': bool(is_match),
             'confidence': float(confidence),
             'consecutive_matches': self.consecutive_matches,
-            'recognition_complete': self.recognition_complete
+            'recognition_complete': self.recognition_complete,
+            'reused': reused
+        }, {
+            'status': (status_text, status_color),
+            'box': (face_location, is_match, confidence)
         }
     
-    def frame_to_base64(self, frame):
-        """Convert frame to base64 JPEG"""
-        _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 80])
-        jpg_as_text = base64.b64encode(buffer).decode('utf-8')
-        return jpg_as_text
+    def face_signature(self, frame, face_location):
+        """Tiny grayscale thumbnail of the face region for cheap motion checks"""
+        top, right, bottom, left = face_location
+        crop = frame[max(0, top):max(0, bottom), max(0, left):max(0, right)]
+        if crop.size == 0:
+            return None
+        gray = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY)
+        return cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.int16)
+    
+    def is_static(self, face_location, signature):
+        """True when the previous distance can stand in for a fresh encoding"""
+        if self.last_evaluation is None or signature is None:
+            return False
+        if self.frames_since_encode + 1 >= self.reencode_interval:
+            return False
+        
+        last_location, last_signature, _ = self.last_evaluation
+        if last_signature is None or box_iou(face_location, last_location) < self.static_iou:
+            return False
+        return float(np.mean(np.abs(signature - last_signature))) < self.motion_threshold
+    
+    def render(self, frame, overlay):
+        """Draw the latest recognition overlay onto a preview frame"""
+        if overlay is None:
+            return self.add_status_overlay(frame, "Scanning...", (255, 255, 255))
+        
+        if 'box' in overlay:
+            frame = self.draw_face_boundary(frame, *overlay['box'])
+        return self.add_status_overlay(frame, *overlay['status'])
+    
+    def read_frame(self, name):
+        """Read the next camera frame, into the named buffer once the frame size is known"""
+        buffer = self.buffers.get(name, self.frame_shape) if self.frame_shape else None
+        return self.camera.read(buffer)
+    
+    def mirror(self, frame, name=None):
+        """Flip horizontally for the mirror effect; into the named buffer if given"""
+        dst = self.buffers.get(name, frame.shape) if name else None
+        return cv2.flip(frame, 1, dst=dst)
+    
+    def preview_copy(self, frame):
+        """Private copy of a shared frame for the preview encoder to draw on"""
+        buffer = self.buffers.get('preview', frame.shape)
+        if buffer is None:
+            return frame.copy()
+        np.copyto(buffer, frame)
+        return buffer
+    
+    def process_frame(self):
+        """Process single frame serially and return (annotated frame, result).
+
+        The returned frame lives in a reused buffer and is overwritten by the next call.
+        """
+        ret, frame = self.read_frame('camera')
+        
+        if not ret:
+            logger.error("Failed to read frame")
+            return None, None
+        
+        frame = self.mirror(frame, 'mirror')
+        
+        result, overlay = self.recognize(frame)
+        return self.render(frame, overlay), result
+    
+    def capture_loop(self, frames, stop, max_frames):
+        """Producer: keep the freshest camera frame in the slot at camera FPS"""
+        captured = 0
+        failures = 0
+        while not stop.is_set() and captured < max_frames:
+            ret, frame = self.read_frame('camera')
+            if not ret:
+                failures += 1
+                if failures > 30:
+                    logger.error("Camera stopped delivering frames")
+                    break
+                continue
+            failures = 0
+            
+            # The mirrored frame is shared with the other threads, so it gets fresh memory
+            frames.put(self.mirror(frame))
+            captured += 1
+    
+    def recognition_loop(self, frames, stop):
+        """Consumer: always recognize the newest frame, skipping any that went stale meanwhile"""
+        seq = 0
+        while not stop.is_set():
+            seq, frame = frames.get(seq, timeout=0.5)
+            if frame is None:
+                continue
+            
+            timings = StageTimings()
+            result, overlay = self.recognize(frame, timings)
+            with self.state_lock:
+                self.latest_overlay = overlay
+            self.stage_stats.record(timings)
+            result['timings'] = timings.as_dict()
+            
+            # Small JSON event per recognition; preview pixels go over HTTP
+            print(json.dumps({'type': 'result', 'result': result}), flush=True)
+            
+            if self.recognition_complete:
+                stop.set()
+    
+    def output_loop(self, frames, stop):
+        """Preview encoder: annotate and publish frames, only while someone is watching"""
+        seq = 0
+        while not stop.is_set():
+            seq, frame = frames.get(seq, timeout=0.5)
+            if frame is None or not self.preview.wants_frame():
+                continue
+            
+            with self.state_lock:
+                overlay = self.latest_overlay
+            
+            # The recognition thread may still be reading this frame - draw on a copy
+            self.preview.publish(self.render(self.preview_copy(frame), overlay))
     
     def run(self):
-        """Main recognition loop"""
+        """Main recognition loop: capture, recognition and output run on separate threads"""
         try:
-            # Load registered face
-            if not self.download_and_encode_registered_image():
+            # Load registered face (skipped when an enrollment encoding was supplied)
+            if self.registered_encoding is None and not self.download_and_encode_registered_image():
                 return {
                     'success': False,
                     'error': 'Failed to load registered image'
@@ -299,31 +455,38 @@ class FaceRecognitionStream:
             
             logger.info("Starting face recognition stream...")
             
-            frame_count = 0
             max_frames = 600  # 20 seconds at 30fps
+            frames = LatestFrame()
+            stop = threading.Event()
             
-            while frame_count < max_frames and not self.recognition_complete:
-                frame, result = self.process_frame()
-                
-                if frame is None:
-                    continue
-                
-                # Convert frame to base64
-                frame_base64 = self.frame_to_base64(frame)
-                
-                # Output frame and result as JSON
-                output = {
-                    'type': 'frame',
-                    'frame': frame_base64,
-                    'result': result
-                }
-                
-                print(json.dumps(output), flush=True)
-                
-                frame_count += 1
-                
-                # Small delay to control frame rate
-                cv2.waitKey(33)  # ~30fps
+            def stage(loop, *args):
+                # A failing stage ends the whole session instead of hanging it
+                try:
+                    loop(*args)
+                except Exception as e:
+                    logger.error(f"Error in {loop.__name__}: {str(e)}", exc_info=True)
+                finally:
+                    stop.set()
+            
+            threads = [
+                threading.Thread(target=stage, args=(self.capture_loop, frames, stop, max_frames), daemon=True),
+                threading.Thread(target=stage, args=(self.recognition_loop, frames, stop), daemon=True)
+            ]
+            
+            if self.preview_port is not None:
+                self.preview = PreviewServer(self.preview_port, max_fps=self.preview_fps)
+                print(json.dumps({'type': 'preview', 'url': self.preview.url}), flush=True)
+                threads.append(threading.Thread(target=stage, args=(self.output_loop, frames, stop), daemon=True))
+            
+            for thread in threads:
+                thread.start()
+            
+            stop.wait()
+            frames.close()
+            for thread in threads:
+                thread.join(timeout=5)
+            
+            logger.info(f"Encodings computed: {self.encodings_computed}, reused: {self.encodings_reused}")
             
             # Final result
             if self.recognition_complete and self.success:
@@ -333,7 +496,8 @@ class FaceRecognitionStream:
                     'recognized': True,
                     'rollNumber': self.roll_number,
                     'confidence': float(self.best_confidence),
-                    'message': 'Attendance marked successfully'
+                    'message': 'Attendance marked successfully',
+                    'timings': self.stage_stats.summary()
                 }
             else:
                 final_result = {
@@ -342,7 +506,8 @@ class FaceRecognitionStream:
                     'recognized': False,
                     'rollNumber': self.roll_number,
                     'confidence': float(self.best_confidence),
-                    'message': f'Face not recognized. Best confidence: {self.best_confidence*100:.1f}%'
+                    'message': f'Face not recognized. Best confidence: {self.best_confidence*100:.1f}%',
+                    'timings': self.stage_stats.summary()
                 }
             
             print(json.dumps(final_result), flush=True)
@@ -356,6 +521,8 @@ class FaceRecognitionStream:
                 'error': str(e)
             }
         finally:
+            if self.preview:
+                self.preview.close()
             if self.camera:
                 self.camera.release()
                 logger.info("Camera released")
@@ -374,11 +541,24 @@ if __name__ == '__main__':
         registered_image_url = sys.argv[1]
         roll_number = sys.argv[2]
         
+        # Optional 4th argument: JSON {"encoding": [...], "modelVersion": "..."} stored at enrollment
+        enrollment = {}
+        if len(sys.argv) > 4 and sys.argv[4]:
+            try:
+                enrollment = json.loads(sys.argv[4])
+            except ValueError:
+                logger.warning("Ignoring malformed enrollment encoding argument")
+        
         logger.info(f"Starting face recognition for roll number: {roll_number}")
         logger.info(f"Registered image: {registered_image_url}")
         
+        # Optional 5th argument: port for the MJPEG preview (0 picks a free port; omit for headless)
+        preview_port = int(sys.argv[5]) if len(sys.argv) > 5 and sys.argv[5] != '' else None
+        
         # Create and run face recognition
-        recognizer = FaceRecognitionStream(registered_image_url, roll_number)
+        recognizer = FaceRecognitionStream(registered_image_url, roll_number,
+                                           enrollment.get('encoding'), enrollment.get('modelVersion'),
+                                           preview_port=preview_port)
         result = recognizer.run()
         
         if result.get('success'):
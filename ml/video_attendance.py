@@ -0,0 +1,179 @@
+import os
+import sys
+import json
+import time
+import argparse
+from multiprocessing import Pool
+
+import cv2
+import numpy as np
+
+from face_detection import FaceDetector
+from identify_class import EncodingGallery, identify_faces
+
+DEFAULT_SAMPLE_FPS = 1.0
+# A student must be identified in at least this many sampled frames to count as present
+DEFAULT_MIN_SIGHTINGS = 2
+# Gaps longer than this are seeked over instead of grabbed through. A seek lands on the
+# previous keyframe and decodes forward from there, so it only pays off for gaps longer
+# than a typical keyframe interval; at the default 1 fps every gap is grabbed
+SEEK_SECONDS = 2.0
+
+# Set in each worker process by init_worker
+_gallery = None
+_detector = None
+
+
+def probe_video(path):
+    """(frame count, fps) of a video file"""
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        raise ValueError(f"Cannot open video: {path}")
+    frames = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    fps = capture.get(cv2.CAP_PROP_FPS) or 25.0
+    if frames <= 0:
+        # Streamed containers (e.g. MediaRecorder WebM) carry no frame count in the
+        # header - walk the file once instead of sampling nothing
+        frames = 0
+        while capture.grab():
+            frames += 1
+    capture.release()
+    return frames, fps
+
+
+def plan_segments(frames, fps, sample_fps, segments):
+    """Split the sampled frame numbers into contiguous segments, one per task"""
+    step = max(1, int(round(fps / sample_fps)))
+    samples = list(range(0, frames, step))
+    size = max(1, -(-len(samples) // max(1, segments)))
+    return [samples[i:i + size] for i in range(0, len(samples), size)]
+
+
+def init_worker(roll_numbers, matrix, detector_name, scale, upsample):
+    """Runs once per worker process: the gallery arrives as a plain matrix, not re-encoded photos"""
+    global _gallery, _detector
+    _gallery = EncodingGallery(roll_numbers, list(matrix))
+    _detector = FaceDetector(detector_name, scale=scale, upsample=upsample)
+
+
+def process_segment(task):
+    """Identify faces in one segment's sampled frames.
+
+    Only the sampled frames are retrieved and converted to RGB. Frames in
+    between are still decoded by grab() (the FFmpeg backend has no demux-only
+    skip) but never copied out or converted; long gaps are seeked over.
+    """
+    path, frame_numbers, fps = task
+    capture = cv2.VideoCapture(path)
+    seek_frames = int(fps * SEEK_SECONDS)
+    sightings = {}  # roll number -> [count, best confidence, first seen (s)]
+    sampled = 0
+    position = None  # index of the next frame read() would return
+
+    try:
+        for target in frame_numbers:
+            if position is None or target < position or target - position > seek_frames:
+                capture.set(cv2.CAP_PROP_POS_FRAMES, target)
+                position = target
+            while position < target:
+                if not capture.grab():
+                    return sightings, sampled
+                position += 1
+
+            ok, frame = capture.read()
+            position += 1
+            if not ok:
+                break
+            sampled += 1
+
+            rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            for face in identify_faces(_gallery, rgb, _detector):
+                if not face['matched']:
+                    continue
+                entry = sightings.setdefault(face['rollNumber'], [0, 0.0, target / fps])
+                entry[0] += 1
+                entry[1] = max(entry[1], face['confidence'])
+    finally:
+        capture.release()
+
+    return sightings, sampled
+
+
+def video_attendance(path, students, sample_fps=DEFAULT_SAMPLE_FPS, workers=None,
+                     min_sightings=DEFAULT_MIN_SIGHTINGS, detector='hog', scale=1.0, upsample=1):
+    """Everyone from the roster seen in a recorded lecture"""
+    started = time.perf_counter()
+    frames, fps = probe_video(path)
+    if frames == 0:
+        return {'success': False, 'error': 'No frames could be read from the video', 'present': []}
+    workers = workers or os.cpu_count() or 1
+
+    gallery = EncodingGallery.from_students(students)
+    if len(gallery) == 0:
+        return {'success': False, 'error': 'No enrolled encodings for this class', 'present': []}
+
+    # A few segments per worker keeps the pool busy when some segments have more faces
+    segments = plan_segments(frames, fps, sample_fps, workers * 4)
+    tasks = [(path, numbers, fps) for numbers in segments]
+
+    merged = {}
+    sampled = 0
+    with Pool(workers, initializer=init_worker,
+              initargs=(gallery.roll_numbers, gallery.matrix, detector, scale, upsample)) as pool:
+        for done, (sightings, count) in enumerate(pool.imap_unordered(process_segment, tasks), 1):
+            sampled += count
+            for roll_number, (seen, confidence, first_seen) in sightings.items():
+                entry = merged.setdefault(roll_number, [0, 0.0, first_seen])
+                entry[0] += seen
+                entry[1] = max(entry[1], confidence)
+                entry[2] = min(entry[2], first_seen)
+            print(f"Segments done: {done}/{len(tasks)}", file=sys.stderr)
+
+    # Nothing decoded is not the same as nobody present
+    if sampled == 0:
+        return {'success': False, 'error': 'No frames could be decoded from the video', 'present': []}
+
+    present = [
+        {
+            'rollNumber': roll_number,
+            'sightings': seen,
+            'confidence': round(float(confidence), 4),
+            'firstSeen': round(float(first_seen), 1)
+        }
+        for roll_number, (seen, confidence, first_seen) in sorted(merged.items())
+        if seen >= min_sightings
+    ]
+
+    return {
+        'success': True,
+        'durationSeconds': round(frames / fps, 1) if fps else None,
+        'framesSampled': sampled,
+        'gallerySize': len(gallery),
+        'workers': workers,
+        'elapsedSeconds': round(time.perf_counter() - started, 2),
+        'present': present
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Mark attendance from a recorded classroom video')
+    parser.add_argument('video')
+    parser.add_argument('roster', help='JSON file: [{rollNumber, encoding, encodingModel, photo}]')
+    parser.add_argument('--sample-fps', type=float, default=DEFAULT_SAMPLE_FPS)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--min-sightings', type=int, default=DEFAULT_MIN_SIGHTINGS)
+    parser.add_argument('--detector', default='hog')
+    parser.add_argument('--scale', type=float, default=1.0)
+    parser.add_argument('--upsample', type=int, default=1)
+    args = parser.parse_args()
+
+    try:
+        with open(args.roster) as f:
+            students = json.load(f)
+        result = video_attendance(args.video, students, args.sample_fps, args.workers, args.min_sightings,
+                                  args.detector, args.scale, args.upsample)
+        print(json.dumps(result), flush=True)
+        sys.exit(0 if result['success'] else 1)
+    except Exception as e:
+        print(json.dumps({'success': False, 'error': str(e), 'present': []}), flush=True)
+        sys.exit(1)
@@ -16,7 +16,7 @@ const markPresentSchema = new Schema({
     },
     method: {
         type: String,
-        enum: ['face_recognition', 'manual', 'qr_code'],
+        enum: ['face_recognition', 'manual', 'qr_code', 'video'],
         default: 'face_recognition'
     },
     confidence: {
@@ -41,7 +41,51 @@ const markPresentSchema = new Schema({
     },
     room: {
         type: String
+    },
+    // Local calendar day of timestamp (YYYY-MM-DD), so "once per class per day" is indexable
+    day: {
+        type: String
     }
 });
 
+function dayKey(date) {
+    const d = new Date(date);
+    return `${d.getFullYear()}-${String(d.getMonth() + 1).padStart(2, '0')}-${String(d.getDate()).padStart(2, '0')}`;
+}
+
+markPresentSchema.pre('validate', function(next) {
+    this.day = dayKey(this.timestamp || Date.now());
+    next();
+});
+
+// Teacher roll call: one class on one day
+markPresentSchema.index({ subject: 1, time: 1, room: 1, day: 1, timestamp: -1 });
+// Student history and per-day lookups
+markPresentSchema.index({ rollNumber: 1, day: 1 });
+markPresentSchema.index({ rollNumber: 1, timestamp: -1 });
+// A student is marked at most once per class per day; enforced atomically by the insert.
+// Records without class details (or from before `day` existed) are not constrained
+markPresentSchema.index(
+    { rollNumber: 1, subject: 1, time: 1, room: 1, day: 1 },
+    {
+        unique: true,
+        partialFilterExpression: {
+            subject: { $exists: true },
+            time: { $exists: true },
+            room: { $exists: true },
+            day: { $exists: true }
+        }
+    }
+);
+
+markPresentSchema.statics.dayKey = dayKey;
+
+// Duplicate-key errors from the unique index above (also inside bulk inserts)
+markPresentSchema.statics.isDuplicate = function(error) {
+    if (!error) return false;
+    if (error.code === 11000) return true;
+    return Array.isArray(error.writeErrors) && error.writeErrors.length > 0 &&
+        error.writeErrors.every(writeError => (writeError.code || (writeError.err && writeError.err.code)) === 11000);
+};
+
 module.exports = mongoose.model('MarkPresent', markPresentSchema);
\ No newline at end of file
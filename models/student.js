@@ -40,6 +40,20 @@ const studentSchema=new Schema({
     semester:{
         type:String,
         required:true
+    },
+    // 128-d reference encoding computed once at enrollment
+    faceEncoding:{
+        type:[Number],
+        default:undefined
+    },
+    encodingModel:{
+        type:String
+    },
+    // Set when this photo can never be encoded (no face or several faces), so
+    // warm-up skips it until the photo or the encoding model changes
+    faceEncodingError:{
+        photo:String,
+        reason:String
     }
 })
 
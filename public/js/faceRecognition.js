@@ -1,5 +1,22 @@
 // faceRecognition.js - Place in /public/js/
 
+// Client-side frame quality gate, mirroring ml/frame_quality.py
+// Same probe width as the server, so the Laplacian variance is on the same scale
+// and one sharpness threshold means the same thing on both sides
+const QUALITY_PROBE_WIDTH = 160;
+const QUALITY_MIN_BRIGHTNESS = 40;
+const QUALITY_MAX_BRIGHTNESS = 220;
+const QUALITY_MIN_SHARPNESS = 12;
+const QUALITY_RETRY_DELAY = 300; // ms before checking the next frame after a rejected one
+// Until the server sends pacing hints: one frame every 2 s at full camera size, JPEG quality 0.3
+const DEFAULT_PACING = { interval: 2000, maxWidth: 640, quality: 0.3 };
+const QUALITY_HINTS = {
+    too_dark: 'Too dark - move to a brighter spot',
+    overexposed: 'Too bright - avoid facing a light source',
+    blurry: 'Hold still',
+    face_too_small: 'Move closer to the camera'
+};
+
 class FaceRecognitionHandler {
     constructor() {
         this.video = null;
@@ -11,6 +28,12 @@ class FaceRecognitionHandler {
         this.recognitionTimeout = 30; // seconds - increased slightly
         this.intervalId = null;
         this.timeoutId = null;
+        this.probeCanvas = null;
+        this.captureCanvas = null;
+        this.captureWidth = 0;
+        this.captureHeight = 0;
+        // Replaced by the server's pacing hints after every frame
+        this.pacing = { ...DEFAULT_PACING };
     }
 
     initialize(videoElement, canvasElement) {
@@ -83,15 +106,86 @@ class FaceRecognitionHandler {
         this.isRecognizing = false;
     }
 
+    // Same checks as the server's quality gate (ml/frame_quality.py), on a small copy of the frame
+    checkFrameQuality() {
+        if (!this.probeCanvas) {
+            this.probeCanvas = document.createElement('canvas');
+        }
+        // Keep the camera's aspect ratio, as the server's resize does
+        const width = QUALITY_PROBE_WIDTH;
+        const height = this.video.videoWidth
+            ? Math.max(1, Math.floor(this.video.videoHeight * width / this.video.videoWidth))
+            : width * 3 / 4;
+        if (this.probeCanvas.width !== width || this.probeCanvas.height !== height) {
+            this.probeCanvas.width = width;
+            this.probeCanvas.height = height;
+        }
+        const ctx = this.probeCanvas.getContext('2d', { willReadFrequently: true });
+        ctx.drawImage(this.video, 0, 0, width, height);
+        const pixels = ctx.getImageData(0, 0, width, height).data;
+
+        const gray = new Float32Array(width * height);
+        let brightness = 0;
+        for (let i = 0, p = 0; i < gray.length; i++, p += 4) {
+            gray[i] = 0.299 * pixels[p] + 0.587 * pixels[p + 1] + 0.114 * pixels[p + 2];
+            brightness += gray[i];
+        }
+        brightness /= gray.length;
+
+        if (brightness < QUALITY_MIN_BRIGHTNESS) return 'too_dark';
+        if (brightness > QUALITY_MAX_BRIGHTNESS) return 'overexposed';
+
+        // Variance of the 4-neighbour Laplacian over the interior pixels
+        let sum = 0;
+        let sumSquares = 0;
+        let count = 0;
+        for (let y = 1; y < height - 1; y++) {
+            for (let x = 1; x < width - 1; x++) {
+                const i = y * width + x;
+                const laplacian = gray[i - 1] + gray[i + 1] + gray[i - width] + gray[i + width] - 4 * gray[i];
+                sum += laplacian;
+                sumSquares += laplacian * laplacian;
+                count++;
+            }
+        }
+        const mean = sum / count;
+        if (sumSquares / count - mean * mean < QUALITY_MIN_SHARPNESS) return 'blurry';
+        return null;
+    }
+
+    // Resolves to null (and sets lastRejectedReason) for frames not worth uploading
     captureFrame() {
-        const ctx = this.canvas.getContext('2d');
+        this.lastRejectedReason = this.checkFrameQuality();
+        if (this.lastRejectedReason) {
+            return Promise.resolve(null);
+        }
+
+        // Overlay canvas stays at camera size; the upload is scaled to the server's requested width
         this.canvas.width = this.video.videoWidth;
         this.canvas.height = this.video.videoHeight;
+
+        if (!this.captureCanvas) {
+            this.captureCanvas = document.createElement('canvas');
+        }
+        const scale = Math.min(1, this.pacing.maxWidth / this.video.videoWidth);
+        this.captureWidth = Math.round(this.video.videoWidth * scale);
+        this.captureHeight = Math.round(this.video.videoHeight * scale);
+        this.captureCanvas.width = this.captureWidth;
+        this.captureCanvas.height = this.captureHeight;
+        this.captureCanvas.getContext('2d').drawImage(this.video, 0, 0, this.captureWidth, this.captureHeight);
         
-        ctx.drawImage(this.video, 0, 0);
-        
-        // Get base64 image with lower quality for faster processing
-        return this.canvas.toDataURL('image/jpeg', 0.3);
+        // Binary JPEG (no base64 round trip) at the quality the server asked for
+        return new Promise((resolve) => {
+            this.captureCanvas.toBlob((blob) => resolve(blob), 'image/jpeg', this.pacing.quality);
+        });
+    }
+
+    // Follow the server's pacing hints, ignoring anything malformed
+    updatePacing(pacing) {
+        if (!pacing) return;
+        if (pacing.interval > 0) this.pacing.interval = pacing.interval;
+        if (pacing.maxWidth > 0) this.pacing.maxWidth = pacing.maxWidth;
+        if (pacing.quality > 0 && pacing.quality <= 1) this.pacing.quality = pacing.quality;
     }
 
     drawFaceBoundary(result) {
@@ -103,8 +197,9 @@ class FaceRecognitionHandler {
         }
 
         const ctx = this.canvas.getContext('2d');
-        const scaleX = this.canvas.width / this.video.videoWidth;
-        const scaleY = this.canvas.height / this.video.videoHeight;
+        // Boxes are in the coordinates of the (possibly downscaled) uploaded frame
+        const scaleX = this.canvas.width / (this.captureWidth || this.video.videoWidth);
+        const scaleY = this.canvas.height / (this.captureHeight || this.video.videoHeight);
 
         const x = result.x * scaleX;
         const y = result.y * scaleY;
@@ -180,6 +275,31 @@ class FaceRecognitionHandler {
         let frameCount = 0;
         let bestConfidence = 0;
 
+        // The server accumulates the evidence across frames and decides when the check-in is verified
+        let sessionId = null;
+        try {
+            const startResponse = await fetch('/student/verify/start', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ rollNumber: rollNumber })
+            });
+            const started = await startResponse.json();
+            if (!started.success) {
+                throw new Error(started.message);
+            }
+            sessionId = started.session.id;
+            this.requiredMatches = started.session.requiredFrames;
+        } catch (error) {
+            console.error('[Face Recognition] Could not start verification:', error);
+            this.isRecognizing = false;
+            completeCallback({
+                success: false,
+                confidence: 0,
+                message: `Could not start face verification: ${error.message}`
+            });
+            return;
+        }
+
         console.log(`[Face Recognition] Starting recognition process... Required matches: ${this.requiredMatches}`);
 
         // Update timer
@@ -195,10 +315,10 @@ class FaceRecognitionHandler {
             }
         }, 1000);
 
-        // Recognition loop - Process less frequently to reduce system load and improve video smoothness
+        // Recognition loop - paced by the server's hints so uploads track its spare capacity
         let isProcessing = false; // Prevent concurrent requests
         let lastProcessTime = 0;
-        const PROCESS_INTERVAL = 2000; // Process every 2 seconds for smoother video and less CPU load
+        this.pacing = { ...DEFAULT_PACING };
         
         const processFrame = async () => {
             if (!this.isRecognizing) {
@@ -207,112 +327,104 @@ class FaceRecognitionHandler {
 
             const now = Date.now();
             // Skip if already processing or too soon since last process
-            if (isProcessing || (now - lastProcessTime) < PROCESS_INTERVAL) {
+            if (isProcessing || (now - lastProcessTime) < this.pacing.interval) {
                 requestAnimationFrame(processFrame);
                 return;
             }
 
             lastProcessTime = now;
-            frameCount++;
             isProcessing = true;
 
-            // Capture frame
-            const frameData = this.captureFrame();
+            // Capture frame - blurry or badly lit frames are dropped here and retried soon
+            const frameData = await this.captureFrame();
+            if (!frameData) {
+                lastProcessTime = now - this.pacing.interval + QUALITY_RETRY_DELAY;
+                isProcessing = false;
+                progressCallback({
+                    timeLeft: timeLeft,
+                    matchCount: this.matchCount,
+                    hint: QUALITY_HINTS[this.lastRejectedReason]
+                });
+                requestAnimationFrame(processFrame);
+                return;
+            }
+            frameCount++;
 
             try {
                 // Send frame to backend for recognition with longer timeout to prevent frequent timeouts
                 const controller = new AbortController();
                 const timeoutId = setTimeout(() => controller.abort(), 10000); // 10s timeout per request
                 
-                const response = await fetch('/student/recognize-frame', {
+                const response = await fetch(`/student/verify/frame?session=${encodeURIComponent(sessionId)}`, {
                     method: 'POST',
                     headers: {
-                        'Content-Type': 'application/json',
+                        'Content-Type': 'image/jpeg',
                     },
-                    body: JSON.stringify({
-                        rollNumber: rollNumber,
-                        frame: frameData
-                    }),
+                    body: frameData,
                     signal: controller.signal
                 });
 
                 clearTimeout(timeoutId);
                 const result = await response.json();
-                
-                // Debug: Log the full result to see what we're getting
-                console.log('[Face Recognition] Full response:', JSON.stringify(result, null, 2));
+                const session = result.session;
+                this.updatePacing(result.pacing);
+
                 console.log('[Face Recognition] Response details:', {
                     faceDetected: result.faceDetected,
+                    rejectedReason: result.rejectedReason,
                     matched: result.matched,
                     confidence: result.confidence,
                     error: result.error,
-                    currentMatchCount: this.matchCount,
-                    requiredMatches: this.requiredMatches
+                    session: session
                 });
 
-                // Handle timeout errors - don't reset match count
-                if (result.error === 'Process timeout') {
-                    console.log(`[Face Recognition] Timeout occurred, but preserving match count: ${this.matchCount}/${this.requiredMatches}`);
-                    // Don't reset - just continue
+                // Progress is the server's count of matched frames in this session
+                if (session) {
+                    this.matchCount = session.matchedFrames;
+                    bestConfidence = Math.max(bestConfidence, session.bestConfidence);
+                    progressCallback({
+                        timeLeft: timeLeft,
+                        matchCount: this.matchCount,
+                        hint: QUALITY_HINTS[result.rejectedReason]
+                    });
+                }
+
+                // Server is shedding load - skip this frame and wait an extra interval
+                if (result.busy) {
+                    lastProcessTime = Date.now() + this.pacing.interval;
+                    console.log(`[Face Recognition] Server busy, backing off. Match count: ${this.matchCount}/${this.requiredMatches}`);
                 } else if (result.faceDetected) {
                     // Draw face boundary
                     this.drawFaceBoundary(result);
-
-                    if (result.confidence > bestConfidence) {
-                        bestConfidence = result.confidence;
-                    }
-
-                    if (result.matched) {
-                        // Count matches with moderate confidence (0.5 = 50%)
-                        if (result.confidence >= 0.5) {
-                            const previousCount = this.matchCount;
-                            this.matchCount++;
-                            
-                            console.log(`[Face Recognition] ✓ Match detected! Count: ${previousCount} -> ${this.matchCount}/${this.requiredMatches} - Confidence: ${(result.confidence * 100).toFixed(1)}%`);
-                            
-                            // Update UI immediately
-                            progressCallback({
-                                timeLeft: timeLeft,
-                                matchCount: this.matchCount
-                            });
-                            
-                            console.log(`[Face Recognition] Progress callback called with matchCount: ${this.matchCount}`);
-
-                            // Check if recognition complete
-                            if (this.matchCount >= this.requiredMatches) {
-                                clearInterval(timerInterval);
-                                this.isRecognizing = false;
-
-                                console.log(`[Face Recognition] ✅ Recognition complete! Total matches: ${this.matchCount}, Best confidence: ${(bestConfidence * 100).toFixed(1)}%`);
-                                completeCallback({
-                                    success: true,
-                                    confidence: bestConfidence,
-                                    message: 'Face recognized successfully'
-                                });
-                                return;
-                            }
-                        } else {
-                            console.log(`[Face Recognition] Low confidence: ${(result.confidence * 100).toFixed(1)}% (not counting)`);
-                        }
-                        // Don't reset on low confidence - just don't count it
-                    } else {
-                        // Only reset counter if confidence is very low (not just no match)
-                        // This prevents reset on temporary detection issues
-                        if (result.confidence && result.confidence < 0.3) {
-                            this.matchCount = Math.max(0, this.matchCount - 1); // Decrement instead of reset
-                            console.log(`[Face Recognition] Very low confidence, decrementing match count to: ${this.matchCount}`);
-                        } else {
-                            console.log(`[Face Recognition] No match (confidence: ${result.confidence ? (result.confidence * 100).toFixed(1) + '%' : 'N/A'}), preserving match count: ${this.matchCount}`);
-                        }
-                    }
                 } else {
-                    // Don't reset match count on face detection failure - might be temporary
-                    // Only clear canvas
-                    console.log(`[Face Recognition] No face detected, preserving match count: ${this.matchCount}/${this.requiredMatches}`);
+                    // Only clear canvas - a missed face doesn't discard the session's evidence
                     const ctx = this.canvas.getContext('2d');
                     ctx.clearRect(0, 0, this.canvas.width, this.canvas.height);
                 }
 
+                if (!session || session.status !== 'pending') {
+                    clearInterval(timerInterval);
+                    this.isRecognizing = false;
+
+                    if (session && session.status === 'accepted') {
+                        console.log(`[Face Recognition] ✅ Verified after ${session.frames} frame(s), confidence: ${(session.aggregateConfidence * 100).toFixed(1)}%`);
+                        completeCallback({
+                            success: true,
+                            confidence: session.aggregateConfidence,
+                            sessionId: sessionId,
+                            message: 'Face recognized successfully'
+                        });
+                    } else {
+                        const reason = session ? session.reason : (result.error || 'Verification session expired');
+                        completeCallback({
+                            success: false,
+                            confidence: bestConfidence,
+                            message: `${reason}. Best confidence: ${(bestConfidence * 100).toFixed(1)}%`
+                        });
+                    }
+                    return;
+                }
+
             } catch (error) {
                 if (error.name !== 'AbortError') {
                     console.error('[Face Recognition] Frame processing error:', error);
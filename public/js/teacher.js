@@ -12,6 +12,8 @@ document.addEventListener('DOMContentLoaded', function() {
     let accessGranted = false;
     let teacherId = null;
     let lastAttendanceCount = 0;
+    let attendanceStream = null; // EventSource pushing new check-ins
+    let currentAttendance = [];
 
     // Get teacherId from page
     teacherId = document.body.getAttribute('data-teacher-id');
@@ -153,19 +155,61 @@ document.addEventListener('DOMContentLoaded', function() {
     }
 
     function startAttendanceMonitoring() {
-        if (attendanceCheckInterval) {
-            clearInterval(attendanceCheckInterval);
-        }
+        closeAttendanceUpdates();
         loadAttendance();
-        attendanceCheckInterval = setInterval(loadAttendance, 5000);
+
+        // Browsers without Server-Sent Events fall back to polling
+        if (!window.EventSource) {
+            attendanceCheckInterval = setInterval(loadAttendance, 5000);
+            return;
+        }
+
+        const { subject, time, room } = currentSelectedClass;
+        attendanceStream = new EventSource(`/teacher/attendance-stream?subject=${encodeURIComponent(subject)}&time=${encodeURIComponent(time)}&room=${encodeURIComponent(room)}`);
+        attendanceStream.addEventListener('checkin', (event) => {
+            addCheckIn(JSON.parse(event.data));
+        });
+
+        // After a dropped connection, catch up on check-ins missed while disconnected
+        let reconnecting = false;
+        attendanceStream.onerror = () => {
+            reconnecting = true;
+        };
+        attendanceStream.onopen = () => {
+            if (reconnecting) {
+                reconnecting = false;
+                loadAttendance();
+            }
+        };
     }
 
-    function stopAttendanceMonitoring() {
+    function closeAttendanceUpdates() {
         if (attendanceCheckInterval) {
             clearInterval(attendanceCheckInterval);
             attendanceCheckInterval = null;
         }
+        if (attendanceStream) {
+            attendanceStream.close();
+            attendanceStream = null;
+        }
+    }
+
+    function addCheckIn(record) {
+        if (currentAttendance.some(existing => existing._id === record._id)) return;
+
+        currentAttendance.unshift(record);
+        lastAttendanceCount = currentAttendance.length;
+        displayAttendance(currentAttendance);
+        if (presentCountEl) {
+            presentCountEl.textContent = currentAttendance.length;
+        }
+        showNotification(`🎓 ${record.studentName} marked present!`, 'success');
+    }
+
+    function stopAttendanceMonitoring() {
+        closeAttendanceUpdates();
         lastAttendanceCount = 0;
+        currentAttendance = [];
         
         if (studentsGrid) {
             studentsGrid.innerHTML = `
@@ -189,6 +233,8 @@ document.addEventListener('DOMContentLoaded', function() {
             const data = await response.json();
             
             if (data.success) {
+                currentAttendance = data.attendance;
+
                 // Update total students count dynamically
                 if (totalStudentsEl && data.totalStudents !== undefined) {
                     totalStudentsEl.textContent = data.totalStudents;
@@ -2,6 +2,10 @@ const express = require('express');
 const router = express.Router();
 const upload = require('../middleware/cloudinary');
 const studentController = require('../controller/student');
+const { MAX_FRAME_BYTES } = require('../utils/recognitionPool');
+
+// Camera frames are posted as raw JPEG bytes
+const rawFrame = express.raw({ type: 'image/jpeg', limit: MAX_FRAME_BYTES });
 
 router.get('/login', (req, res) => res.render('../views/student/login'));
 router.get('/portal', studentController.getPortal);
@@ -9,7 +13,9 @@ router.post('/portal', studentController.postPortal);
 router.get('/signup', studentController.getSignUp);
 router.post('/signup', upload.single('photo'), studentController.postSignUp);
 router.get('/check-access', studentController.checkAccess);
-router.post('/recognize-frame', studentController.recognizeFrame);
+router.post('/recognize-frame', rawFrame, studentController.recognizeFrame);
+router.post('/verify/start', studentController.startVerification);
+router.post('/verify/frame', rawFrame, studentController.verifyFrame);
 router.post('/save-attendance', studentController.saveAttendance);
 router.get('/recent-attendance', studentController.getRecentAttendance);
 
@@ -1,6 +1,15 @@
 const express = require('express');
+const os = require('os');
+const multer = require('multer');
 const router = express.Router();
 const teacherController = require('../controller/teacher');
+const { MAX_FRAME_BYTES } = require('../utils/recognitionPool');
+
+// Camera frames are posted as raw JPEG bytes
+const rawFrame = express.raw({ type: 'image/jpeg', limit: MAX_FRAME_BYTES });
+
+// Lecture recordings stay on local disk; they are processed and deleted, never uploaded to Cloudinary
+const videoUpload = multer({ dest: os.tmpdir(), limits: { fileSize: 4 * 1024 * 1024 * 1024 } });
 
 // Login route - GET (show login form)
 router.get('/login', (req, res) => {
@@ -26,6 +35,10 @@ router.get('/check-access-status', teacherController.checkAccessStatus);
 
 // Attendance routes
 router.get('/get-attendance-records', teacherController.getAttendanceRecords); // For displaying attendance list
+router.get('/attendance-stream', teacherController.attendanceStream); // Live check-ins (Server-Sent Events)
 router.get('/mark-face-recognition', teacherController.getAttendance); // For face recognition (if needed)
+router.get('/preview/:rollNumber', teacherController.previewStream); // Annotated camera preview of a running recognition
+router.post('/identify-frame', rawFrame, teacherController.identifyFrame); // Classroom camera: identify every face in one frame
+router.post('/video-attendance', videoUpload.single('video'), teacherController.videoAttendance); // Recorded lecture: mark everyone seen
 
 module.exports = router;
\ No newline at end of file
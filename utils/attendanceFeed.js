@@ -0,0 +1,47 @@
+const { EventEmitter } = require('events');
+
+// In-process fan-out of new check-ins to teacher portals (Server-Sent Events)
+const feed = new EventEmitter();
+feed.setMaxListeners(0);
+
+// Keeps proxies from closing idle streams
+const HEARTBEAT_INTERVAL = 25000;
+
+function classKey(subject, time, room) {
+    return JSON.stringify([subject || null, time || null, room || null]);
+}
+
+// Call after a MarkPresent record has been written
+function publishCheckIn(record) {
+    const data = typeof record.toObject === 'function' ? record.toObject() : record;
+    feed.emit(classKey(data.subject, data.time, data.room), data);
+}
+
+// Stream one class's new check-ins to a client until it disconnects
+function subscribe(req, res, { subject, time, room }) {
+    res.set({
+        'Content-Type': 'text/event-stream',
+        'Cache-Control': 'no-cache',
+        'Connection': 'keep-alive',
+        'X-Accel-Buffering': 'no'
+    });
+    res.flushHeaders();
+    res.write('retry: 3000\n\n');
+
+    const key = classKey(subject, time, room);
+    const onCheckIn = (record) => {
+        res.write(`event: checkin\ndata: ${JSON.stringify(record)}\n\n`);
+    };
+    const heartbeat = setInterval(() => res.write(': heartbeat\n\n'), HEARTBEAT_INTERVAL);
+
+    feed.on(key, onCheckIn);
+    req.on('close', () => {
+        clearInterval(heartbeat);
+        feed.off(key, onCheckIn);
+    });
+}
+
+module.exports = {
+    publishCheckIn,
+    subscribe
+};
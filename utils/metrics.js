@@ -0,0 +1,170 @@
+const fs = require('fs');
+
+// Latency buckets (ms) covering cache hits up to cold photo downloads
+const DEFAULT_BUCKETS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000];
+
+// Optional periodic dump of the metrics text for hosts that aren't scraped
+const METRICS_FILE = process.env.METRICS_FILE || '';
+const METRICS_FILE_INTERVAL = 15000;
+
+function labelKey(labels) {
+    return Object.keys(labels).sort().map(name => `${name}="${String(labels[name]).replace(/["\\\n]/g, '_')}"`).join(',');
+}
+
+class Counter {
+    constructor(name, help) {
+        this.name = name;
+        this.help = help;
+        this.values = new Map();
+    }
+
+    inc(labels = {}, value = 1) {
+        const key = labelKey(labels);
+        this.values.set(key, (this.values.get(key) || 0) + value);
+    }
+
+    render() {
+        const lines = [`# HELP ${this.name} ${this.help}`, `# TYPE ${this.name} counter`];
+        this.values.forEach((value, key) => lines.push(`${this.name}{${key}} ${value}`));
+        return lines.join('\n');
+    }
+}
+
+class Histogram {
+    constructor(name, help, buckets = DEFAULT_BUCKETS) {
+        this.name = name;
+        this.help = help;
+        this.buckets = buckets;
+        this.series = new Map();  // label key -> { counts, sum, count }
+    }
+
+    observe(labels, value) {
+        if (typeof value !== 'number' || !isFinite(value)) return;
+        const key = labelKey(labels);
+        let series = this.series.get(key);
+        if (!series) {
+            series = { counts: new Array(this.buckets.length).fill(0), sum: 0, count: 0 };
+            this.series.set(key, series);
+        }
+        const bucket = this.buckets.findIndex(bound => value <= bound);
+        if (bucket !== -1) series.counts[bucket]++;
+        series.sum += value;
+        series.count++;
+    }
+
+    render() {
+        const lines = [`# HELP ${this.name} ${this.help}`, `# TYPE ${this.name} histogram`];
+        this.series.forEach((series, key) => {
+            const prefix = key ? `${key},` : '';
+            let cumulative = 0;
+            this.buckets.forEach((bound, i) => {
+                cumulative += series.counts[i];
+                lines.push(`${this.name}_bucket{${prefix}le="${bound}"} ${cumulative}`);
+            });
+            lines.push(`${this.name}_bucket{${prefix}le="+Inf"} ${series.count}`);
+            lines.push(`${this.name}_sum{${key}} ${series.sum}`);
+            lines.push(`${this.name}_count{${key}} ${series.count}`);
+        });
+        return lines.join('\n');
+    }
+}
+
+// Gauges are read when rendered, so they never go stale
+class Gauge {
+    constructor(name, help, read) {
+        this.name = name;
+        this.help = help;
+        this.read = read;
+    }
+
+    render() {
+        return [`# HELP ${this.name} ${this.help}`, `# TYPE ${this.name} gauge`, `${this.name} ${this.read()}`].join('\n');
+    }
+}
+
+class Registry {
+    constructor() {
+        this.metrics = [];
+        this.fileTimer = null;
+    }
+
+    counter(name, help) {
+        return this.register(new Counter(name, help));
+    }
+
+    histogram(name, help, buckets) {
+        return this.register(new Histogram(name, help, buckets));
+    }
+
+    gauge(name, help, read) {
+        return this.register(new Gauge(name, help, read));
+    }
+
+    register(metric) {
+        this.metrics.push(metric);
+        return metric;
+    }
+
+    render() {
+        return this.metrics.map(metric => metric.render()).join('\n') + '\n';
+    }
+
+    startFileExport() {
+        if (!METRICS_FILE || this.fileTimer) return;
+        this.fileTimer = setInterval(() => {
+            fs.writeFile(METRICS_FILE, this.render(), (err) => {
+                if (err) console.error('[Metrics] Error writing metrics file:', err.message);
+            });
+        }, METRICS_FILE_INTERVAL);
+        this.fileTimer.unref();
+    }
+}
+
+const registry = new Registry();
+
+const recognitionRequests = registry.counter(
+    'recognition_requests_total',
+    'Recognition requests by operation and outcome'
+);
+const recognitionDuration = registry.histogram(
+    'recognition_request_duration_ms',
+    'End-to-end recognition latency in the Node process, from enqueue to result'
+);
+const recognitionStageDuration = registry.histogram(
+    'recognition_stage_duration_ms',
+    'Per-stage recognition latency (queue, worker round trip and the Python stages)'
+);
+
+function outcomeOf(result) {
+    if (result.busy) return 'busy';
+    if (result.error === 'Process timeout') return 'timeout';
+    if (result.error) return 'error';
+    if (result.rejectedReason) return 'rejected';
+    if (result.faces) return 'identified';
+    if ('matched' in result) return result.matched ? 'matched' : 'unmatched';
+    if (result.faceDetected === false) return 'no_face';
+    return 'ok';
+}
+
+// Record one finished request; stage timings are in milliseconds
+function recordRecognition(op, result, timings) {
+    recognitionRequests.inc({ op, outcome: outcomeOf(result) });
+    if (timings.total !== undefined) {
+        recognitionDuration.observe({ op }, timings.total);
+    }
+    Object.keys(timings).forEach(stage => {
+        if (stage !== 'total') recognitionStageDuration.observe({ op, stage }, timings[stage]);
+    });
+}
+
+// GET /metrics in the Prometheus text exposition format
+function metricsHandler(req, res) {
+    res.set('Content-Type', 'text/plain; version=0.0.4');
+    res.send(registry.render());
+}
+
+module.exports = {
+    registry,
+    recordRecognition,
+    metricsHandler
+};
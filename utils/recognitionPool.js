@@ -0,0 +1,474 @@
+const { spawn } = require('child_process');
+const os = require('os');
+const path = require('path');
+const readline = require('readline');
+const { registry, recordRecognition } = require('./metrics');
+
+// Allow configuring Python path via environment variable
+// Prioritize conda environment Python for this project
+const PYTHON_PATH = process.env.PYTHON_PATH ||
+    '/opt/anaconda3/envs/project/bin/python3' ||
+    (process.platform === 'darwin' ? '/Users/krishna/.pyenv/shims/python3' : 'python3') ||
+    'python3';
+
+const WORKER_SCRIPT = path.join(__dirname, '../ml/compare_frame.py');
+
+// Largest JPEG frame accepted from the browser
+const MAX_FRAME_BYTES = '5mb';
+
+// Pool configuration (overridable via environment)
+// One worker per core: recognition is CPU-bound and each worker is single-threaded
+const POOL_SIZE = parseInt(process.env.RECOGNITION_WORKERS) || os.cpus().length;
+// Compare requests are sent to a worker in micro-batches of up to BATCH_SIZE frames;
+// a partial batch is held at most BATCH_MAX_WAIT ms for more frames to arrive
+const BATCH_SIZE = parseInt(process.env.RECOGNITION_BATCH_SIZE) || 4;
+const BATCH_MAX_WAIT = process.env.RECOGNITION_BATCH_WAIT_MS !== undefined
+    ? parseInt(process.env.RECOGNITION_BATCH_WAIT_MS) || 0
+    : 10;
+// Past this many queued requests new ones are turned away instead of timing out later
+const MAX_QUEUE = parseInt(process.env.RECOGNITION_MAX_QUEUE) || POOL_SIZE * BATCH_SIZE * 4;
+// Reference photos per warm-up request; small enough that live frames interleave
+const WARM_CHUNK_SIZE = 8;
+const REQUEST_TIMEOUT = parseInt(process.env.RECOGNITION_TIMEOUT_MS) || 12000;
+// Photo downloads (warm-up, enrollment, a gallery built from a roster) get longer;
+// the worker's own fetch timeouts stay well inside it so a slow photo fails the
+// request instead of getting the worker killed
+const BACKGROUND_TIMEOUT = parseInt(process.env.RECOGNITION_BACKGROUND_TIMEOUT_MS) || 60000;
+// Pacing hints sent with every frame result, by estimated queue wait (ms) for a new frame:
+// idle workers invite faster, sharper frames; a backlog slows clients down and shrinks uploads
+const PACING_LEVELS = [
+    { maxWait: 0, interval: 800, maxWidth: 640, quality: 0.5 },
+    { maxWait: 500, interval: 1500, maxWidth: 480, quality: 0.4 },
+    { maxWait: 2000, interval: 2500, maxWidth: 400, quality: 0.35 },
+    { maxWait: Infinity, interval: 4000, maxWidth: 320, quality: 0.3 }
+];
+// Weight of the newest frame in the moving average of compare latency,
+// and the latency assumed before any frame has been measured
+const LATENCY_SMOOTHING = 0.2;
+const INITIAL_FRAME_LATENCY = 500;
+const HEALTH_CHECK_INTERVAL = 15000;
+const HEALTH_CHECK_TIMEOUT = 5000;
+const MAX_RESTART_DELAY = 30000;
+
+function requestTimeout(payload) {
+    const background = payload.op === 'warm' || payload.op === 'enroll' ||
+        (payload.op === 'identify' && payload.students);
+    return background ? BACKGROUND_TIMEOUT : REQUEST_TIMEOUT;
+}
+
+// A single long-lived compare_frame.py --worker process
+class RecognitionWorker {
+    constructor(pool, index) {
+        this.pool = pool;
+        this.index = index;
+        this.process = null;
+        this.ready = false;
+        this.busy = false;
+        this.current = null;      // { id, jobs } - the batch being processed
+        this.pendingPing = null;  // { id, timer }
+        this.restarts = 0;
+        this.stopped = false;
+    }
+
+    start() {
+        this.ready = false;
+        this.busy = false;
+
+        const python = spawn(PYTHON_PATH, ['-u', '-W', 'ignore::UserWarning', WORKER_SCRIPT, '--worker']);
+        this.process = python;
+
+        // Writes racing a crash would otherwise surface as an unhandled EPIPE
+        python.stdin.on('error', () => {});
+
+        readline.createInterface({ input: python.stdout }).on('line', (line) => this.onMessage(line));
+
+        // Suppress stderr warnings (only log real errors)
+        python.stderr.on('data', (data) => {
+            const errorMsg = data.toString();
+            if (!errorMsg.includes('pkg_resources is deprecated')) {
+                console.error(`[Recognition Worker ${this.index}]`, errorMsg.trim());
+            }
+        });
+
+        python.on('exit', (code, signal) => {
+            if (this.process !== python) return;
+            this.onExit(code, signal);
+        });
+
+        python.on('error', (error) => {
+            console.error(`[Recognition Worker ${this.index}] Spawn error:`, error.message);
+            console.error(`[Recognition Worker ${this.index}] Python path:`, PYTHON_PATH);
+        });
+    }
+
+    onMessage(line) {
+        let message;
+        try {
+            message = JSON.parse(line);
+        } catch (e) {
+            console.error(`[Recognition Worker ${this.index}] Unparseable output:`, line.substring(0, 200));
+            return;
+        }
+
+        if (message.type === 'ready') {
+            this.ready = true;
+            this.restarts = 0;
+            this.pool.modelVersion = message.modelVersion || this.pool.modelVersion;
+            console.log(`[Recognition Worker ${this.index}] Ready (pid ${message.pid})`);
+            this.pool.dispatch();
+        } else if (message.type === 'pong') {
+            if (this.pendingPing && this.pendingPing.id === message.id) {
+                clearTimeout(this.pendingPing.timer);
+                this.pendingPing = null;
+                this.pool.dispatch();
+            }
+        } else if (message.type === 'result') {
+            const batch = this.current;
+            if (!batch || batch.id !== message.id) return;
+
+            this.current = null;
+            this.busy = false;
+            const results = message.results || [message.result];
+            batch.jobs.forEach((job, i) => {
+                job.resolve(results[i] || { faceDetected: false, error: 'Missing result' });
+            });
+            this.pool.dispatch();
+        }
+    }
+
+    onExit(code, signal) {
+        this.ready = false;
+        this.busy = false;
+
+        if (this.pendingPing) {
+            clearTimeout(this.pendingPing.timer);
+            this.pendingPing = null;
+        }
+
+        if (this.current) {
+            this.current.jobs.forEach(job => job.resolve({ faceDetected: false, error: 'Worker crashed' }));
+            this.current = null;
+        }
+
+        if (this.stopped) return;
+
+        // Restart with exponential backoff so a broken environment doesn't spin
+        const delay = Math.min(1000 * Math.pow(2, this.restarts), MAX_RESTART_DELAY);
+        this.restarts++;
+        console.error(`[Recognition Worker ${this.index}] Exited (code ${code}, signal ${signal}) - restarting in ${delay}ms`);
+        setTimeout(() => {
+            if (!this.stopped) this.start();
+        }, delay);
+    }
+
+    send(message) {
+        this.process.stdin.write(JSON.stringify(message) + '\n');
+    }
+
+    run(jobs) {
+        this.busy = true;
+        const now = Date.now();
+        jobs.forEach(job => {
+            job.worker = this;
+            job.started = now;
+        });
+
+        if (jobs.length === 1) {
+            const job = jobs[0];
+            this.current = { id: job.id, jobs };
+
+            // Frames travel as raw JPEG bytes after the JSON header line
+            const { frame, ...header } = job.payload;
+            if (Buffer.isBuffer(frame)) {
+                this.send(Object.assign({ id: job.id, frameBytes: frame.length }, header));
+                this.process.stdin.write(frame);
+            } else {
+                this.send(Object.assign({ id: job.id }, job.payload));
+            }
+            return;
+        }
+
+        // A batch header lists every item; the frames follow back to back in the same order
+        const id = this.pool.nextId();
+        this.current = { id, jobs };
+        const frames = [];
+        const items = jobs.map(job => {
+            const { op, frame, ...item } = job.payload;
+            const bytes = Buffer.isBuffer(frame) ? frame : Buffer.alloc(0);
+            frames.push(bytes);
+            return Object.assign(item, { frameBytes: bytes.length });
+        });
+        this.send({ id, op: 'batch', items });
+        this.process.stdin.write(Buffer.concat(frames));
+    }
+
+    abort(job) {
+        if (!this.current || !this.current.jobs.includes(job)) return;
+        // A stuck interpreter can't be trusted with the next frame - kill and respawn it
+        console.error(`[Recognition Worker ${this.index}] Request timeout - killing process`);
+        this.current.jobs.forEach(other => other.resolve({ faceDetected: false, error: 'Process timeout' }));
+        this.current = null;
+        this.kill();
+    }
+
+    healthCheck() {
+        if (!this.ready || this.busy || this.pendingPing) return;
+
+        const id = this.pool.nextId();
+        this.pendingPing = {
+            id,
+            timer: setTimeout(() => {
+                console.error(`[Recognition Worker ${this.index}] Health check failed - restarting`);
+                this.pendingPing = null;
+                this.kill();
+            }, HEALTH_CHECK_TIMEOUT)
+        };
+        this.send({ id, op: 'ping' });
+    }
+
+    kill() {
+        if (this.process) {
+            this.process.kill('SIGKILL');
+        }
+    }
+
+    stop() {
+        this.stopped = true;
+        this.kill();
+    }
+}
+
+// Fixed-size pool of recognition workers with a bounded FIFO request queue
+class RecognitionPool {
+    constructor(size) {
+        this.size = size;
+        this.workers = [];
+        this.queue = [];
+        this.counter = 0;
+        this.healthTimer = null;
+        this.batchTimer = null;
+        this.modelVersion = null;  // encoding model the workers produce, reported when they start
+        this.frameLatency = null;  // moving average of a compare job's worker time (ms)
+    }
+
+    start() {
+        if (this.workers.length) return;
+
+        for (let i = 0; i < this.size; i++) {
+            const worker = new RecognitionWorker(this, i);
+            this.workers.push(worker);
+            worker.start();
+        }
+
+        this.healthTimer = setInterval(() => {
+            this.workers.forEach(worker => worker.healthCheck());
+        }, HEALTH_CHECK_INTERVAL);
+        this.healthTimer.unref();
+
+        console.log(`[Recognition Pool] Started ${this.size} worker(s), batches of up to ${BATCH_SIZE}`);
+    }
+
+    stop() {
+        clearInterval(this.healthTimer);
+        clearTimeout(this.batchTimer);
+        this.workers.forEach(worker => worker.stop());
+        this.workers = [];
+    }
+
+    nextId() {
+        this.counter = (this.counter + 1) % Number.MAX_SAFE_INTEGER;
+        return this.counter;
+    }
+
+    run(payload, target = null) {
+        this.start();
+
+        // Backpressure: a request that would only wait out its timeout in the
+        // queue is refused now so the client can back off
+        if (!target && this.queue.length >= MAX_QUEUE) {
+            const result = { faceDetected: false, busy: true, error: 'Server busy' };
+            recordRecognition(payload.op, result, {});
+            return Promise.resolve(result);
+        }
+
+        return new Promise((resolve) => {
+            const job = { id: this.nextId(), payload, target, worker: null, enqueued: Date.now(), started: null };
+            let settled = false;
+            // Every outcome (result, crash, timeout) ends here exactly once
+            job.resolve = (result) => {
+                if (settled) return;
+                settled = true;
+                clearTimeout(job.timer);
+
+                // Node-side stages around the worker's own per-stage timings (all ms)
+                const now = Date.now();
+                const timings = Object.assign({ queue: (job.started || now) - job.enqueued }, result.timings);
+                if (job.started) timings.worker = now - job.started;
+                timings.total = now - job.enqueued;
+                result.timings = timings;
+
+                if (payload.op === 'compare' && job.started && !result.error) {
+                    this.frameLatency = this.frameLatency === null ? timings.worker
+                        : this.frameLatency + LATENCY_SMOOTHING * (timings.worker - this.frameLatency);
+                }
+                recordRecognition(payload.op, result, timings);
+                resolve(result);
+            };
+
+            // Frames keep the 12 s budget the per-frame spawn had, counted from enqueue
+            job.timer = setTimeout(() => {
+                if (job.worker) {
+                    job.worker.abort(job);
+                } else {
+                    const index = this.queue.indexOf(job);
+                    if (index !== -1) this.queue.splice(index, 1);
+                }
+                job.resolve({ faceDetected: false, error: 'Process timeout' });
+            }, requestTimeout(payload));
+
+            this.queue.push(job);
+            this.dispatch();
+        });
+    }
+
+    // How a browser should pace and size its next frame under the current load
+    pacing() {
+        const ready = this.workers.filter(worker => worker.ready);
+        const idle = ready.some(worker => !worker.busy) && this.queue.length === 0;
+        const latency = this.frameLatency === null ? INITIAL_FRAME_LATENCY : this.frameLatency;
+
+        // A new frame waits for the batches ahead of it to clear the ready workers
+        let wait = 0;
+        if (!idle) {
+            const batchesAhead = Math.floor(this.queue.length / (Math.max(1, ready.length) * BATCH_SIZE)) + 1;
+            wait = ready.length ? batchesAhead * latency : Infinity;
+        }
+
+        const level = PACING_LEVELS.find(candidate => wait <= candidate.maxWait);
+        return {
+            // Never ask for frames faster than a worker can turn one around
+            interval: Math.max(level.interval, Math.round(latency)),
+            maxWidth: level.maxWidth,
+            quality: level.quality
+        };
+    }
+
+    // 1:N identification against a section gallery; the roster is only sent
+    // to a worker that doesn't already hold this gallery
+    async identify(gallery, frame) {
+        const result = await this.run({ op: 'identify', galleryKey: gallery.key, frame });
+        if (!result.galleryMissing) return result;
+
+        return this.run({
+            op: 'identify',
+            galleryKey: gallery.key,
+            section: gallery.section,
+            students: gallery.students,
+            frame
+        });
+    }
+
+    // Fetch and encode [{ rollNumber, url }] reference photos ahead of a class.
+    // At most one chunk per worker runs at a time, leaving one worker free for live frames
+    async warm(students) {
+        const chunks = [];
+        for (let i = 0; i < students.length; i += WARM_CHUNK_SIZE) {
+            chunks.push(students.slice(i, i + WARM_CHUNK_SIZE));
+        }
+
+        const encodings = [];
+        const failed = [];
+        const rejected = [];
+        let modelVersion = this.modelVersion;
+        const concurrency = Math.max(1, this.size - 1);
+        for (let i = 0; i < chunks.length; i += concurrency) {
+            const batch = chunks.slice(i, i + concurrency);
+            const results = await Promise.all(batch.map(chunk => this.run({ op: 'warm', students: chunk })));
+            results.forEach((result, j) => {
+                if (result.encodings) {
+                    encodings.push(...result.encodings);
+                    failed.push(...result.failed);
+                    rejected.push(...(result.rejected || []));
+                    modelVersion = result.modelVersion || modelVersion;
+                } else {
+                    failed.push(...batch[j].map(student => student.rollNumber));
+                }
+            });
+        }
+        return { encodings, failed, rejected, modelVersion };
+    }
+
+    // Drop a cached reference encoding in every worker (e.g. after a photo re-upload)
+    invalidate(url) {
+        return Promise.all(this.workers.map(worker => this.run({ op: 'invalidate', url }, worker)));
+    }
+
+    dispatch() {
+        clearTimeout(this.batchTimer);
+        this.batchTimer = null;
+
+        const idle = (worker) => worker.ready && !worker.busy && !worker.pendingPing;
+        const batchable = (job) => !job.target && job.payload.op === 'compare';
+        let holding = false;
+
+        for (let i = 0; i < this.queue.length;) {
+            const job = this.queue[i];
+            const worker = job.target ? (idle(job.target) ? job.target : null) : this.workers.find(idle);
+            if (!worker) {
+                i++;
+                continue;
+            }
+            if (!batchable(job)) {
+                this.queue.splice(i, 1);
+                worker.run([job]);
+                continue;
+            }
+            if (holding) {
+                i++;
+                continue;
+            }
+
+            // Jobs before i were dispatched or are targeted, so the batch starts at job
+            const batch = this.queue.filter(batchable).slice(0, BATCH_SIZE);
+            const wait = job.enqueued + BATCH_MAX_WAIT - Date.now();
+            if (batch.length < BATCH_SIZE && wait > 0) {
+                holding = true;
+                this.batchTimer = setTimeout(() => this.dispatch(), wait);
+                i++;
+                continue;
+            }
+
+            this.queue = this.queue.filter(queued => !batch.includes(queued));
+            worker.run(batch);
+        }
+    }
+}
+
+const recognitionPool = new RecognitionPool(POOL_SIZE);
+
+registry.gauge('recognition_queue_depth', 'Requests waiting for a recognition worker',
+    () => recognitionPool.queue.length);
+registry.gauge('recognition_workers_ready', 'Recognition workers currently running',
+    () => recognitionPool.workers.filter(worker => worker.ready).length);
+registry.gauge('recognition_workers_busy', 'Recognition workers currently processing a request',
+    () => recognitionPool.workers.filter(worker => worker.busy).length);
+
+// Frames arrive as a raw JPEG body; older clients still post a JSON data URL,
+// which is unpacked here once so workers only ever see bytes
+function frameFromRequest(req) {
+    if (Buffer.isBuffer(req.body) && req.body.length) {
+        return req.body;
+    }
+    const frame = req.body && req.body.frame;
+    if (typeof frame === 'string' && frame.length) {
+        return Buffer.from(frame.substring(frame.indexOf(',') + 1), 'base64');
+    }
+    return null;
+}
+
+module.exports = {
+    PYTHON_PATH,
+    MAX_FRAME_BYTES,
+    frameFromRequest,
+    recognitionPool
+};
@@ -0,0 +1,143 @@
+const crypto = require('crypto');
+
+// Verification policy (overridable via environment)
+// Matched frames whose mean embedding must clear ACCEPT_CONFIDENCE before a check-in is accepted
+const MIN_FRAMES = parseInt(process.env.VERIFY_MIN_FRAMES) || 2;
+const ACCEPT_CONFIDENCE = parseFloat(process.env.VERIFY_ACCEPT_CONFIDENCE) || 0.55;
+// A session that hasn't accepted after this many frames with a face is rejected
+const MAX_FRAMES = parseInt(process.env.VERIFY_MAX_FRAMES) || 12;
+const SESSION_TTL = 2 * 60 * 1000;
+// Largest allowed drop of the per-frame confidence across the last frames at accept time
+const MAX_CONFIDENCE_DROP = 0.1;
+// Probe encodings closer than this to the previous one come from the same pixels
+const IDENTICAL_DISTANCE = 1e-3;
+
+const sessions = new Map();
+
+function distance(a, b) {
+    let sum = 0;
+    for (let i = 0; i < a.length; i++) {
+        const d = a[i] - b[i];
+        sum += d * d;
+    }
+    return Math.sqrt(sum);
+}
+
+// Per-student check-in state kept on the server between camera frames
+class VerificationSession {
+    constructor(rollNumber) {
+        this.id = crypto.randomUUID();
+        this.rollNumber = rollNumber;
+        this.created = Date.now();
+        this.frameHashes = new Set();
+        this.sum = null;           // running sum of matched probe embeddings
+        this.count = 0;            // embeddings in sum
+        this.frames = 0;           // frames in which a face was found
+        this.confidences = [];     // per-frame confidence, oldest first
+        this.aggregateConfidence = 0;
+        this.bestConfidence = 0;
+        this.lastEncoding = null;
+        this.status = 'pending';   // pending | accepted | rejected
+        this.reason = null;
+    }
+
+    get expired() {
+        return Date.now() - this.created > SESSION_TTL;
+    }
+
+    // Byte-identical uploads are replays; caught before any recognition work
+    isReplay(frame) {
+        const hash = crypto.createHash('sha1').update(frame).digest('hex');
+        if (this.frameHashes.has(hash)) return true;
+        this.frameHashes.add(hash);
+        return false;
+    }
+
+    // What the worker needs to score the running mean together with the new probe
+    aggregate() {
+        return { sum: this.sum, count: this.count };
+    }
+
+    get trend() {
+        const recent = this.confidences.slice(-3);
+        return recent.length > 1 ? recent[recent.length - 1] - recent[0] : 0;
+    }
+
+    update(result) {
+        if (this.status !== 'pending' || !result.faceDetected || !result.encoding) return;
+
+        this.frames++;
+        this.confidences.push(result.confidence);
+        this.bestConfidence = Math.max(this.bestConfidence, result.confidence);
+
+        const encoding = result.encoding;
+        const identical = this.lastEncoding && distance(this.lastEncoding, encoding) < IDENTICAL_DISTANCE;
+        this.lastEncoding = encoding;
+
+        if (!result.matched) {
+            // Someone else (or nobody recognisable) - evidence so far no longer applies
+            this.sum = null;
+            this.count = 0;
+            this.aggregateConfidence = 0;
+        } else if (!identical) {
+            this.sum = this.sum ? this.sum.map((v, i) => v + encoding[i]) : encoding.slice();
+            this.count++;
+            this.aggregateConfidence = result.aggregateConfidence;
+        }
+
+        if (this.count >= MIN_FRAMES && this.aggregateConfidence >= ACCEPT_CONFIDENCE &&
+            this.trend >= -MAX_CONFIDENCE_DROP) {
+            this.status = 'accepted';
+        } else if (this.frames >= MAX_FRAMES) {
+            this.status = 'rejected';
+            this.reason = 'Face not verified';
+        }
+    }
+
+    view() {
+        return {
+            id: this.id,
+            status: this.status,
+            reason: this.reason,
+            frames: this.frames,
+            matchedFrames: this.count,
+            requiredFrames: MIN_FRAMES,
+            aggregateConfidence: this.aggregateConfidence,
+            bestConfidence: this.bestConfidence,
+            trend: this.trend
+        };
+    }
+}
+
+function createSession(rollNumber) {
+    for (const [id, session] of sessions) {
+        if (session.expired) sessions.delete(id);
+    }
+    const session = new VerificationSession(rollNumber);
+    sessions.set(session.id, session);
+    return session;
+}
+
+function getSession(id) {
+    const session = sessions.get(id);
+    if (!session) return null;
+    if (session.expired) {
+        sessions.delete(id);
+        return null;
+    }
+    return session;
+}
+
+// An accepted session can be redeemed for one attendance record
+function consumeSession(id, rollNumber) {
+    const session = getSession(id);
+    if (!session || session.status !== 'accepted' || session.rollNumber !== rollNumber) return null;
+    sessions.delete(id);
+    return session;
+}
+
+module.exports = {
+    createSession,
+    getSession,
+    consumeSession
+};